@@ -0,0 +1,153 @@
+"""
+Offline benchmarks of the dataset-search workflow.
+
+Runs the real extract, assemble, submit, watch and ingest commands
+against a synthetic metadata store and a stand-in SearchClient (see
+standins.py), for an increasing number of datasets, and reports the
+wall time, throughput, database queries, Search API calls and peak
+Python memory of each stage.
+
+    python -m benchmarks.run --sizes 10,100,1000,10000 --json results.json
+"""
+import io
+import os
+import json
+import time
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+
+import click
+
+from gdex_globus_search import extractor, assembler, submitter, watcher, ingester
+from gdex_globus_search.lib import database, search
+
+from .standins import SyntheticMetadataStore, StandInSearchClient
+
+INDEX_ID = "00000000-0000-0000-0000-000000000000"
+
+# Number of datasets run through `ingest --in-memory` one at a time
+INGEST_SAMPLE = 10
+
+def install(store, client, directory):
+    """
+    Point lib.database and lib.search at the stand-ins, and at a new
+    sqlite3 configuration database in the given directory.
+    """
+    database.close_db_connections()
+    database.DBConnectionPool._connect = lambda pool: store.connect(pool.database)
+
+    database.SQLITE_STORAGE = os.path.join(directory, "config.db")
+    if hasattr(database.config_storage_adapter, "_instance"):
+        database.config_storage_adapter._instance.close()
+        del database.config_storage_adapter._instance
+    database.config_storage_adapter().store_config("index_info", {"index_id": INDEX_ID})
+
+    search.search_client._instance = client
+
+def run_stage(name, command, args, store, client, num_items, measure_memory):
+    """ Run a click command and return its measurements """
+    queries = store.queries
+    calls = dict(client.calls)
+    if measure_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        command.main(args, standalone_mode=False)
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if measure_memory else None
+    if measure_memory:
+        tracemalloc.stop()
+
+    return {
+        "stage": name,
+        "items": num_items,
+        "wall_s": round(wall, 4),
+        "items_per_s": round(num_items / wall, 1) if wall else None,
+        "queries": store.queries - queries,
+        "api_calls": {k: client.calls[k] - calls[k] for k in calls if client.calls[k] != calls[k]},
+        "peak_mb": round(peak / 2**20, 2) if peak is not None else None,
+    }
+
+def benchmark(num_datasets, ingest_latency, task_latency, workers, measure_memory):
+    """ Run every stage for one synthetic store of num_datasets datasets """
+    with tempfile.TemporaryDirectory() as directory:
+        store = SyntheticMetadataStore(directory, num_datasets)
+        client = StandInSearchClient(ingest_latency, task_latency)
+        install(store, client, directory)
+        dsids = store.dsids()
+        extracted = os.path.join(directory, "extracted")
+        assembled = os.path.join(directory, "assembled")
+        watched = os.path.join(directory, "watch")
+
+        results = [
+            run_stage("extract", extractor.extract,
+                      ["--all", "--output", extracted, "--force"],
+                      store, client, len(dsids), measure_memory),
+            run_stage("assemble", assembler.assemble,
+                      ["--directory", extracted, "--output", assembled, "--force"],
+                      store, client, len(dsids), measure_memory),
+            run_stage("submit", submitter.submit,
+                      ["--directory", assembled, "--force", "--workers", str(workers)],
+                      store, client, len(dsids), measure_memory),
+            run_stage("watch", watcher.watch,
+                      ["--output", watched, "--max-wait", "3600"],
+                      store, client, len(dsids), measure_memory),
+        ]
+
+        sample = dsids[:INGEST_SAMPLE]
+        ingest_results = [run_stage("ingest", ingester.ingest, ["--dsid", dsid, "--in-memory", "--force"],
+                                    store, client, 1, measure_memory)
+                          for dsid in sample]
+        if ingest_results:
+            results.append({
+                "stage": f"ingest --in-memory (x{len(sample)})",
+                "items": len(sample),
+                "wall_s": round(sum(r["wall_s"] for r in ingest_results), 4),
+                "items_per_s": round(len(sample) / sum(r["wall_s"] for r in ingest_results), 1),
+                "queries": sum(r["queries"] for r in ingest_results),
+                "api_calls": {k: sum(r["api_calls"].get(k, 0) for r in ingest_results)
+                              for k in client.calls if any(k in r["api_calls"] for r in ingest_results)},
+                "peak_mb": max(r["peak_mb"] for r in ingest_results) if measure_memory else None,
+            })
+
+        database.close_db_connections()
+
+    for result in results:
+        result["datasets"] = num_datasets
+    return results
+
+def format_table(results):
+    header = f"{'datasets':>8}  {'stage':<26} {'items':>6} {'wall s':>9} {'items/s':>9} {'queries':>8} {'peak MB':>8}  api calls"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        peak = f"{r['peak_mb']:>8.2f}" if r["peak_mb"] is not None else f"{'-':>8}"
+        calls = ", ".join(f"{k}={v}" for k, v in r["api_calls"].items())
+        lines.append(f"{r['datasets']:>8}  {r['stage']:<26} {r['items']:>6} {r['wall_s']:>9.3f} "
+                     f"{r['items_per_s'] or 0:>9.1f} {r['queries']:>8} {peak}  {calls}")
+    return "\n".join(lines)
+
+@click.command(help="Benchmark the dataset-search workflow against offline stand-ins.")
+@click.option("--sizes", default="10,100,1000", show_default=True,
+              help="Comma-delimited numbers of synthetic datasets to benchmark.")
+@click.option("--ingest-latency", type=float, default=0.05, show_default=True,
+              help="Seconds each stand-in ingest request takes.")
+@click.option("--task-latency", type=float, default=0.5, show_default=True,
+              help="Seconds from submission until a stand-in task succeeds.")
+@click.option("--workers", type=int, default=submitter.SUBMIT_WORKERS, show_default=True,
+              help="Number of concurrent submit workers.")
+@click.option("--no-memory", is_flag=True,
+              help="Do not trace peak memory, which slows down each stage.")
+@click.option("--json", "json_output", type=click.Path(dir_okay=False), default=None,
+              help="Also write the results to this JSON file.")
+def main(sizes, ingest_latency, task_latency, workers, no_memory, json_output):
+    results = []
+    for size in (int(s) for s in sizes.split(",")):
+        results += benchmark(size, ingest_latency, task_latency, workers, not no_memory)
+    click.echo(format_table(results))
+    if json_output:
+        with open(json_output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+if __name__ == "__main__":
+    main()
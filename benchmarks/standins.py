@@ -0,0 +1,292 @@
+"""
+Stand-ins for the NCAR metadata databases and the Globus Search service,
+so the real dataset-search code paths can be benchmarked offline.
+
+SyntheticMetadataStore generates N datasets into SQLite databases with
+the tables read by extractor.py, and serves them through connections
+that look enough like psycopg connections for lib.database.  The few
+PostgreSQL-specific constructs used by the extractor queries are
+translated to SQLite.  StandInSearchClient models ingest and task
+latencies, and counts API calls.
+"""
+import os
+import re
+import json
+import uuid
+import time
+import random
+import sqlite3
+import threading
+
+from gdex_globus_search import extractor
+
+SCHEMAS = {
+    'search': (
+        "CREATE TABLE datasets (dsid TEXT, type TEXT, title TEXT, summary TEXT, pub_date TEXT, ai_ready TEXT)",
+        "CREATE TABLE data_types (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE gcmd_variables (dsid TEXT, topic TEXT, term TEXT, keyword TEXT)",
+        "CREATE TABLE time_resolutions (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE platforms_new (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE gcmd_platforms (uuid TEXT, path TEXT)",
+        "CREATE TABLE grid_resolutions (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE topics (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE projects_new (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE supported_projects (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE gcmd_projects (uuid TEXT, path TEXT)",
+        "CREATE TABLE formats (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE instruments (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE gcmd_instruments (uuid TEXT, path TEXT)",
+        "CREATE TABLE locations_new (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE gcmd_locations (uuid TEXT, path TEXT, last_in_path TEXT)",
+        "CREATE TABLE contributors_new (dsid TEXT, keyword TEXT)",
+        "CREATE TABLE gcmd_providers (uuid TEXT, path TEXT)",
+    ),
+    'dssdb': (
+        "CREATE TABLE dsvrsn (dsid TEXT, doi TEXT, status TEXT)",
+        "CREATE TABLE dsperiod (dsid TEXT, date_start TEXT, time_start TEXT, "
+        "date_end TEXT, time_end TEXT, time_zone TEXT)",
+    ),
+    'wagtail': (
+        "CREATE TABLE dataset_description_datasetdescriptionpage (dsid TEXT, update_freq TEXT, volume TEXT)",
+    ),
+}
+
+# Tables keyed by dsid, which are indexed on it like the real tables
+DSID_TABLES = {
+    'search': ('datasets', 'data_types', 'gcmd_variables', 'time_resolutions', 'platforms_new',
+               'grid_resolutions', 'topics', 'projects_new', 'supported_projects', 'formats',
+               'instruments', 'locations_new', 'contributors_new'),
+    'dssdb': ('dsvrsn', 'dsperiod'),
+    'wagtail': ('dataset_description_datasetdescriptionpage',),
+}
+
+# jsonb columns, which are returned parsed by psycopg
+JSON_COLUMNS = {'volume'}
+
+# Number of entries in each GCMD vocabulary table
+VOCABULARY_SIZE = 50
+
+def select_columns(sql):
+    """ Return the column names selected by one of the extractor queries """
+    select_list = re.match(r"SELECT (.*?) FROM ", sql).group(1)
+    return [re.split(r"[. ]", col.strip())[-1] for col in select_list.split(", ")]
+
+def translate(sql):
+    """ Translate the PostgreSQL-specific parts of the extractor queries to SQLite """
+    sql = re.sub(r"= ANY\(ARRAY\[(.*?)\]\)", r"IN (\1)", sql)
+    sql = re.sub(r"CONCAT\(([\w.]+), ' ', ([\w.]+)\)", r"(\1 || ' ' || \2)", sql)
+    for name, query in extractor.SEARCH_QUERIES.items():
+        fields = ", ".join(f"'{col}', q.{col}" for col in select_columns(query))
+        sql = re.sub(
+            rf"\(SELECT json_agg\(q ORDER BY ([\w, ]+)\) FROM q_{name} AS q\)",
+            rf"(SELECT CASE WHEN count(*) THEN json_group_array(json_object({fields})) END "
+            rf"FROM (SELECT * FROM q_{name} ORDER BY \1) AS q)",
+            sql,
+        )
+    return sql
+
+class StandInCursor:
+    def __init__(self, conn, store):
+        self._cursor = conn.cursor()
+        self._store = store
+        self._aggregated = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def execute(self, sql, params=None):
+        self._store.count_query()
+        # as are the json_agg columns of the combined search metadata query
+        self._aggregated = sql.startswith("WITH ")
+        self._cursor.execute(translate(sql), params or ())
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def _convert(self, rows):
+        decode = [self._aggregated or col[0] in JSON_COLUMNS for col in self.description or ()]
+        if not any(decode):
+            return rows
+        return [tuple(json.loads(v) if d and isinstance(v, str) else v for d, v in zip(decode, row))
+                for row in rows]
+
+    def fetchall(self):
+        return self._convert(self._cursor.fetchall())
+
+    def fetchmany(self, size):
+        return self._convert(self._cursor.fetchmany(size))
+
+class StandInConnection:
+    """ A SQLite connection with the parts of the psycopg connection API used by lib.database """
+
+    def __init__(self, path, store):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._store = store
+        self.autocommit = True
+        self.closed = False
+
+    def cursor(self):
+        return StandInCursor(self._conn, self._store)
+
+    def close(self):
+        self._conn.close()
+        self.closed = True
+
+class SyntheticMetadataStore:
+    """
+    :param directory: Directory in which the SQLite databases are written.
+    :param num_datasets: Number of datasets to generate.
+    :param seed: Random seed, so the same store is generated on every run.
+
+    About 10% of the generated datasets have an unsupported type ('W'), as
+    in the real search database.
+    """
+
+    def __init__(self, directory, num_datasets, seed=0):
+        self.directory = directory
+        self.num_datasets = num_datasets
+        self.queries = 0
+        self._lock = threading.Lock()
+        self._generate(random.Random(seed))
+
+    def path(self, database_name):
+        return os.path.join(self.directory, f"{database_name}.db")
+
+    def dsids(self, supported_only=True):
+        return [dsid for dsid, dataset_type in self._types.items()
+                if not supported_only or dataset_type in extractor.SUPPORTED_TYPES]
+
+    def count_query(self):
+        with self._lock:
+            self.queries += 1
+
+    def connect(self, database_name):
+        return StandInConnection(self.path(database_name), self)
+
+    def _generate(self, rng):
+        rows = {name: [] for tables in DSID_TABLES.values() for name in tables}
+        vocabularies = {
+            'gcmd_platforms': [(str(uuid.UUID(int=rng.getrandbits(128))), f"Platform > {i}")
+                               for i in range(VOCABULARY_SIZE)],
+            'gcmd_projects': [(str(uuid.UUID(int=rng.getrandbits(128))), f"Project > {i}")
+                              for i in range(VOCABULARY_SIZE)],
+            'gcmd_instruments': [(str(uuid.UUID(int=rng.getrandbits(128))), f"Instrument > {i}")
+                                 for i in range(VOCABULARY_SIZE)],
+            'gcmd_locations': [(str(uuid.UUID(int=rng.getrandbits(128))), f"Continent > Location {i}",
+                                f"Location {i}") for i in range(VOCABULARY_SIZE)],
+            'gcmd_providers': [(str(uuid.UUID(int=rng.getrandbits(128))), f"Provider > {i}")
+                               for i in range(VOCABULARY_SIZE)],
+        }
+
+        def pick(table, k):
+            return [entry[0] for entry in rng.sample(vocabularies[table], k)]
+
+        self._types = {}
+        for i in range(self.num_datasets):
+            dsid = f"d{100000 + i:06d}"
+            dataset_type = 'W' if rng.random() < 0.1 else rng.choice(extractor.SUPPORTED_TYPES)
+            self._types[dsid] = dataset_type
+            year = rng.randint(1950, 2020)
+            rows['datasets'].append((dsid, dataset_type, f"Synthetic dataset {dsid}",
+                                     f"<p>Summary of {dsid}. " + "Lorem ipsum dolor sit amet. " * rng.randint(5, 60) + "</p>",
+                                     f"{year + 1}-01-15", rng.choice(('Y', 'N'))))
+            rows['data_types'] += [(dsid, kw) for kw in rng.sample(('grid', 'platform_observation', 'station'), rng.randint(1, 2))]
+            for v in range(rng.randint(1, 8)):
+                rows['gcmd_variables'].append((dsid, f"TOPIC{v % 3}", f"TERM{v % 5}", f"VARIABLE{v}"))
+            rows['time_resolutions'] += [(dsid, f"T: {kw}") for kw in rng.sample(('Hourly', 'Daily', 'Monthly'), rng.randint(1, 2))]
+            rows['platforms_new'] += [(dsid, kw) for kw in pick('gcmd_platforms', rng.randint(0, 3))]
+            rows['grid_resolutions'] += [(dsid, f"H: {rng.choice((0.25, 0.5, 1.0))} degree")]
+            rows['topics'].append((dsid, "climatologyMeteorologyAtmosphere"))
+            rows['projects_new'] += [(dsid, kw) for kw in pick('gcmd_projects', rng.randint(0, 2))]
+            rows['supported_projects'] += [(dsid, kw) for kw in pick('gcmd_projects', rng.randint(0, 2))]
+            rows['formats'] += [(dsid, kw) for kw in rng.sample(('netCDF', 'GRIB2', 'ASCII'), rng.randint(1, 2))]
+            rows['instruments'] += [(dsid, kw) for kw in pick('gcmd_instruments', rng.randint(0, 2))]
+            rows['locations_new'] += [(dsid, kw) for kw in pick('gcmd_locations', rng.randint(1, 4))]
+            rows['contributors_new'] += [(dsid, kw) for kw in pick('gcmd_providers', rng.randint(1, 3))]
+            rows['dsvrsn'].append((dsid, f"10.5065/{dsid}", 'A'))
+            rows['dsperiod'] += [(dsid, f"{year}-01-01", "00:00:00", f"{year + p}-12-31", "24:00:00", "+0000")
+                                 for p in range(1, rng.randint(2, 4))]
+            rows['dataset_description_datasetdescriptionpage'].append(
+                (dsid, rng.choice(('Monthly', 'Yearly', None)), json.dumps({'full': f"{rng.randint(1, 999)} GB"})))
+
+        for database_name, statements in SCHEMAS.items():
+            path = self.path(database_name)
+            if os.path.exists(path):
+                os.remove(path)
+            conn = sqlite3.connect(path)
+            for sql in statements:
+                conn.execute(sql)
+            for table in DSID_TABLES[database_name]:
+                conn.execute(f"CREATE INDEX {table}_dsid ON {table} (dsid)")
+                if rows[table]:
+                    placeholders = ", ".join("?" * len(rows[table][0]))
+                    conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows[table])
+            if database_name == 'search':
+                for table, entries in vocabularies.items():
+                    placeholders = ", ".join("?" * len(entries[0]))
+                    conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", entries)
+            conn.commit()
+            conn.close()
+
+class StandInSearchClient:
+    """
+    :param ingest_latency: Time (in seconds) each ingest or delete request takes.
+    :param task_latency: Time (in seconds) from submission until a task succeeds.
+
+    Implements the SearchClient methods used by submit, watch and ingest,
+    and counts calls to each of them in ``calls``.
+    """
+
+    def __init__(self, ingest_latency=0.0, task_latency=0.0):
+        self.ingest_latency = ingest_latency
+        self.task_latency = task_latency
+        self.calls = {'ingest': 0, 'delete_subject': 0, 'get_task': 0, 'get_task_list': 0}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.calls[name] += 1
+
+    def _submit(self, index_id):
+        time.sleep(self.ingest_latency)
+        task_id = str(uuid.uuid4())
+        with self._lock:
+            self._tasks[task_id] = {"index_id": index_id, "submitted": time.monotonic()}
+        return {"task_id": task_id, "acknowledged": True}
+
+    def _task(self, task_id):
+        task = self._tasks[task_id]
+        done = time.monotonic() >= task["submitted"] + self.task_latency
+        return {
+            "task_id": task_id,
+            "state": "SUCCESS" if done else "PROGRESS",
+            "index_id": task["index_id"],
+            "creation_date": "2025-01-01T00:00:00Z",
+            "completion_date": "2025-01-01T00:00:00Z" if done else None,
+            "message": "",
+            "additional_details": {},
+        }
+
+    def ingest(self, index_id, data):
+        self._count('ingest')
+        return self._submit(index_id)
+
+    def delete_subject(self, index_id, subject):
+        self._count('delete_subject')
+        return self._submit(index_id)
+
+    def get_task(self, task_id):
+        self._count('get_task')
+        return self._task(task_id)
+
+    def get_task_list(self, index_id, query_params=None):
+        self._count('get_task_list')
+        # the Search API lists the 1000 most recent tasks of an index
+        with self._lock:
+            task_ids = [task_id for task_id, task in self._tasks.items() if task["index_id"] == index_id]
+        return {"tasks": [self._task(task_id) for task_id in task_ids[-1000:]]}
@@ -6,21 +6,38 @@ import click
 
 from .lib import (ASSEMBLED_OUTPUT, 
                   EXTRACTED_OUTPUT, 
-                  all_filenames, 
+                  DEFAULT_FORMAT,
+                  all_datafiles, 
                   common_options, 
-                  prettyprint_json
+                  format_option,
+                  is_ndjson,
+                  file_extension,
+                  open_data_file,
+                  dump_record,
+                  read_records,
+                  config_storage_adapter,
+                  configured_index_id,
 )
+from .lib.fingerprint import is_unchanged
+from .lib.profiling import timed
+from .lib.history import count, track_run
 
 import logging
 logger = logging.getLogger(__name__)
 
-MAX_BATCH_SIZE = 10
+# Target size in bytes of each ingest document, as serialized for the
+# Globus Search ingest API.  Ingest payloads are limited to 10 MB, so the
+# default leaves some headroom.  The entry count is only a secondary cap.
+MAX_BATCH_BYTES = 9 * 1024 * 1024
+MAX_BATCH_SIZE = 1000
 
-def build_entries(datafile):
-    # read data
-    with open(datafile) as fp:
-        data = json.load(fp)
+# Size of an ingest document with no entries, and of the separator
+# between entries in the gmeta list
+GMETA_ENVELOPE_BYTES = len(json.dumps({"ingest_type": "GMetaList", "ingest_data": {"gmeta": []}}))
+GMETA_SEPARATOR_BYTES = len(", ")
 
+@timed("assemble.build_entries")
+def build_entries(data):
     entry_data = {k: v for k, v in data.items()}
     subject = entry_data['dataset_id']
     visibility = ['public']
@@ -31,13 +48,69 @@ def build_entries(datafile):
             "content": entry_data,
     }
 
-def flush_batch(entry_batch, docid, output_directory):
+def iter_entries(filenames, adapter=None, index_id=None, skipped=None):
+    """
+    Build ingest entries from extracted metadata files in any format,
+    one dataset at a time.
+
+    If an adapter and index_id are given, entries for datasets unchanged
+    since they were last ingested are skipped, and their subjects are
+    appended to the skipped list.
+    """
+    for filename in filenames:
+        for data in read_records(filename):
+            entry = build_entries(data)
+            if is_unchanged(adapter, index_id, entry["subject"], entry["content"]):
+                if skipped is not None:
+                    skipped.append(entry["subject"])
+                continue
+            yield entry
+
+def iter_batches(entries, max_bytes=MAX_BATCH_BYTES, max_size=MAX_BATCH_SIZE):
+    """
+    Group a stream of ingest entries into batches, yielding each batch
+    when adding the next entry would take its serialized GMetaList over
+    max_bytes, or its entry count over max_size.  Only one batch is held
+    in memory at a time.
+    """
+    batch = []
+    batch_bytes = GMETA_ENVELOPE_BYTES
+    for entry in entries:
+        entry_bytes = len(json.dumps(entry).encode("utf-8"))
+        if batch and (batch_bytes + GMETA_SEPARATOR_BYTES + entry_bytes > max_bytes
+                      or len(batch) >= max_size):
+            yield batch
+            batch = []
+            batch_bytes = GMETA_ENVELOPE_BYTES
+
+        if GMETA_ENVELOPE_BYTES + entry_bytes > max_bytes:
+            logger.warning(f"ingest entry for {entry['subject']} is {entry_bytes} bytes, "
+                           f"larger than the maximum ingest document size of {max_bytes} bytes")
+        if batch:
+            batch_bytes += GMETA_SEPARATOR_BYTES
+        batch.append(entry)
+        batch_bytes += entry_bytes
+
+    if batch:
+        yield batch
+
+def gmeta_list(entry_batch):
+    """ Return an ingest document for a batch of entries """
+    return {"ingest_type": "GMetaList", "ingest_data": {"gmeta": entry_batch}}
+
+def batch_file(output_directory, docid, fmt=DEFAULT_FORMAT):
+    # all ingest documents are appended to a single file in ndjson format
+    if is_ndjson(fmt):
+        return os.path.join(output_directory, "ingest_docs" + file_extension(fmt))
+    return os.path.join(output_directory, f"ingest_doc_{docid}" + file_extension(fmt))
+
+@timed("assemble.flush_batch")
+def flush_batch(entry_batch, docid, output_directory, fmt=DEFAULT_FORMAT):
     os.makedirs(output_directory, exist_ok=True)
-    fname = os.path.join(output_directory, f"ingest_doc_{docid}.json")
-    with open(fname, "w") as fp:
-        prettyprint_json(
-            {"ingest_type": "GMetaList", "ingest_data": {"gmeta": entry_batch}}, fp
-        )
+    fname = batch_file(output_directory, docid, fmt)
+    mode = "a" if is_ndjson(fmt) else "w"
+    with open_data_file(fname, mode) as fp:
+        dump_record(gmeta_list(entry_batch), fp, fmt)
 
 @click.command(
     help="Annotate data and prepare it for ingest into a Globus Search index.\n"
@@ -64,24 +137,51 @@ def flush_batch(entry_batch, docid, output_directory):
     help="Absolute path to the directory, "
     "where the assembled metadata should be written.",
 )
+@click.option(
+    "--force",
+    default=False,
+    is_flag=True,
+    help="Assemble entries even for datasets unchanged since they were last ingested.",
+)
+@click.option(
+    "--max-batch-bytes",
+    default=MAX_BATCH_BYTES,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Target maximum size in bytes of each ingest document.",
+)
+@click.option(
+    "--max-batch-size",
+    default=MAX_BATCH_SIZE,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Maximum number of entries in each ingest document.",
+)
+@format_option
 @common_options
-def assemble(directory, output, clean):
+@track_run("assemble")
+def assemble(directory, output, clean, force, max_batch_bytes, max_batch_size, fmt):
     if clean:
         shutil.rmtree(output, ignore_errors=True)
+    elif is_ndjson(fmt) and os.path.exists(batch_file(output, None, fmt)):
+        # ingest documents are appended to this file, start it afresh
+        os.remove(batch_file(output, None, fmt))
 
-    entry_docs = []
-    for filename in all_filenames(directory, '*.json'):
-        entry_docs.append(build_entries(filename))
+    adapter = index_id = None
+    if not force:
+        adapter = config_storage_adapter()
+        index_id = configured_index_id()
 
-    current_doc_id = 0
-    batch = []
-    for entry in entry_docs:
-        if len(batch) >= MAX_BATCH_SIZE:
-            flush_batch(batch, current_doc_id, output)
-            batch = []
-            current_doc_id += 1
-        batch.append(entry)
-    flush_batch(batch, current_doc_id, output)
+    skipped = []
+    entries = iter_entries(all_datafiles(directory), adapter, index_id, skipped)
+    for docid, batch in enumerate(iter_batches(entries, max_batch_bytes, max_batch_size)):
+        flush_batch(batch, docid, output, fmt)
+        count("datasets", len(batch))
+        count("documents")
+    count("datasets_skipped", len(skipped))
+
+    if skipped:
+        click.echo(f"skipped {len(skipped)} datasets unchanged since last ingest (use '--force' to override)")
 
     click.echo("ingest document assembly complete")
     click.echo(f"results visible in\n  {output}")
\ No newline at end of file
@@ -1,214 +1,229 @@
 import os
 import shutil
 from time import time
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 
 from .lib import (
     EXTRACTED_OUTPUT, 
     GDEX_DOMAIN, 
+    DEFAULT_FORMAT,
     common_options, 
+    format_option,
+    is_ndjson,
+    file_extension,
+    open_data_file,
+    dump_record,
+    config_storage_adapter,
+    configured_index_id,
     validate_dsid,
-    prettyprint_json, 
+    validate_dsid_file,
     strip_html_tags
 )
-from .lib.database import load_db
-from rda_python_common.PgDBI import pgget, pgmget
+from .lib.database import db_connection, dbget, dbmget
+from .lib.fingerprint import is_unchanged
+from .lib.profiling import span, timed
+from .lib.history import count, track_run
 
 import logging
 logger = logging.getLogger(__name__)
 
-def get_search_metadata(dsid):
-    """ Query and return search metadata """
-
-    load_db('search')
-    cond = f"dsid='{dsid}'"
-    search_metadata = {}
-
-    # Dataset type ('P' or 'H', public or historical).  Other dataset types
-    # should be ignored and not ingested ('W', 'I', etc.).
-    dataset_type = pgget('datasets', 'type', cond)
-    if dataset_type['type'] not in ['P', 'H']:
-        logger.warning(f"Dataset type '{dataset_type['type']}' is not supported for dsid {dsid} (it must be 'P' or 'H').")
-        logger.warning("Skipping metadata extraction for this dataset.")
-        click.echo(f"Dataset type '{dataset_type['type']}' is not supported for dsid {dsid} (it must be 'P' or 'H').")
-        click.echo("Skipping metadata extraction for this dataset.")
-        raise click.Abort()
-    else:
-        search_metadata.update({'dataset_type': dataset_type['type']})
-
-    # Dataset title and summary
-    myrec = pgget('datasets', 'title, summary', cond)
-    description = strip_html_tags(myrec['summary'])
-    search_metadata.update({'title': myrec['title'], 'description': description})
-
-    # Data type (grid, platform_observation, etc.)
-    data_types = pgmget('data_types', 'DISTINCT(keyword) as data_type', cond)
-    search_metadata.update({'data_type': data_types['data_type']})
-
-    # GCMD variables
-    gcmd_keywords = pgmget('gcmd_variables', 'topic,term,keyword', cond)
-    topics = gcmd_keywords['topic']
-    terms = gcmd_keywords['term']
-    keywords = gcmd_keywords['keyword']
-
-    search_metadata.update({'gcmd_category': 'EARTH SCIENCE'})
-    search_metadata.update({'gcmd_topics': sorted(list(set(topics)))})
-    search_metadata.update({'gcmd_terms': sorted(list(set(terms)))})
-    search_metadata.update({'gcmd_variables': sorted(list(set(keywords)))})
-    search_metadata.update({'gcmd_topics_and_terms': sorted(list(set(topics + terms)))})
-
-    # Time resolutions
-    time_resolutions = pgmget('time_resolutions', 'DISTINCT(keyword) as time_resolutions', cond)
-    if not time_resolutions:
-        search_metadata.update({'time_resolution': None})
-    else:
-        search_metadata.update({'time_resolution': time_resolutions['time_resolutions']})
-
-    # Platforms
-    platform_query = f"SELECT path " \
-        f"FROM platforms_new AS p " \
-        f"LEFT JOIN gcmd_platforms AS g " \
-        f"ON g.uuid = p.keyword " \
-        f"WHERE p.dsid = '{dsid}'"
-    platforms = pgmget(None, None, platform_query)
-    if not platforms:
-        search_metadata.update({'platform': None})
-    else:
-        search_metadata.update({'platform': platforms['path']})
-
-    # Grid resolutions (gridded datasets only)
-    grid_resolutions = pgmget('grid_resolutions', 'keyword', cond)
-    if not grid_resolutions:
-        search_metadata.update({'spatial_resolution': None})
-    else:
-        search_metadata.update({'spatial_resolution': grid_resolutions['keyword']})
-    
-    # ISO topic
-    topic = pgget('topics', 'keyword', cond)
-    search_metadata.update({'topic': topic['keyword']})
-
-    # "Collected from" projects (projects that produced the data)
-    project_query = f"SELECT path " \
-        f"FROM projects_new AS p " \
-        f"LEFT JOIN gcmd_projects AS g " \
-        f"ON g.uuid = p.keyword " \
-        f"WHERE p.dsid = '{dsid}'"
-    projects = pgmget(None, None, project_query)
-    if not projects:
-        search_metadata.update({'project': None})
-    else:
-        search_metadata.update({'project': projects['path']})
-
-    # Projects supported by the data
-    supported_projects_query = f"SELECT path " \
-        f"FROM supported_projects AS p " \
-        f"LEFT JOIN gcmd_projects AS g " \
-        f"ON g.uuid = p.keyword " \
-        f"WHERE p.dsid = '{dsid}'"
-    supported_projects = pgmget(None, None, supported_projects_query)
-    if not supported_projects:
-        search_metadata.update({'supports_project': None})
-    else:
-        search_metadata.update({'supports_project': supported_projects['path']})
-
-    # Data formats
-    formats = pgmget('formats', 'DISTINCT(keyword) as format', cond)
-    if not formats:
-        search_metadata.update({'format': None})
-    else:
-        search_metadata.update({'format': formats['format']})
-
-    # Observation instruments
-    instruments_query = f"SELECT path " \
-        f"FROM instruments AS i " \
-        f"LEFT JOIN gcmd_instruments AS g " \
-        f"ON g.uuid = i.keyword " \
-        f"WHERE i.dsid = '{dsid}'"
-    instruments = pgmget(None, None, instruments_query)
-    if not instruments:
-        search_metadata.update({'instrument': None})
-    else:
-        search_metadata.update({'instrument': instruments['path']})
-    
-    # GCMD locations
-    location_query = f"SELECT path, last_in_path " \
-        f"FROM locations_new AS l " \
-        f"LEFT JOIN gcmd_locations AS g " \
-        f"ON g.uuid = l.keyword " \
-        f"WHERE l.dsid = '{dsid}'"
-    locations = pgmget(None, None, location_query)
-    if not locations:
-        search_metadata.update({'gcmd_location_path': None})
-        search_metadata.update({'location': None})
-    else:
-        search_metadata.update({'gcmd_location_path': locations['path']})
-        search_metadata.update({'location': locations['last_in_path']})
-
-    # Data contributors
-    contributor_query = f"SELECT path " \
-        f"FROM contributors_new AS c " \
-        f"LEFT JOIN gcmd_providers AS g " \
-        f"ON g.uuid = c.keyword " \
-        f"WHERE c.dsid = '{dsid}'"
-    contributors = pgmget(None, None, contributor_query)
-    if not contributors:
-        search_metadata.update({'data_contributors': None})
-    else:
-        search_metadata.update({'data_contributors': contributors['path']})
-
-    # Publication date
-    pub_date = pgget('datasets', 'pub_date', cond)
-    search_metadata.update({'publication_date': pub_date['pub_date'].strftime("%Y-%m-%d")})
-
-    # Tags
-    ai_tag = pgget('datasets', 'ai_ready', cond)
+# Queries for each metadata table in the 'search' database.  Each query
+# selects the dsid along with the metadata columns so that rows for many
+# datasets can be fetched at once and grouped by dsid.  The main table is
+# always aliased as 't' so the same dsid condition applies to every query.
+# Every query ends with an ORDER BY on its output columns, so the rows, and
+# the lists built from them, come back in the same order on every run and
+# the metadata fingerprint does not change unless the metadata does.
+SEARCH_QUERIES = {
+    'datasets': "SELECT t.dsid, t.type, t.title, t.summary, t.pub_date, t.ai_ready "
+        "FROM datasets AS t WHERE {cond} ORDER BY dsid",
+    'data_types': "SELECT t.dsid, t.keyword FROM data_types AS t WHERE {cond} "
+        "ORDER BY dsid, keyword",
+    'gcmd_variables': "SELECT t.dsid, t.topic, t.term, t.keyword FROM gcmd_variables AS t "
+        "WHERE {cond} ORDER BY dsid, topic, term, keyword",
+    'time_resolutions': "SELECT t.dsid, t.keyword FROM time_resolutions AS t WHERE {cond} "
+        "ORDER BY dsid, keyword",
+    'platforms': "SELECT t.dsid, g.path FROM platforms_new AS t "
+        "LEFT JOIN gcmd_platforms AS g ON g.uuid = t.keyword WHERE {cond} ORDER BY dsid, path",
+    'grid_resolutions': "SELECT t.dsid, t.keyword FROM grid_resolutions AS t WHERE {cond} "
+        "ORDER BY dsid, keyword",
+    'topics': "SELECT t.dsid, t.keyword FROM topics AS t WHERE {cond} ORDER BY dsid, keyword",
+    'projects': "SELECT t.dsid, g.path FROM projects_new AS t "
+        "LEFT JOIN gcmd_projects AS g ON g.uuid = t.keyword WHERE {cond} ORDER BY dsid, path",
+    'supported_projects': "SELECT t.dsid, g.path FROM supported_projects AS t "
+        "LEFT JOIN gcmd_projects AS g ON g.uuid = t.keyword WHERE {cond} ORDER BY dsid, path",
+    'formats': "SELECT t.dsid, t.keyword FROM formats AS t WHERE {cond} ORDER BY dsid, keyword",
+    'instruments': "SELECT t.dsid, g.path FROM instruments AS t "
+        "LEFT JOIN gcmd_instruments AS g ON g.uuid = t.keyword WHERE {cond} ORDER BY dsid, path",
+    'locations': "SELECT t.dsid, g.path, g.last_in_path FROM locations_new AS t "
+        "LEFT JOIN gcmd_locations AS g ON g.uuid = t.keyword WHERE {cond} "
+        "ORDER BY dsid, path, last_in_path",
+    'contributors': "SELECT t.dsid, g.path FROM contributors_new AS t "
+        "LEFT JOIN gcmd_providers AS g ON g.uuid = t.keyword WHERE {cond} ORDER BY dsid, path",
+}
+
+# Queries for metadata in the 'dssdb' database.  dsperiod rows are ordered
+# by start date, as the first row of a dataset gives its temporal coverage.
+DSSDB_QUERIES = {
+    'dsvrsn': "SELECT t.dsid, t.doi FROM dsvrsn AS t WHERE t.status='A' AND {cond} "
+        "ORDER BY dsid, doi",
+    'dsperiod': "SELECT t.dsid, "
+        "MIN(CONCAT(t.date_start, ' ', t.time_start)) AS date_start, "
+        "MAX(CONCAT(t.date_end, ' ', t.time_end)) AS date_end, "
+        "t.time_zone "
+        "FROM dsperiod AS t "
+        "WHERE {cond} GROUP BY t.dsid, t.time_zone "
+        "ORDER BY dsid, date_start, date_end, time_zone",
+}
+
+# Queries for metadata in the 'wagtail' database
+WAGTAIL_QUERIES = {
+    'description': "SELECT t.dsid, t.update_freq, t.volume "
+        "FROM dataset_description_datasetdescriptionpage AS t WHERE {cond} "
+        "ORDER BY dsid, update_freq, volume",
+}
+
+# Dataset types supported by the search index ('P' or 'H', public or
+# historical).  Other dataset types ('W', 'I', etc.) are not ingested.
+SUPPORTED_TYPES = ('P', 'H')
+
+def dsid_condition(dsids):
+    """ Return a SQL condition on column t.dsid matching any of the given dsids """
+    return "t.dsid = ANY(ARRAY[{}])".format(", ".join(f"'{dsid}'" for dsid in dsids))
+
+def search_metadata_query(dsid):
+    """
+    Return a single SQL statement that selects the rows of every
+    SEARCH_QUERIES table for one dataset.  Each table is a CTE, and its
+    rows are aggregated into one JSON array column named after the table,
+    so all search metadata for the dataset is returned in one round trip.
+    The ORDER BY of each query orders its rows within the aggregate.
+    """
+    cond = f"t.dsid = '{dsid}'"
+    ctes = []
+    columns = []
+    for name, sql in SEARCH_QUERIES.items():
+        sql, _, order = sql.format(cond=cond).partition(" ORDER BY ")
+        ctes.append(f"q_{name} AS ({sql})")
+        columns.append(f"(SELECT json_agg(q ORDER BY {order}) FROM q_{name} AS q) AS {name}")
+    return f"WITH {', '.join(ctes)} SELECT {', '.join(columns)}"
+
+def group_by_dsid(records):
+    """
+    Group the column lists returned by dbmget into a dict of row dicts
+    keyed by dsid, keeping the rows for each dsid in query order.
+    """
+    grouped = {}
+    if not records:
+        return grouped
+    columns = list(records)
+    for values in zip(*(records[col] for col in columns)):
+        row = dict(zip(columns, values))
+        grouped.setdefault(row['dsid'], []).append(row)
+    return grouped
+
+def fetch_grouped(conn, queries, cond):
+    """ Run each query with the given condition and return its rows grouped by dsid """
+    return {name: group_by_dsid(dbmget(conn, sql.format(cond=cond)))
+            for name, sql in queries.items()}
+
+def fetch_grouped_from(database, queries, cond):
+    """ Run fetch_grouped on a pooled connection to the given database """
+    with span(f"extract.{database}"), db_connection(database) as conn:
+        return fetch_grouped(conn, queries, cond)
+
+def rows_for(grouped, dsid):
+    """ Return the rows for one dsid from each table in a fetch_grouped result """
+    return {name: rows.get(dsid, []) for name, rows in grouped.items()}
+
+def column(rows, name):
+    """ Return the values of one column from a list of row dicts """
+    return [row[name] for row in rows]
+
+def distinct(values):
+    """ Return the distinct values in sorted order, as with SQL DISTINCT """
+    return sorted(set(values), key=lambda v: (v is None, v))
+
+def format_date(value):
+    """
+    Format a date as YYYY-MM-DD.  Dates aggregated into a JSON result
+    are returned as ISO 8601 strings rather than date objects.
+    """
+    if isinstance(value, str):
+        return value[:10]
+    return value.strftime("%Y-%m-%d")
+
+def build_search_metadata(rows):
+    """
+    Build the search metadata for one dataset from its rows in each
+    of the SEARCH_QUERIES tables.
+    """
+    dataset = rows['datasets'][0]
+    gcmd = rows['gcmd_variables']
+    topics = column(gcmd, 'topic')
+    terms = column(gcmd, 'term')
+    keywords = column(gcmd, 'keyword')
+    topic = rows['topics'][0]['keyword'] if rows['topics'] else None
     tags = []
-    if ai_tag and ai_tag['ai_ready']=='Y':
+    if dataset['ai_ready'] == 'Y':
         tags.append('AI Ready')
-    search_metadata.update({'tags': tags})
-
-    return search_metadata
 
-def get_dssdb_metadata(dsid):
-    """ Query and return metadata from dssdb tables """
-
-    load_db('dssdb')
-    cond = f"dsid='{dsid}'"
+    return {
+        'dataset_type': dataset['type'],
+        'title': dataset['title'],
+        'description': strip_html_tags(dataset['summary']),
+        'data_type': distinct(column(rows['data_types'], 'keyword')),
+        'gcmd_category': 'EARTH SCIENCE',
+        'gcmd_topics': sorted(set(topics)),
+        'gcmd_terms': sorted(set(terms)),
+        'gcmd_variables': sorted(set(keywords)),
+        'gcmd_topics_and_terms': sorted(set(topics + terms)),
+        'time_resolution': distinct(column(rows['time_resolutions'], 'keyword')) or None,
+        'platform': column(rows['platforms'], 'path') or None,
+        'spatial_resolution': column(rows['grid_resolutions'], 'keyword') or None,
+        'topic': topic,
+        'project': column(rows['projects'], 'path') or None,
+        'supports_project': column(rows['supported_projects'], 'path') or None,
+        'format': distinct(column(rows['formats'], 'keyword')) or None,
+        'instrument': column(rows['instruments'], 'path') or None,
+        'gcmd_location_path': column(rows['locations'], 'path') or None,
+        'location': column(rows['locations'], 'last_in_path') or None,
+        'data_contributors': column(rows['contributors'], 'path') or None,
+        'publication_date': format_date(dataset['pub_date']),
+        'tags': tags,
+    }
+
+def build_dssdb_metadata(rows):
+    """
+    Build the dssdb metadata for one dataset from its rows in each
+    of the DSSDB_QUERIES tables.
+    """
     dssdb_metadata = {}
 
-    doi = pgget('dsvrsn', 'doi', cond + " AND status='A'")
-    if doi and 'doi' in doi:
-        dssdb_metadata.update({'doi': doi['doi']})
-    else:
-        dssdb_metadata.update({'doi': None})
-
-    dsperiod_query = f"SELECT " \
-        f"MIN(CONCAT(date_start, ' ', time_start)) AS date_start, " \
-        f"MAX(CONCAT(date_end, ' ', time_end)) AS date_end, " \
-        f"time_zone " \
-        f"FROM dsperiod " \
-        f"WHERE {cond} GROUP BY time_zone"
-    dsperiod = pgmget(None, None, dsperiod_query)
+    doi = rows['dsvrsn'][0]['doi'] if rows['dsvrsn'] else None
+    dssdb_metadata.update({'doi': doi})
 
-    if not dsperiod or 'date_start' not in dsperiod or 'date_end' not in dsperiod:
+    if not rows['dsperiod']:
         dssdb_metadata.update({'temporal_range_start': None,
                                'temporal_range_end': None})
         return dssdb_metadata
-    
+    dsperiod = rows['dsperiod'][0]
+
     # Adjust 24:00:00 to 23:59:59 for search index compatibility
-    if dsperiod['date_start'][0].endswith("24:00:00"):
-        temporal_start = dsperiod['date_start'][0][:-9] + " 23:59:59"
+    if dsperiod['date_start'].endswith("24:00:00"):
+        temporal_start = dsperiod['date_start'][:-9] + " 23:59:59"
     else:
-        temporal_start = dsperiod['date_start'][0]
+        temporal_start = dsperiod['date_start']
 
-    if dsperiod['date_end'][0].endswith("24:00:00"):
-        temporal_end = dsperiod['date_end'][0][:-9] + " 23:59:59"
+    if dsperiod['date_end'].endswith("24:00:00"):
+        temporal_end = dsperiod['date_end'][:-9] + " 23:59:59"
     else:
-        temporal_end = dsperiod['date_end'][0]
+        temporal_end = dsperiod['date_end']
 
     # BCE (Before Common Era) datasets are not supported by the search index.
-    if dsperiod['time_zone'][0] == 'BCE':
+    if dsperiod['time_zone'] == 'BCE':
         dssdb_metadata.update({'temporal_range_start': None,
                                'temporal_range_end': None})
     else:
@@ -217,31 +232,64 @@ def get_dssdb_metadata(dsid):
 
     return dssdb_metadata
 
-def get_wagtail_metadata(dsid):
-    """ Query and return wagtail metadata """
+def build_wagtail_metadata(rows):
+    """
+    Build the wagtail metadata for one dataset from its rows in each
+    of the WAGTAIL_QUERIES tables.
+    """
+    wagtail_rec = rows['description'][0] if rows['description'] else {}
+    updates = wagtail_rec.get('update_freq')
+    volume = wagtail_rec.get('volume')
+    total_volume = volume.get('full') if volume else None
+
+    return {
+        'updates': updates,
+        'total_volume': total_volume
+    }
+
+def check_dataset_type(dsid, rows):
+    """ Abort if the dataset does not exist or its type is not supported """
+    if not rows['datasets']:
+        logger.warning(f"Dataset {dsid} not found in the search database.")
+        click.echo(f"Dataset {dsid} not found in the search database.")
+        raise click.Abort()
 
-    load_db('wagtail')
-    cond = f"dsid='{dsid}'"
-    wagtail_metadata = {}
+    dataset_type = rows['datasets'][0]['type']
+    if dataset_type not in SUPPORTED_TYPES:
+        logger.warning(f"Dataset type '{dataset_type}' is not supported for dsid {dsid} (it must be 'P' or 'H').")
+        logger.warning("Skipping metadata extraction for this dataset.")
+        click.echo(f"Dataset type '{dataset_type}' is not supported for dsid {dsid} (it must be 'P' or 'H').")
+        click.echo("Skipping metadata extraction for this dataset.")
+        raise click.Abort()
 
-    wagtail_rec = pgget('dataset_description_datasetdescriptionpage', 'update_freq, volume', cond)
+@timed("extract.search")
+def get_search_metadata(dsid):
+    """ Query and return search metadata """
 
-    if 'update_freq' not in wagtail_rec or wagtail_rec['update_freq'] is None:
-        updates = None
-    else:
-        updates = wagtail_rec['update_freq']
+    with db_connection('search') as conn:
+        record = dbget(conn, search_metadata_query(dsid))
+    rows = {name: record.get(name) or [] for name in SEARCH_QUERIES}
+    check_dataset_type(dsid, rows)
 
-    if 'volume' not in wagtail_rec or wagtail_rec['volume'] is None:
-        total_volume = None
-    else:
-        total_volume = wagtail_rec['volume']['full'] if 'full' in wagtail_rec['volume'] else None
+    return build_search_metadata(rows)
 
-    wagtail_metadata.update({
-        'updates': updates,
-        'total_volume': total_volume
-    })
+@timed("extract.dssdb")
+def get_dssdb_metadata(dsid):
+    """ Query and return metadata from dssdb tables """
+
+    with db_connection('dssdb') as conn:
+        rows = rows_for(fetch_grouped(conn, DSSDB_QUERIES, dsid_condition([dsid])), dsid)
+
+    return build_dssdb_metadata(rows)
 
-    return wagtail_metadata
+@timed("extract.wagtail")
+def get_wagtail_metadata(dsid):
+    """ Query and return wagtail metadata """
+
+    with db_connection('wagtail') as conn:
+        rows = rows_for(fetch_grouped(conn, WAGTAIL_QUERIES, dsid_condition([dsid])), dsid)
+
+    return build_wagtail_metadata(rows)
 
 def get_other_metadata(dsid):
     """ Returns metadata not stored in DB """
@@ -265,32 +313,164 @@ def check_date(date_str):
         return False
 
 def metadata2dict(dsid):
-    """ Query metadata from the database and return in a comprehensive dict """
+    """
+    Query metadata from the database and return in a comprehensive dict.
+
+    The search, dssdb and wagtail databases are queried concurrently,
+    each on its own pooled connection.
+    """
+
+    extractors = (get_search_metadata, get_dssdb_metadata, get_wagtail_metadata)
+    with ThreadPoolExecutor(max_workers=len(extractors)) as executor:
+        futures = [executor.submit(extractor, dsid) for extractor in extractors]
 
-    metadata = {}
-    metadata.update(get_search_metadata(dsid))
-    metadata.update(get_dssdb_metadata(dsid))
-    metadata.update(get_wagtail_metadata(dsid))
+        metadata = {}
+        for future in futures:
+            metadata.update(future.result())
     metadata.update(get_other_metadata(dsid))
 
     return metadata
 
-def target_file(output_directory, dsid):
-    target_name = f"{dsid}.search-metadata"
+def metadata2dict_bulk(dsids=None):
+    """
+    Query metadata for many datasets at once and return a dict of
+    comprehensive metadata dicts keyed by dsid.
+
+    Each metadata table is queried once for the whole set of datasets,
+    rather than once per dataset.  If dsids is None, all datasets with a
+    supported type are extracted.  Datasets that are not found or do not
+    have a supported type are skipped with a warning.
+    """
+
+    with span("extract.datasets"), db_connection('search') as conn:
+        if dsids is None:
+            types = ", ".join(f"'{t}'" for t in SUPPORTED_TYPES)
+            cond = f"t.type IN ({types})"
+        else:
+            cond = dsid_condition(dsids)
+        datasets = group_by_dsid(dbmget(conn, SEARCH_QUERIES['datasets'].format(cond=cond)))
+        if dsids is None:
+            dsids = sorted(datasets)
+
+        selected = []
+        for dsid in dsids:
+            if dsid not in datasets:
+                logger.warning(f"Dataset {dsid} not found in the search database, skipping.")
+                continue
+            dataset_type = datasets[dsid][0]['type']
+            if dataset_type not in SUPPORTED_TYPES:
+                logger.warning(f"Dataset type '{dataset_type}' is not supported for dsid {dsid} (it must be 'P' or 'H'), skipping.")
+                continue
+            selected.append(dsid)
+
+        if not selected:
+            return {}
+        cond = dsid_condition(selected)
+
+    # The remaining search tables and the dssdb and wagtail tables are
+    # queried concurrently, each on its own pooled connection.
+    search_queries = {name: sql for name, sql in SEARCH_QUERIES.items() if name != 'datasets'}
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        search_future = executor.submit(fetch_grouped_from, 'search', search_queries, cond)
+        dssdb_future = executor.submit(fetch_grouped_from, 'dssdb', DSSDB_QUERIES, cond)
+        wagtail_future = executor.submit(fetch_grouped_from, 'wagtail', WAGTAIL_QUERIES, cond)
+
+        search_rows = search_future.result()
+        dssdb_rows = dssdb_future.result()
+        wagtail_rows = wagtail_future.result()
+    search_rows['datasets'] = datasets
+
+    results = {}
+    for dsid in selected:
+        metadata = {}
+        metadata.update(build_search_metadata(rows_for(search_rows, dsid)))
+        metadata.update(build_dssdb_metadata(rows_for(dssdb_rows, dsid)))
+        metadata.update(build_wagtail_metadata(rows_for(wagtail_rows, dsid)))
+        metadata.update(get_other_metadata(dsid))
+        results[dsid] = metadata
+
+    return results
+
+def write_metadata(rendered_data, output, force=False, fmt=DEFAULT_FORMAT):
+    """
+    Write extracted metadata (a dict of metadata dicts keyed by dsid) to
+    the output directory in the given format: one file per dataset, or
+    one line per dataset in a single file for 'ndjson'.
+
+    Datasets unchanged since they were last ingested are skipped unless
+    force is True.  Returns the list of dsids written.
+    """
+    rendered_data = dict(rendered_data)
+    if not force:
+        adapter = config_storage_adapter()
+        index_id = configured_index_id()
+        unchanged = [dsid for dsid, data in rendered_data.items()
+                     if is_unchanged(adapter, index_id, dsid, data)]
+        for dsid in unchanged:
+            del rendered_data[dsid]
+        if unchanged:
+            logger.info(f"skipped {len(unchanged)} datasets unchanged since last ingest: {', '.join(unchanged)}")
+            click.echo(f"skipped {len(unchanged)} datasets unchanged since last ingest (use '--force' to override)")
+
+    if is_ndjson(fmt) and rendered_data:
+        with open_data_file(target_file(output, None, fmt), "w") as fp:
+            for data in rendered_data.values():
+                dump_record(data, fp, fmt)
+    else:
+        for dsid, data in rendered_data.items():
+            with open_data_file(target_file(output, dsid, fmt), "w") as fp:
+                dump_record(data, fp, fmt)
+
+    if not rendered_data:
+        click.echo("no metadata to extract")
+    elif len(rendered_data) == 1:
+        dsid = next(iter(rendered_data))
+        logger.info(f"metadata extraction complete for dsid {dsid}")
+        click.echo("metadata extraction complete")
+        click.echo(f"results visible in\n  {target_file(output, dsid, fmt)}")
+    else:
+        logger.info(f"metadata extraction complete for {len(rendered_data)} datasets")
+        click.echo(f"metadata extraction complete for {len(rendered_data)} datasets")
+        click.echo(f"results visible in\n  {output}")
+
+    return list(rendered_data)
+
+def target_file(output_directory, dsid, fmt=DEFAULT_FORMAT):
+    # all datasets are written to a single file in ndjson format
+    if is_ndjson(fmt):
+        target_name = "search-metadata"
+    else:
+        target_name = f"{dsid}.search-metadata"
     os.makedirs(output_directory, exist_ok=True)
-    return os.path.join(output_directory, target_name) + ".json"
+    return os.path.join(output_directory, target_name) + file_extension(fmt)
 
 @click.command(
     help="Extract metadata from the database.\n"
-    "This command creates dataset level metadata extracted from various metadata tables.",
+    "This command creates dataset level metadata extracted from various metadata tables. "
+    "Use '--all' or '--dsid-file' to extract many datasets in one bulk pass, "
+    "which queries each metadata table once for the whole set of datasets.",
 )
 @click.option(
     "--dsid",
     type=str,
-    required=True,
+    default=None,
     callback=validate_dsid,
     help="Dataset ID (dnnnnnn) to extract metadata.",
 )
+@click.option(
+    "--all",
+    "all_datasets",
+    default=False,
+    is_flag=True,
+    help="Extract metadata for all public and historical (type 'P' or 'H') datasets.",
+)
+@click.option(
+    "--dsid-file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    callback=validate_dsid_file,
+    help="Path to a file listing the dataset IDs (dnnnnnn) to extract, one per line.",
+)
 @click.option(
     "--clean",
     default=False,
@@ -303,18 +483,27 @@ def target_file(output_directory, dsid):
     show_default=True,
     help="Absolute path where the extracted metadata should be written.",
 )
+@click.option(
+    "--force",
+    default=False,
+    is_flag=True,
+    help="Write metadata even for datasets unchanged since they were last ingested.",
+)
+@format_option
 @common_options
-def extract(dsid, output, clean):
+@track_run("extract")
+def extract(dsid, all_datasets, dsid_file, output, clean, force, fmt):
+    if sum(1 for opt in (dsid, all_datasets, dsid_file) if opt) != 1:
+        raise click.UsageError("Provide exactly one of '--dsid', '--all' or '--dsid-file'")
+
     if clean:
         shutil.rmtree(output, ignore_errors=True)
 
     rendered_data = {}
-    rendered_data[dsid] = metadata2dict(dsid)
-
-    for dsid, data in rendered_data.items():
-        with open(target_file(output, dsid), "w") as fp:
-            prettyprint_json(data, fp)
+    if dsid:
+        rendered_data[dsid] = metadata2dict(dsid)
+    else:
+        rendered_data = metadata2dict_bulk(None if all_datasets else dsid_file)
 
-    logger.info(f"metadata extraction complete for dsid {dsid}")
-    click.echo("metadata extraction complete")
-    click.echo(f"results visible in\n  {target_file(output, dsid)}")
+    written = write_metadata(rendered_data, output, force, fmt)
+    count("datasets", len(written))
@@ -1,10 +1,63 @@
 import click
 from . import extractor, assembler, submitter, watcher
-from .lib import common_options, validate_dsid
+from .lib import (
+    EXTRACTED_OUTPUT,
+    ASSEMBLED_OUTPUT,
+    TASK_WATCH_OUTPUT,
+    common_options,
+    format_option,
+    validate_dsid,
+    search_client,
+    config_storage_adapter,
+    configured_index_id,
+)
+from .lib.fingerprint import is_unchanged
+from .lib.ledger import new_batch
+from .lib.history import count, track_run
 
 import logging
 logger = logging.getLogger(__name__)
 
+def ingest_in_memory(dsid, force, fmt, keep_artifacts):
+    """
+    Run the extract, assemble, submit and watch workflow for one dataset,
+    passing the metadata, ingest documents and task IDs between stages as
+    Python objects.  The intermediate files are only written if
+    keep_artifacts is True.
+    """
+    adapter = config_storage_adapter()
+    index_id = configured_index_id()
+    if index_id is None:
+        raise click.UsageError("Cannot ingest without first setting up an index")
+
+    metadata = extractor.metadata2dict(dsid)
+    count("datasets")
+    if not force and is_unchanged(adapter, index_id, dsid, metadata):
+        click.echo(f"dsid {dsid} is unchanged since last ingest (use '--force' to override)")
+        return []
+    if keep_artifacts:
+        extractor.write_metadata({dsid: metadata}, EXTRACTED_OUTPUT, force=True, fmt=fmt)
+
+    entries = [assembler.build_entries(metadata)]
+    docs = []
+    for docid, batch in enumerate(assembler.iter_batches(entries)):
+        docs.append(assembler.gmeta_list(batch))
+        if keep_artifacts:
+            assembler.flush_batch(batch, docid, ASSEMBLED_OUTPUT, fmt)
+
+    client = search_client()
+    batch_id = new_batch(adapter)
+    task_ids = [submitter.submit_doc(client, index_id, doc, adapter, force=True, batch_id=batch_id)
+                for doc in docs]
+    logger.info(f"ingest for dsid {dsid} submitted as task IDs {', '.join(task_ids)}")
+
+    results = watcher.watch_tasks(client, adapter, task_ids, watcher.MAX_WAIT)
+    watcher.report_results(results)
+    if keep_artifacts:
+        watcher.write_results(results, TASK_WATCH_OUTPUT)
+
+    return results
+
 @click.command(
     help="Run all workflow commands in sequence: extract, assemble, submit, watch.  This is equivalent to running each subcommand (extract, assemble, submit, watch) individually."
 )
@@ -20,11 +73,38 @@ logger = logging.getLogger(__name__)
     is_flag=True,
     help="Empty the output directory before writing any data there.",
 )
+@click.option(
+    "--force",
+    default=False,
+    is_flag=True,
+    help="Re-ingest the dataset even if it is unchanged since it was last ingested.",
+)
+@click.option(
+    "--in-memory",
+    default=False,
+    is_flag=True,
+    help="Pass data between the workflow stages in memory instead of through the "
+    "output directories.",
+)
+@click.option(
+    "--keep-artifacts",
+    default=False,
+    is_flag=True,
+    help="With '--in-memory', also write the extracted metadata, ingest documents, "
+    "task IDs and task results to the output directories.  Requires '--in-memory'.",
+)
+@format_option
 @common_options
 @click.pass_context
-def ingest(ctx, dsid, clean):
+@track_run("ingest")
+def ingest(ctx, dsid, clean, force, in_memory, keep_artifacts, fmt):
+    if keep_artifacts and not in_memory:
+        raise click.UsageError("'--keep-artifacts' requires '--in-memory'")
+    if in_memory:
+        return ingest_in_memory(dsid, force, fmt, keep_artifacts)
+
     ctx = click.get_current_context()
-    ctx.invoke(extractor.extract, dsid=dsid, clean=clean)
-    ctx.invoke(assembler.assemble, clean=clean)
-    ctx.invoke(submitter.submit)
-    ctx.invoke(watcher.watch)
+    ctx.invoke(extractor.extract, dsid=dsid, clean=clean, force=force, fmt=fmt)
+    ctx.invoke(assembler.assemble, clean=clean, force=force, fmt=fmt)
+    batch_id = ctx.invoke(submitter.submit, force=force)
+    ctx.invoke(watcher.watch, batch_id=batch_id)
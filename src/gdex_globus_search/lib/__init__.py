@@ -1,6 +1,8 @@
 import json
 import os
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from io import StringIO
 from html.parser import HTMLParser
@@ -10,7 +12,25 @@ import click
 
 from .auth import auth_client, internal_auth_client
 from .search import search_client
-from .database import get_dbconfigs, load_db, config_storage_adapter
+from .formats import (
+    FORMATS,
+    DEFAULT_FORMAT,
+    is_ndjson,
+    file_extension,
+    open_data_file,
+    dump_record,
+    read_records,
+    all_datafiles,
+)
+from .database import (
+    get_dbconfigs,
+    load_db,
+    db_connection,
+    close_db_connections,
+    dbget,
+    dbmget,
+    config_storage_adapter,
+)
 
 GDEX_BASE_PATH = '/lustre/desc1/scratch'
 LOGPATH = os.path.join(GDEX_BASE_PATH, 'tcram/logs/globus')
@@ -20,16 +40,29 @@ OUTPUT_BASE = os.path.join(GDEX_BASE_PATH, 'tcram/globus/search/dataset-metadata
 
 EXTRACTED_OUTPUT = os.path.join(OUTPUT_BASE, 'extracted')
 ASSEMBLED_OUTPUT = os.path.join(OUTPUT_BASE, 'assembled')
-TASK_SUBMIT_OUTPUT = os.path.join(OUTPUT_BASE, 'task_submit')
 TASK_WATCH_OUTPUT = os.path.join(OUTPUT_BASE, 'task_watch')
 
-TASK_OUTPUT_FILE = 'ingest-tasks.txt'
 GDEX_DOMAIN = "https://gdex.ucar.edu"
 
+DSID_PATTERN = re.compile(r'^([a-z]{1})(\d{3})(\d{3})$')
+
 def common_options(f):
     # any shared/common options for all commands
     return click.help_option("-h", "--help")(f)
 
+def format_option(f):
+    # on-disk format of extracted metadata and assembled ingest documents
+    return click.option(
+        "--format",
+        "fmt",
+        type=click.Choice(FORMATS),
+        default=DEFAULT_FORMAT,
+        show_default=True,
+        help="Format of the files written: indented JSON ('json'), JSON without whitespace "
+        "('compact'), or one JSON object per line in a single file ('ndjson'), each optionally "
+        "gzip-compressed ('.gz').  Files in any format are read.",
+    )(f)
+
 def all_filenames(directory, pattern=None):
     """ 
     Returns the absolute path and file name to all files 
@@ -49,51 +82,87 @@ def all_filenames(directory, pattern=None):
             for f in filenames:
                 yield os.path.join(dirpath, f)
 
+def ordered_map(func, iterable, workers):
+    """
+    Like map(), but calls func in a pool of worker threads.  Results are
+    yielded in the order of iterable, and at most 2 * workers items are
+    taken from iterable ahead of the result being yielded, so memory use
+    stays bounded for long or lazy inputs.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in iterable:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 def validate_dsid(ctx, param, dsid):
     """ Validate dsid from command line input """
-    ms = re.match(r'^([a-z]{1})(\d{3})(\d{3})$', dsid)
+    if dsid is None:
+        return None
+    if isinstance(dsid, tuple):  # option given with multiple=True
+        return tuple(validate_dsid(ctx, param, d) for d in dsid)
+    ms = DSID_PATTERN.match(dsid)
     if ms:
         return dsid
     else:
         raise click.BadParameter("format must be 'dnnnnnn'")
 
+def validate_dsid_file(ctx, param, path):
+    """
+    Read and validate a file of dataset IDs from command line input.
+
+    The file lists one dsid per line.  Blank lines and lines starting
+    with '#' are ignored.  Returns the list of dsids in file order,
+    with duplicates removed.
+    """
+    if path is None:
+        return None
+    dsids = []
+    with open(path) as fp:
+        for lineno, line in enumerate(fp, start=1):
+            dsid = line.strip()
+            if not dsid or dsid.startswith('#'):
+                continue
+            if not DSID_PATTERN.match(dsid):
+                raise click.BadParameter(f"line {lineno}: '{dsid}' format must be 'dnnnnnn'")
+            dsids.append(dsid)
+    return list(dict.fromkeys(dsids))
+
 def prettyprint_json(obj, fp=None):
     if fp:
         return json.dump(obj, fp, indent=2, separators=(",", ": "), ensure_ascii=False)
     return json.dumps(obj, indent=2, separators=(",", ": "), ensure_ascii=False)
 
 def configure_log():
-   """ Congigure logging """
+   """
+   Configure logging to the log file.  The log file is opened when the
+   first message is logged, not when logging is configured.  Only the
+   first call has any effect.
+   """
+   if getattr(configure_log, "_configured", False):
+       return
    logfile = os.path.join(LOGPATH, 'dataset-search.log')
    loglevel = 'INFO'
    format = '%(asctime)s - %(name)s - %(lineno)d - %(levelname)s - %(message)s'
-   logging.basicConfig(filename=logfile, level=loglevel, format=format)
+   handler = logging.FileHandler(logfile, delay=True)
+   handler.setFormatter(logging.Formatter(format))
+   logging.basicConfig(level=loglevel, handlers=[handler])
+   configure_log._configured = True
 
    return
 
-def move_file_to_completed(output, filename):
+def configured_index_id():
     """
-    Moves the file to a new subdirectory named 'completed'.
-    If the file already exists in 'completed', appends an incrementing number to its name.
-    Returns the new file path.
+    Return the default search index ID stored in the sqlite3 configuration
+    database, or None if no index has been set up.
     """
-    completed_dir = os.path.join(output, "completed")
-    os.makedirs(completed_dir, exist_ok=True)
-    base_name = os.path.basename(filename)
-    dest_path = os.path.join(completed_dir, base_name)
-
-    # Ensure unique filename in 'completed'
-    base, ext = os.path.splitext(dest_path)
-    counter = 0
-    unique_dest = f"{base}_{counter}{ext}"
-    counter += 1
-    # Increment counter until a unique filename is found
-    while os.path.exists(unique_dest):
-        unique_dest = f"{base}_{counter}{ext}"
-        counter += 1
-
-    os.rename(filename, unique_dest)
-    return unique_dest
+    index_info = config_storage_adapter().read_config("index_info")
+    if index_info is None:
+        return None
+    return index_info["index_id"]
 
 class MLStripper(HTMLParser):
     """ 
@@ -124,21 +193,34 @@ def strip_html_tags(html):
 __all__ = (
     "EXTRACTED_OUTPUT",
     "ASSEMBLED_OUTPUT",
-    "TASK_SUBMIT_OUTPUT",
     "TASK_WATCH_OUTPUT",
-    "TASK_OUTPUT_FILE",
     "GDEX_DOMAIN",
     "common_options",
+    "format_option",
+    "FORMATS",
+    "DEFAULT_FORMAT",
+    "is_ndjson",
+    "file_extension",
+    "open_data_file",
+    "dump_record",
+    "read_records",
+    "all_datafiles",
     "all_filenames",
     "validate_dsid",
+    "validate_dsid_file",
     "prettyprint_json",
     "configure_log",
-    "move_file_to_completed",
     "config_storage_adapter",
+    "configured_index_id",
     "strip_html_tags",
     "internal_auth_client",
     "auth_client",
     "search_client",
+    "ordered_map",
     "get_dbconfigs",
     "load_db",
+    "db_connection",
+    "close_db_connections",
+    "dbget",
+    "dbmget",
 )
\ No newline at end of file
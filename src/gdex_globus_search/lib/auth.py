@@ -1,25 +1,110 @@
-import yaml
+import os
+import stat
+
 import globus_sdk
 
+from . import database
+from .transport import use_shared_transport
+
+import logging
+logger = logging.getLogger(__name__)
+
 AUTH_RESOURCE_SERVER = "auth.globus.org"
 AUTH_SCOPES = ["openid", "profile"]
 
 CLIENT_CONFIG = '/glade/u/home/gdexdata/globus/.globusconfig.yml'
 
 def get_client_credentials():
-    """ Get Globus Search service client ID and secret """
-    with open(CLIENT_CONFIG) as f:
-        try:
-            return yaml.safe_load(f)
-        except yaml.YAMLError as e:
-            print(e)
+    """ 
+    Get Globus Search service client ID and secret.  The config file is
+    read once per process and cached.
+    """
+    if not hasattr(get_client_credentials, "_credentials"):
+        import yaml  # imported on first use, see database.py
+
+        with open(CLIENT_CONFIG) as f:
+            try:
+                get_client_credentials._credentials = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                print(e)
+                return None
+    return get_client_credentials._credentials
 
 def internal_auth_client():
-    client_config = get_client_credentials()['search_client']
-    client_id = client_config['client_id']
-    client_secret = client_config['client_secret']
-    return globus_sdk.ConfidentialAppAuthClient(client_id, client_secret, app_name="dataset-search")
+    if not hasattr(internal_auth_client, "_instance"):
+        client_config = get_client_credentials()['search_client']
+        client_id = client_config['client_id']
+        client_secret = client_config['client_secret']
+        internal_auth_client._instance = use_shared_transport(
+            globus_sdk.ConfidentialAppAuthClient(client_id, client_secret, app_name="dataset-search")
+        )
+    return internal_auth_client._instance
+
+def token_config_name(resource_server):
+    return f"token_{resource_server}"
+
+def read_cached_token(resource_server, scopes):
+    """
+    Return the cached access token for a resource server as a dict with
+    'access_token' and 'expires_at', or None if there is none for this
+    client and scopes.  Expired tokens are returned too; the authorizer
+    replaces them when first used.
+    """
+    token = database.config_storage_adapter().read_config(token_config_name(resource_server))
+    if (token is None
+            or token["client_id"] != internal_auth_client().client_id
+            or token["scopes"] != scopes):
+        return None
+    return token
+
+def is_private(path):
+    """ Returns True if the file is neither group- nor world-readable """
+    return not os.stat(path).st_mode & (stat.S_IRGRP | stat.S_IROTH)
+
+def cache_tokens(scopes, token_response):
+    """
+    Store newly issued access tokens in the token cache (authorizer
+    on_refresh callback).  Bearer tokens are stored in plain text, so they
+    are not cached if others can read the configuration database.
+    """
+    # tokens may be refreshed from any thread making a request; the adapter
+    # gives each thread its own connection to the configuration database
+    adapter = database.config_storage_adapter()
+    if not is_private(adapter.filename):
+        logger.warning(f"not caching access tokens, {adapter.filename} is readable by "
+                       f"other users (run 'chmod 600 {adapter.filename}' to enable the cache)")
+        return
+    with adapter.transaction():
+        for resource_server, data in token_response.by_resource_server.items():
+            adapter.store_config(token_config_name(resource_server), {
+                "client_id": internal_auth_client().client_id,
+                "scopes": scopes,
+                "access_token": data["access_token"],
+                "expires_at": data["expires_at_seconds"],
+            })
+
+def client_credentials_authorizer(scopes, resource_server):
+    """
+    Return a ClientCredentialsAuthorizer for the internal client, starting
+    from the cached access token for the resource server if there is one.
+    New tokens are written back to the cache, so later commands reuse them
+    until they expire.
+    """
+    if not isinstance(scopes, str):
+        scopes = " ".join(scopes)
+    token = read_cached_token(resource_server, scopes)
+    return globus_sdk.ClientCredentialsAuthorizer(
+        internal_auth_client(),
+        scopes,
+        access_token=token["access_token"] if token else None,
+        expires_at=token["expires_at"] if token else None,
+        on_refresh=lambda token_response: cache_tokens(scopes, token_response),
+    )
 
 def auth_client():
-    authorizer = globus_sdk.ClientCredentialsAuthorizer(internal_auth_client(), AUTH_SCOPES)
-    return globus_sdk.AuthClient(authorizer=authorizer, app_name="dataset-search")
\ No newline at end of file
+    if not hasattr(auth_client, "_instance"):
+        authorizer = client_credentials_authorizer(AUTH_SCOPES, AUTH_RESOURCE_SERVER)
+        auth_client._instance = use_shared_transport(
+            globus_sdk.AuthClient(authorizer=authorizer, app_name="dataset-search")
+        )
+    return auth_client._instance
@@ -1,23 +1,83 @@
 import os
-import yaml
 import json
+import queue
+import importlib
 import pathlib
 import sqlite3
+import threading
 import typing as t
+from contextlib import contextmanager
 
-from rda_python_common.PgDBI import default_scinfo
+from .history import count
+
+# yaml, the PostgreSQL driver and rda_python_common are slow to import, and
+# are not needed by commands which only use the sqlite3 configuration
+# database, so they are imported on first use.
+
+def pg_driver():
+    """
+    Return the PostgreSQL driver module: psycopg (v3), falling back to
+    psycopg2, as rda_python_common does.
+    """
+    if not hasattr(pg_driver, "_module"):
+        try:
+            import psycopg as PgSQL
+        except ImportError:
+            import psycopg2 as PgSQL
+        pg_driver._module = PgSQL
+    return pg_driver._module
 
 DATABASE_CONFIG = '/glade/u/home/gdexdata/.pgconfig.yml'
 SQLITE_STORAGE = '/glade/u/home/gdexdata/globus/.globus_search.db'
 
+# Journal mode to set on the sqlite3 configuration database, or None to
+# leave the database in the mode it has.  The journal mode is persistent,
+# so it is only set when asked for: otherwise processes with and without
+# the setting would keep switching the database between modes.  A new
+# database starts with the rollback journal ('DELETE'), which is safe on a
+# filesystem shared between hosts, such as /glade.  In 'WAL' mode readers
+# do not block a writer, nor a writer readers, but every process using the
+# database must run on the same host, as the WAL index is shared memory;
+# opt in with configure_storage (see the --sqlite-journal-mode option of
+# the dataset-search command group).
+SQLITE_JOURNAL_MODE = None
+SQLITE_JOURNAL_MODES = ('DELETE', 'WAL')
+
+# Modules storing tables of their own in the sqlite3 configuration database,
+# next to the config table.  Each defines the statements creating its tables
+# as SCHEMA, which SQLiteAdapter runs when it opens the database.
+SQLITE_SCHEMA_MODULES = ('ledger', 'query_cache', 'mirror', 'history')
+
+# Maximum time (in seconds) to wait for a lock on the sqlite3 configuration
+# database held by another connection or process
+SQLITE_BUSY_TIMEOUT = 30.0
+
+# Maximum number of idle connections kept open for each database
+DB_POOL_SIZE = 4
+
+# PostgreSQL type code for CHAR columns, which are returned space padded
+CHCODE = 1042
+
 def get_dbconfigs():
-    """ Get DB login config for all databases """
+    """ 
+    Get DB login config for all databases.  The config file is read
+    once per process and cached.
+    """
 
-    with open(DATABASE_CONFIG) as f:
-        try:
-            return yaml.safe_load(f)
-        except yaml.YAMLError as e:
-            print(e)
+    if not hasattr(get_dbconfigs, "_configs"):
+        import yaml
+
+        with open(DATABASE_CONFIG) as f:
+            try:
+                get_dbconfigs._configs = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                print(e)
+                return None
+    return get_dbconfigs._configs
+
+def get_schema(database, schema=None):
+    """ Return the schema name for the given database """
+    return schema or get_dbconfigs()['pg_schemas'][database]
 
 def load_db(database, schema=None):
     """ 
@@ -27,15 +87,169 @@ def load_db(database, schema=None):
     Schema name will default to the database name unless
     otherwise specified.
     """
-    
+    from rda_python_common.PgDBI import default_scinfo
+
     dbconfigs = get_dbconfigs()
     config_name = '{}_config'.format(database)
     dbconfig = dbconfigs[config_name]
+    pgschema = get_schema(database, schema)
+
+    return default_scinfo(dbconfig['dbname'], pgschema, dbconfig['host'], dbconfig['user'],
+                          dbport=dbconfig.get('port'))
 
-    if not schema:
-        pgschema = dbconfigs['pg_schemas'][database]
+# rda_python_common.PgDBI keeps the current database in module globals, so
+# password lookups from concurrent threads are serialized
+_password_lock = threading.Lock()
 
-    return default_scinfo(dbconfig['dbname'], pgschema, dbconfig['host'], dbconfig['user'])
+def get_password(database, schema=None):
+    """
+    Return the password for the given DB/schema, found the way
+    rda_python_common.PgDBI finds it: in the .pgpass file under $DSSHOME,
+    $GDEXHOME or the home directory, then in OpenBao.  Returns None if
+    there is none.
+    """
+    from rda_python_common import PgDBI
+
+    with _password_lock:
+        load_db(database, schema)
+        return PgDBI.get_pgpass_password()
+
+class DBConnectionPool:
+    """
+    :param database: The logical database name: 'dssdb', 'search', or 'wagtail'.
+    :param schema: The schema name.  Defaults to the schema configured for the
+        database in ``DATABASE_CONFIG``.
+    :param max_size: The maximum number of idle connections kept open.
+
+    A small, thread-safe pool of open connections to one database/schema.
+    Connections are opened on demand and returned to the pool after use, so
+    that repeated and threaded callers reuse live connections rather than
+    reconnecting.  At most ``max_size`` idle connections are kept; any
+    extra connections are closed when they are released.
+    """
+
+    def __init__(self, database: str, schema: str | None = None, max_size: int = DB_POOL_SIZE) -> None:
+        self.database = database
+        self.schema = schema
+        self._idle = queue.LifoQueue(maxsize=max_size)
+        self._password = None
+
+    def _connect(self):
+        dbconfigs = get_dbconfigs()
+        dbconfig = dbconfigs['{}_config'.format(self.database)]
+        params = {
+            'dbname': dbconfig['dbname'],
+            'host': dbconfig['host'],
+            'user': dbconfig['user'],
+        }
+        if dbconfig.get('port'):
+            params['port'] = dbconfig['port']
+        # the password is looked up as PgDBI does unless set in the config,
+        # once per pool
+        password = dbconfig.get('password') or self._password
+        if password is None:
+            password = self._password = get_password(self.database, self.schema)
+        if password:
+            params['password'] = password
+
+        conn = pg_driver().connect(**params)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("SELECT set_config('search_path', %s, false)",
+                        (get_schema(self.database, self.schema),))
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the duration of a ``with`` block.
+        """
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+        if conn is None or conn.closed:
+            conn = self._connect()
+
+        try:
+            yield conn
+        finally:
+            if not conn.closed:
+                try:
+                    self._idle.put_nowait(conn)
+                except queue.Full:
+                    conn.close()
+
+    def close(self) -> None:
+        """
+        Close all idle connections in the pool.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def db_connection(database, schema=None):
+    """
+    Return a context manager which checks out a pooled connection to
+    the given DB/schema, e.g.
+
+        with db_connection('search') as conn:
+            records = dbmget(conn, sqlstr)
+
+    Valid database names: 'dssdb', 'search', or 'wagtail'.
+    One pool is kept per DB/schema for the life of the process.
+    """
+    key = (database, schema)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = DBConnectionPool(database, schema)
+        pool = _pools[key]
+    return pool.connection()
+
+def close_db_connections():
+    """ Close all pooled database connections """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+def _fetch(conn, sqlstr, many):
+    count("queries")
+    with conn.cursor() as cur:
+        cur.execute(sqlstr)
+        rows = cur.fetchall() if many else cur.fetchmany(1)
+        columns = [(col[0], col[1]) for col in cur.description] if cur.description else []
+
+    records = {}
+    if rows:
+        for (name, type_code), vals in zip(columns, zip(*rows)):
+            vals = list(vals)
+            if type_code == CHCODE:
+                vals = [v.rstrip() if v and v[-1] == ' ' else v for v in vals]
+            records[name] = vals
+    return records
+
+def dbget(conn, sqlstr):
+    """ 
+    Run a query on the given connection and return the first row as a
+    dict of column values, or an empty dict if there are no rows.
+    Equivalent to rda_python_common.PgDBI.pgget(None, None, sqlstr).
+    """
+    records = _fetch(conn, sqlstr, many=False)
+    return {name: vals[0] for name, vals in records.items()}
+
+def dbmget(conn, sqlstr):
+    """ 
+    Run a query on the given connection and return all rows as a dict
+    of column value lists, or an empty dict if there are no rows.
+    Equivalent to rda_python_common.PgDBI.pgmget(None, None, sqlstr).
+    """
+    return _fetch(conn, sqlstr, many=True)
 
 class SQLiteAdapter:
     """
@@ -45,20 +259,21 @@ class SQLiteAdapter:
         may be stored in the database.
     :param connect_params: A pass-through dictionary for fine-tuning the SQLite
          connection.
+    :param journal_mode: The SQLite journal mode to set on the database, or None
+        (the default) to leave its current mode.
 
     The ``connect_params`` is an optional dictionary whose elements are passed directly
     to the underlying ``sqlite3.connect()`` method, enabling developers to fine-tune the
     connection to the SQLite database.  Refer to the ``sqlite3.connect()``
     documentation for SQLite-specific parameters.
 
-    SQL command to create the config table used here.  This will need to be 
-    called externally if the desired table doesn't exist:
-        CREATE TABLE config_storage (
-                namespace VARCHAR NOT NULL,
-                config_name VARCHAR NOT NULL,
-                config_data_json VARCHAR NOT NULL,
-                PRIMARY KEY (namespace, config_name)
-                );
+    The database file, readable only by its owner, the config table and the
+    tables of the ``SQLITE_SCHEMA_MODULES`` are created if they do not exist.
+    Each thread using the adapter gets its own connection, opened on first use,
+    so one adapter may be shared by all threads in a process.  Connections are
+    in autocommit mode: each statement is committed on its own, unless it runs
+    inside ``transaction()``.  A connection waits up to ``SQLITE_BUSY_TIMEOUT``
+    seconds for a lock held by another connection or process.
     """
 
     def __init__(
@@ -67,26 +282,104 @@ class SQLiteAdapter:
         *,
         namespace: str = "DEFAULT",
         connect_params: dict[str, t.Any] | None = None,
+        journal_mode: str | None = SQLITE_JOURNAL_MODE,
     ) -> None:
         self.filename = self.dbname = str(dbname)
         self.namespace = namespace
-        self._connection = self._init_and_connect(connect_params)
+        self.journal_mode = journal_mode
+        self._connect_params = connect_params or {}
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._init_db()
 
-    def _init_and_connect(
-        self,
-        connect_params: dict[str, t.Any] | None,
-    ) -> sqlite3.Connection:
-        if not os.path.exists(self.filename):
-            raise FileNotFoundError("Database {} does not exist.".format(self.filename))
-        connect_params = connect_params or {}
+    def _init_db(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        # the database may hold access tokens (see auth.cache_tokens), so a
+        # new file is only readable by its owner; SQLite gives its journal
+        # files the same permissions
+        fd = os.open(self.filename, os.O_CREAT | os.O_RDWR, 0o600)
+        os.close(fd)
+        conn = self.connection
+        if self.journal_mode:
+            # persistent: set once for the database, not per connection
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS config_storage ("
+            "namespace VARCHAR NOT NULL, "
+            "config_name VARCHAR NOT NULL, "
+            "config_data_json VARCHAR NOT NULL, "
+            "PRIMARY KEY (namespace, config_name))"
+        )
+        for module_name in SQLITE_SCHEMA_MODULES:
+            module = importlib.import_module(f".{module_name}", __package__)
+            for sql in module.SCHEMA:
+                conn.execute(sql)
+
+    def _connect(self) -> sqlite3.Connection:
+        connect_params = {
+            "timeout": SQLITE_BUSY_TIMEOUT,
+            # transactions are managed explicitly, see transaction()
+            "isolation_level": None,
+            # each connection is used by one thread, but all are closed by close()
+            "check_same_thread": False,
+            **self._connect_params,
+        }
         conn = sqlite3.connect(self.dbname, **connect_params)
+        if (self.journal_mode or "").upper() == "WAL":
+            # durable as of the last checkpoint, and much faster to commit
+            conn.execute("PRAGMA synchronous=NORMAL")
         return conn
 
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        The database connection of the calling thread, for tables stored
+        alongside the config table (see ``ledger``).
+        """
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = self._local.connection = self._connect()
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self) -> t.Iterator[sqlite3.Connection]:
+        """
+        Run the statements in a ``with`` block on the calling thread's
+        connection as one transaction, e.g. to batch many writes into one
+        commit:
+
+            with adapter.transaction():
+                for name, config in configs.items():
+                    adapter.store_config(name, config)
+
+        The write lock is taken when the block starts.  The transaction is
+        committed when the block ends, or rolled back if it raises.  Nested
+        blocks join the outermost transaction.
+        """
+        conn = self.connection
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
     def close(self) -> None:
         """
-        Close the underlying database connection.
+        Close the database connections of all threads.
         """
-        self._connection.close()
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
 
     def store_config(
         self, config_name: str, config_dict: t.Mapping[str, t.Any]
@@ -101,12 +394,11 @@ class SQLiteAdapter:
 
         Uses sqlite "REPLACE" to perform the operation.
         """
-        self._connection.execute(
+        self.connection.execute(
             "REPLACE INTO config_storage(namespace, config_name, config_data_json) "
             "VALUES (?, ?, ?)",
             (self.namespace, config_name, json.dumps(config_dict)),
         )
-        self._connection.commit()
 
     def read_config(self, config_name: str) -> dict[str, t.Any] | None:
         """
@@ -115,7 +407,7 @@ class SQLiteAdapter:
         Load a config dict under the current namespace in the config table.
         If no value is found, returns None
         """
-        row = self._connection.execute(
+        row = self.connection.execute(
             "SELECT config_data_json FROM config_storage "
             "WHERE namespace=? AND config_name=?",
             (self.namespace, config_name),
@@ -137,15 +429,33 @@ class SQLiteAdapter:
 
         Returns True if data was deleted, False if none was found to delete.
         """
-        rowcount = self._connection.execute(
+        rowcount = self.connection.execute(
             "DELETE FROM config_storage WHERE namespace=? AND config_name=?",
             (self.namespace, config_name),
         ).rowcount
-        self._connection.commit()
         return rowcount != 0
 
+_adapter_lock = threading.Lock()
+
+def configure_storage(journal_mode=SQLITE_JOURNAL_MODE):
+    """
+    Set the journal mode of the configuration database, before it is first
+    opened by config_storage_adapter
+    """
+    configure_storage._journal_mode = journal_mode
+
 def config_storage_adapter():
+    """
+    Return the adapter for the sqlite3 configuration database shared by
+    all commands, and all threads, in this process.
+    """
     if not hasattr(config_storage_adapter, "_instance"):
-        # namespace is equal to the current environment
-        config_storage_adapter._instance = SQLiteAdapter(SQLITE_STORAGE, namespace="DEFAULT")
+        with _adapter_lock:
+            if not hasattr(config_storage_adapter, "_instance"):
+                # namespace is equal to the current environment
+                config_storage_adapter._instance = SQLiteAdapter(
+                    SQLITE_STORAGE,
+                    namespace="DEFAULT",
+                    journal_mode=getattr(configure_storage, "_journal_mode", SQLITE_JOURNAL_MODE),
+                )
     return config_storage_adapter._instance
@@ -0,0 +1,77 @@
+import json
+import hashlib
+from datetime import datetime, timezone
+
+def fingerprint(metadata):
+    """
+    Return a stable content hash (SHA-256 hex digest) of a dataset
+    metadata dict, as built by extractor.metadata2dict.
+    """
+    data = json.dumps(metadata, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def fingerprint_config_name(dsid):
+    return f"fingerprint_{dsid}"
+
+def pending_config_name(task_id):
+    return f"pending_fingerprints_{task_id}"
+
+def read_fingerprint(adapter, index_id, dsid):
+    """
+    Return the fingerprint of the last version of a dataset successfully
+    ingested into the given index, or None if there is none.
+    """
+    config = adapter.read_config(fingerprint_config_name(dsid))
+    if config is None or config["index_id"] != index_id:
+        return None
+    return config["fingerprint"]
+
+def is_unchanged(adapter, index_id, dsid, metadata):
+    """
+    Returns True if the metadata matches the last version of the dataset
+    successfully ingested into the given index.
+    """
+    if adapter is None or index_id is None:
+        return False
+    return read_fingerprint(adapter, index_id, dsid) == fingerprint(metadata)
+
+def record_pending(adapter, task_id, index_id, fingerprints):
+    """
+    Store the fingerprints (a dict of fingerprints keyed by dsid) of the
+    datasets submitted in an ingest task, until the task completes.
+    """
+    adapter.store_config(pending_config_name(task_id),
+                         {"index_id": index_id, "fingerprints": fingerprints})
+
+def commit_pending(adapter, task_id):
+    """
+    Mark the datasets submitted in a successful ingest task as ingested,
+    so that unchanged datasets are skipped by later runs.
+    Returns the number of fingerprints stored.
+    """
+    pending = adapter.read_config(pending_config_name(task_id))
+    if pending is None:
+        return 0
+    ingested_at = datetime.now(timezone.utc).isoformat()
+    with adapter.transaction():
+        for dsid, fp in pending["fingerprints"].items():
+            adapter.store_config(fingerprint_config_name(dsid),
+                                 {"index_id": pending["index_id"],
+                                  "fingerprint": fp,
+                                  "ingested_at": ingested_at})
+        adapter.remove_config(pending_config_name(task_id))
+    return len(pending["fingerprints"])
+
+def discard_pending(adapter, task_id):
+    """
+    Drop the pending fingerprints of a failed ingest task, so that its
+    datasets are ingested again by the next run.
+    """
+    return adapter.remove_config(pending_config_name(task_id))
+
+def remove_fingerprint(adapter, dsid):
+    """
+    Forget the fingerprint of a dataset, e.g. after its subject is
+    deleted from the index.
+    """
+    return adapter.remove_config(fingerprint_config_name(dsid))
@@ -0,0 +1,75 @@
+import os
+import gzip
+import json
+from glob import glob
+
+from .history import count
+
+# On-disk formats for extracted metadata and assembled ingest documents:
+#   json     indented JSON, one object per file
+#   compact  JSON without whitespace, one object per file
+#   ndjson   newline-delimited JSON, one object per line in a single file
+# Each format may be gzip-compressed by appending '.gz'.
+FORMATS = ("json", "compact", "ndjson", "json.gz", "compact.gz", "ndjson.gz")
+DEFAULT_FORMAT = "json"
+
+# File name patterns matching every format, for readers
+DATA_FILE_PATTERNS = ("*.json", "*.json.gz", "*.ndjson", "*.ndjson.gz")
+
+def is_gzip(fmt_or_path):
+    return fmt_or_path.endswith(".gz")
+
+def is_ndjson(fmt_or_path):
+    return fmt_or_path in ("ndjson", "ndjson.gz") or fmt_or_path.endswith((".ndjson", ".ndjson.gz"))
+
+def file_extension(fmt):
+    """ Return the file extension for the given format, e.g. '.json.gz' """
+    ext = ".ndjson" if is_ndjson(fmt) else ".json"
+    if is_gzip(fmt):
+        ext += ".gz"
+    return ext
+
+def open_data_file(path, mode="r"):
+    """
+    Open a data file for reading or writing text, compressing or
+    decompressing it with gzip if its name ends in '.gz'.
+    """
+    if is_gzip(path):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def dump_record(obj, fp, fmt=DEFAULT_FORMAT):
+    """ Write one JSON object to an open file in the given format """
+    if fmt.startswith("json"):
+        data = json.dumps(obj, indent=2, separators=(",", ": "), ensure_ascii=False)
+    else:
+        data = json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+    if is_ndjson(fmt):
+        data += "\n"
+    fp.write(data)
+    # uncompressed size
+    count("bytes_written", len(data.encode("utf-8")))
+
+def read_records(path):
+    """
+    Yield each JSON object stored in a data file of any format.  The
+    format is detected from the file name.
+    """
+    with open_data_file(path) as fp:
+        if is_ndjson(path):
+            for line in fp:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            yield json.load(fp)
+
+def all_datafiles(directory):
+    """
+    Returns the absolute path and file name of all data files, in any
+    format, in the given directory, in sorted order.
+    """
+    filenames = set()
+    for pattern in DATA_FILE_PATTERNS:
+        filenames.update(glob(os.path.join(directory, pattern)))
+    return sorted(filenames)
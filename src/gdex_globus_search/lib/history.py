@@ -0,0 +1,220 @@
+import os
+import json
+import math
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Workflow stages recorded in the run history
+STAGES = ("extract", "assemble", "submit", "watch", "ingest", "sync")
+
+# Run statuses
+SUCCESS = "success"
+FAILED = "failed"
+
+# Metric name prefix in the Prometheus textfile
+METRIC_PREFIX = "dataset_search"
+
+# Tables of the run history, created by lib.database.SQLiteAdapter.  Each
+# row holds one run of a stage, with its counters (see count and observe)
+# as a JSON object.
+SCHEMA = (
+    """\
+CREATE TABLE IF NOT EXISTS run_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    namespace VARCHAR NOT NULL,
+    stage VARCHAR NOT NULL,
+    started_at VARCHAR NOT NULL,
+    duration REAL NOT NULL,
+    status VARCHAR NOT NULL,
+    metrics VARCHAR NOT NULL
+)""",
+    "CREATE INDEX IF NOT EXISTS run_history_stage ON run_history (namespace, stage, id)",
+)
+
+class Run:
+    """
+    Counters of one run of a workflow stage.  Counters may be updated
+    from several threads at once.
+    """
+    def __init__(self, stage):
+        self.stage = stage
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.counters = {}
+        self.observations = {}
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        with self.lock:
+            self.observations.setdefault(name, []).append(value)
+
+    def metrics(self):
+        """ Return the counters, with the mean and maximum of each observed value """
+        metrics = dict(self.counters)
+        for name, values in self.observations.items():
+            metrics[f"{name}_mean"] = round(sum(values) / len(values), 3)
+            metrics[f"{name}_max"] = round(max(values), 3)
+        return metrics
+
+def active_runs():
+    """ Return the stack of runs in progress, innermost last """
+    if not hasattr(active_runs, "_stack"):
+        active_runs._stack = []
+    return active_runs._stack
+
+def count(name, n=1):
+    """
+    Add n to a counter of the innermost run in progress.  Does nothing
+    outside of a tracked command, e.g. in reconcile or query.
+    """
+    runs = active_runs()
+    if runs:
+        runs[-1].count(name, n)
+
+def observe(name, value):
+    """ Record a value, e.g. a latency in seconds, for the innermost run in progress """
+    runs = active_runs()
+    if runs:
+        runs[-1].observe(name, value)
+
+def configure_metrics(metrics_file):
+    """ Set the Prometheus textfile updated after each run, or None for none """
+    configure_metrics._metrics_file = metrics_file
+
+def metrics_file():
+    return getattr(configure_metrics, "_metrics_file", None)
+
+def record_run(adapter, run, status):
+    """ Record a finished run in the run history """
+    conn = adapter.connection
+    conn.execute(
+        "INSERT INTO run_history(namespace, stage, started_at, duration, status, metrics) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (adapter.namespace, run.stage, run.started_at.isoformat(),
+         round(time.perf_counter() - run.started, 3), status, json.dumps(run.metrics())),
+    )
+
+def recent_runs(adapter, stage, limit):
+    """ Return the most recent runs of a stage as dicts, oldest first """
+    cursor = adapter.connection.execute(
+        "SELECT stage, started_at, duration, status, metrics FROM run_history "
+        "WHERE namespace=? AND stage=? ORDER BY id DESC LIMIT ?",
+        (adapter.namespace, stage, limit),
+    )
+    columns = [c[0] for c in cursor.description]
+    runs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    for run in runs:
+        run["metrics"] = json.loads(run["metrics"])
+    return runs[::-1]
+
+def track_run(stage):
+    """
+    Decorator for a workflow command, recording each run in the run
+    history along with the counters updated while it runs.  A command
+    invoked by another tracked command is recorded as a run of its own,
+    and its counters are not added to the outer run.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            run = Run(stage)
+            active_runs().append(run)
+            status = FAILED
+            try:
+                result = func(*args, **kwargs)
+                status = SUCCESS
+                return result
+            finally:
+                active_runs().pop()
+                finish_run(run, status)
+        return wrapper
+    return decorator
+
+def finish_run(run, status):
+    """
+    Record a run and update the Prometheus textfile.  Failing to record
+    a run is logged, but does not fail the command.
+    """
+    # imported here, as lib.database counts its queries with count()
+    from .database import config_storage_adapter
+    try:
+        adapter = config_storage_adapter()
+        record_run(adapter, run, status)
+        if metrics_file():
+            write_textfile(adapter, metrics_file())
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"failed to record {run.stage} run in the run history: {e}")
+
+def percentile(values, p):
+    """ Return the p-th percentile (0-100) of values by the nearest-rank method, or None """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(math.ceil(p / 100 * len(values)), 1)
+    return values[rank - 1]
+
+def metric_name(name):
+    return f"{METRIC_PREFIX}_{''.join(c if c.isalnum() else '_' for c in name)}"
+
+def textfile_lines(adapter):
+    """
+    Return the lines of a Prometheus textfile with the results of the
+    last run of each stage, and the number of runs of each stage by status.
+    """
+    conn = adapter.connection
+    gauges = {}
+    for stage in STAGES:
+        runs = recent_runs(adapter, stage, 1)
+        if not runs:
+            continue
+        run = runs[0]
+        finished = datetime.fromisoformat(run["started_at"]).timestamp() + run["duration"]
+        values = {
+            "last_run_timestamp_seconds": round(finished, 3),
+            "last_run_duration_seconds": run["duration"],
+            "last_run_success": int(run["status"] == SUCCESS),
+        }
+        values.update({f"last_run_{name}": value for name, value in run["metrics"].items()})
+        for name, value in values.items():
+            gauges.setdefault(metric_name(name), []).append(f'{{stage="{stage}"}} {value}')
+
+    lines = []
+    for name, samples in sorted(gauges.items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(name + sample for sample in samples)
+
+    name = metric_name("runs_total")
+    lines.append(f"# TYPE {name} counter")
+    for stage, status, n in conn.execute(
+            "SELECT stage, status, count(*) FROM run_history WHERE namespace=? "
+            "GROUP BY stage, status ORDER BY stage, status", (adapter.namespace,)):
+        lines.append(f'{name}{{stage="{stage}",status="{status}"}} {n}')
+    return lines
+
+def write_textfile(adapter, path):
+    """
+    Write the run metrics to a file read by the Prometheus node exporter's
+    textfile collector.  The file is replaced atomically, so the collector
+    never reads a partly written file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".dataset-search-", suffix=".prom.tmp")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            fp.write("\n".join(textfile_lines(adapter)) + "\n")
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
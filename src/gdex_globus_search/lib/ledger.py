@@ -0,0 +1,114 @@
+import json
+import uuid
+from datetime import datetime, timezone
+
+# Task kinds recorded in the ledger
+INGEST = "ingest"
+DELETE = "delete"
+
+# Task states after which a task is no longer watched
+TERMINAL_STATES = ("SUCCESS", "FAILED")
+
+# Config holding the ID of the most recently submitted batch of tasks
+LAST_BATCH_CONFIG = "last_task_batch"
+
+# Tables of the task ledger, created by lib.database.SQLiteAdapter
+SCHEMA = (
+    """\
+CREATE TABLE IF NOT EXISTS task_ledger (
+    namespace VARCHAR NOT NULL,
+    task_id VARCHAR NOT NULL,
+    kind VARCHAR NOT NULL,
+    index_id VARCHAR,
+    batch_id VARCHAR,
+    dsids VARCHAR NOT NULL,
+    submitted_at VARCHAR NOT NULL,
+    state VARCHAR NOT NULL,
+    completed_at VARCHAR,
+    message VARCHAR,
+    PRIMARY KEY (namespace, task_id)
+)""",
+    "CREATE INDEX IF NOT EXISTS task_ledger_state ON task_ledger (namespace, state)",
+)
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+def new_batch(adapter):
+    """
+    Start a new batch of tasks, e.g. one run of `submit`, and store it as
+    the most recent batch.  Returns the batch ID.
+    """
+    batch_id = uuid.uuid4().hex
+    adapter.store_config(LAST_BATCH_CONFIG, {"batch_id": batch_id, "created_at": now()})
+    return batch_id
+
+def last_batch(adapter):
+    """ Return the ID of the most recently submitted batch, or None """
+    config = adapter.read_config(LAST_BATCH_CONFIG)
+    if config is None:
+        return None
+    return config["batch_id"]
+
+def record_task(adapter, task_id, kind, dsids, index_id=None, batch_id=None):
+    """ Record a newly submitted task in the ledger """
+    conn = adapter.connection
+    conn.execute(
+        "REPLACE INTO task_ledger(namespace, task_id, kind, index_id, batch_id, dsids, "
+        "submitted_at, state) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (adapter.namespace, task_id, kind, index_id, batch_id, json.dumps(list(dsids)),
+         now(), "PENDING"),
+    )
+
+def update_task(adapter, task_id, state, message=None):
+    """
+    Record the latest known state of a task.  The completion time is set
+    when the task reaches a terminal state.  Returns True if the task is
+    in the ledger.
+    """
+    conn = adapter.connection
+    completed_at = now() if state in TERMINAL_STATES else None
+    rowcount = conn.execute(
+        "UPDATE task_ledger SET state=?, completed_at=?, message=? "
+        "WHERE namespace=? AND task_id=?",
+        (state, completed_at, message, adapter.namespace, task_id),
+    ).rowcount
+    return rowcount != 0
+
+def read_task(adapter, task_id):
+    """ Return the ledger record of a task as a dict, or None if not found """
+    conn = adapter.connection
+    cursor = conn.execute(
+        "SELECT task_id, kind, index_id, batch_id, dsids, submitted_at, state, "
+        "completed_at, message FROM task_ledger WHERE namespace=? AND task_id=?",
+        (adapter.namespace, task_id),
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    task = dict(zip([c[0] for c in cursor.description], row))
+    task["dsids"] = json.loads(task["dsids"])
+    return task
+
+def batch_tasks(adapter, batch_id):
+    """ Return the IDs of the tasks submitted in a batch, in submission order """
+    rows = adapter.connection.execute(
+        "SELECT task_id FROM task_ledger WHERE namespace=? AND batch_id=? "
+        "ORDER BY submitted_at, rowid",
+        (adapter.namespace, batch_id),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+def open_tasks(adapter, kind=None):
+    """
+    Return the IDs of all tasks not yet known to have succeeded or failed,
+    optionally only those of one kind, in submission order.
+    """
+    sql = ("SELECT task_id FROM task_ledger WHERE namespace=? "
+           f"AND state NOT IN ({', '.join('?' * len(TERMINAL_STATES))})")
+    params = [adapter.namespace, *TERMINAL_STATES]
+    if kind is not None:
+        sql += " AND kind=?"
+        params.append(kind)
+    rows = adapter.connection.execute(sql + " ORDER BY submitted_at, rowid", params).fetchall()
+    return [row[0] for row in rows]
@@ -0,0 +1,199 @@
+import re
+import json
+from datetime import datetime, timezone
+
+# Query filters answered from the facet table, mapped to the content
+# fields of the ingest entries they match
+FACET_FIELDS = {
+    "variables": ("gcmd_variables",),
+    "keywords": ("gcmd_topics", "gcmd_terms", "gcmd_variables"),
+}
+
+# Tables of the local mirror of ingested content, created by
+# lib.database.SQLiteAdapter.  mirror_fts holds the text of each document
+# (its rowid is the document id), and mirror_facets its values of the
+# FACET_FIELDS fields.
+SCHEMA = (
+    """\
+CREATE TABLE IF NOT EXISTS mirror_documents (
+    id INTEGER PRIMARY KEY,
+    namespace VARCHAR NOT NULL,
+    index_id VARCHAR NOT NULL,
+    subject VARCHAR NOT NULL,
+    content_json VARCHAR NOT NULL,
+    updated_at VARCHAR NOT NULL,
+    UNIQUE (namespace, index_id, subject)
+)""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS mirror_fts USING fts5(body)",
+    """\
+CREATE TABLE IF NOT EXISTS mirror_facets (
+    document_id INTEGER NOT NULL,
+    field VARCHAR NOT NULL,
+    value VARCHAR NOT NULL
+)""",
+    "CREATE INDEX IF NOT EXISTS mirror_facets_value ON mirror_facets (field, value)",
+    "CREATE INDEX IF NOT EXISTS mirror_facets_document ON mirror_facets (document_id)",
+)
+
+def pending_documents_name(task_id):
+    return f"pending_documents_{task_id}"
+
+def content_text(value):
+    """ Return all the text in a content value (a dict, list or scalar), for full-text search """
+    if isinstance(value, dict):
+        return " ".join(content_text(v) for v in value.values())
+    if isinstance(value, list):
+        return " ".join(content_text(v) for v in value)
+    if value is None:
+        return ""
+    return str(value)
+
+def facet_values(content):
+    """ Yield the (field, value) facet pairs of a document's content """
+    fields = sorted({field for fields in FACET_FIELDS.values() for field in fields})
+    for field in fields:
+        values = content.get(field) or []
+        if not isinstance(values, list):
+            values = [values]
+        for value in values:
+            yield field, str(value).lower()
+
+def _delete(conn, adapter, index_id, subject):
+    row = conn.execute(
+        "SELECT id FROM mirror_documents WHERE namespace=? AND index_id=? AND subject=?",
+        (adapter.namespace, index_id, subject),
+    ).fetchone()
+    if row is None:
+        return False
+    conn.execute("DELETE FROM mirror_fts WHERE rowid=?", row)
+    conn.execute("DELETE FROM mirror_facets WHERE document_id=?", row)
+    conn.execute("DELETE FROM mirror_documents WHERE id=?", row)
+    return True
+
+def mirror_documents(adapter, index_id, documents):
+    """
+    Add or replace documents in the local mirror of an index, in one
+    transaction.  documents is an iterable of (subject, content) pairs.
+    Returns the number of documents written.
+    """
+    conn = adapter.connection
+    updated_at = datetime.now(timezone.utc).isoformat()
+    count = 0
+    with adapter.transaction():
+        for subject, content in documents:
+            _delete(conn, adapter, index_id, subject)
+            document_id = conn.execute(
+                "INSERT INTO mirror_documents(namespace, index_id, subject, content_json, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (adapter.namespace, index_id, subject, json.dumps(content), updated_at),
+            ).lastrowid
+            conn.execute("INSERT INTO mirror_fts(rowid, body) VALUES (?, ?)",
+                         (document_id, content_text(content)))
+            conn.executemany("INSERT INTO mirror_facets(document_id, field, value) VALUES (?, ?, ?)",
+                             [(document_id, field, value) for field, value in facet_values(content)])
+            count += 1
+    return count
+
+def record_pending_documents(adapter, task_id, index_id, documents):
+    """
+    Store the documents, (subject, content) pairs, submitted in an ingest
+    task until the task completes, so the mirror only holds content the
+    index has accepted.
+    """
+    adapter.store_config(pending_documents_name(task_id),
+                         {"index_id": index_id, "documents": [list(doc) for doc in documents]})
+
+def commit_pending_documents(adapter, task_id):
+    """
+    Add the documents submitted in a successful ingest task to the local
+    mirror.  Returns the number of documents written.
+    """
+    pending = adapter.read_config(pending_documents_name(task_id))
+    if pending is None:
+        return 0
+    with adapter.transaction():
+        count = mirror_documents(adapter, pending["index_id"], pending["documents"])
+        adapter.remove_config(pending_documents_name(task_id))
+    return count
+
+def discard_pending_documents(adapter, task_id):
+    """ Drop the documents of a failed ingest task without mirroring them """
+    return adapter.remove_config(pending_documents_name(task_id))
+
+def remove_documents(adapter, index_id, subjects):
+    """ Remove documents from the local mirror of an index.  Returns the number removed. """
+    conn = adapter.connection
+    with adapter.transaction():
+        return sum(_delete(conn, adapter, index_id, subject) for subject in subjects)
+
+def clear_mirror(adapter, index_id):
+    """ Remove every document from the local mirror of an index """
+    conn = adapter.connection
+    with adapter.transaction():
+        rows = conn.execute("SELECT id FROM mirror_documents WHERE namespace=? AND index_id=?",
+                            (adapter.namespace, index_id)).fetchall()
+        conn.executemany("DELETE FROM mirror_fts WHERE rowid=?", rows)
+        conn.executemany("DELETE FROM mirror_facets WHERE document_id=?", rows)
+        conn.executemany("DELETE FROM mirror_documents WHERE id=?", rows)
+    return len(rows)
+
+def fts_query(query_string, advanced=False):
+    """
+    Translate a query string to an FTS5 query.  Simple queries match
+    documents containing all of their words; advanced queries are passed
+    to FTS5 as they are.  Returns None for '*', which matches everything.
+    """
+    if query_string.strip() == "*":
+        return None
+    if advanced:
+        return query_string
+    words = re.findall(r"\w+", query_string)
+    return " ".join(f'"{word}"' for word in words) or None
+
+def search_mirror(adapter, index_id, query_string, advanced=False, filters=None, limit=10, offset=0):
+    """
+    Search the local mirror of an index, returning a response shaped like
+    a Globus Search result: a dict with 'gmeta', 'count', 'total',
+    'offset' and 'has_next_page'.  filters maps FACET_FIELDS names to
+    lists of values, of which a document must match any.  limit=None
+    returns all matches.
+    """
+    conn = adapter.connection
+    sql = "FROM mirror_documents AS d"
+    conditions = ["d.namespace=?", "d.index_id=?"]
+    params = [adapter.namespace, index_id]
+
+    match = fts_query(query_string, advanced)
+    if match is not None:
+        sql += " JOIN mirror_fts ON mirror_fts.rowid = d.id"
+        conditions.append("mirror_fts MATCH ?")
+        params.append(match)
+
+    for name, values in (filters or {}).items():
+        fields = FACET_FIELDS[name]
+        conditions.append(
+            "d.id IN (SELECT document_id FROM mirror_facets "
+            f"WHERE field IN ({', '.join('?' * len(fields))}) "
+            f"AND value IN ({', '.join('?' * len(values))}))"
+        )
+        params += list(fields) + [value.lower() for value in values]
+
+    sql += " WHERE " + " AND ".join(conditions)
+    total = conn.execute("SELECT count(*) " + sql, params).fetchone()[0]
+
+    order = " ORDER BY bm25(mirror_fts), d.subject" if match is not None else " ORDER BY d.subject"
+    page = " LIMIT ? OFFSET ?" if limit is not None else ""
+    rows = conn.execute(
+        "SELECT d.subject, d.content_json " + sql + order + page,
+        params + ([limit, offset] if limit is not None else []),
+    ).fetchall()
+
+    gmeta = [{"subject": subject, "entries": [{"content": json.loads(content_json), "entry_id": None}]}
+             for subject, content_json in rows]
+    return {
+        "gmeta": gmeta,
+        "count": len(gmeta),
+        "total": total,
+        "offset": offset,
+        "has_next_page": limit is not None and offset + len(gmeta) < total,
+    }
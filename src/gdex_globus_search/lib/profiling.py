@@ -0,0 +1,119 @@
+import cProfile
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+
+# Timing spans cover the stages and sub-steps of the workflow, named
+# '<stage>.<step>', e.g. 'extract.dssdb', 'assemble.flush_batch' or
+# 'submit.ingest'.  Spans cost almost nothing unless a profile is active
+# (see the --profile option of the dataset-search command group).
+
+class Profile:
+    """
+    Timings of the spans run while profiling is active, aggregated by
+    span name.  Spans may be recorded from several threads at once.
+    """
+    def __init__(self, pstats_file=None):
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.lock = threading.Lock()
+        self.pstats_file = pstats_file
+        self.profiler = cProfile.Profile() if pstats_file else None
+
+    def record(self, name, elapsed):
+        with self.lock:
+            span = self.spans.get(name)
+            if span is None:
+                self.spans[name] = {"count": 1, "total": elapsed, "min": elapsed, "max": elapsed}
+            else:
+                span["count"] += 1
+                span["total"] += elapsed
+                span["min"] = min(span["min"], elapsed)
+                span["max"] = max(span["max"], elapsed)
+
+    def report(self, command=None):
+        """ Return the timing report as a JSON-serializable dict, times in seconds """
+        spans = {}
+        for name, span in sorted(self.spans.items()):
+            spans[name] = {
+                "count": span["count"],
+                "total": round(span["total"], 6),
+                "mean": round(span["total"] / span["count"], 6),
+                "min": round(span["min"], 6),
+                "max": round(span["max"], 6),
+            }
+        return {
+            "command": command,
+            "started_at": self.started_at.isoformat(),
+            "wall_time": round(time.perf_counter() - self.started, 6),
+            "spans": spans,
+        }
+
+def current_profile():
+    """ Return the active Profile, or None if profiling is off """
+    return getattr(current_profile, "_instance", None)
+
+def start_profile(pstats_file=None):
+    """
+    Start recording timing spans.  If pstats_file is given, the calling
+    thread is also profiled with cProfile, see stop_profile.
+    """
+    profile = Profile(pstats_file)
+    current_profile._instance = profile
+    if profile.profiler is not None:
+        profile.profiler.enable()
+    return profile
+
+def stop_profile(command=None):
+    """
+    Stop recording timing spans, write the cProfile statistics (readable
+    with pstats) if requested, and return the timing report.
+    """
+    profile = current_profile()
+    if profile is None:
+        return None
+    del current_profile._instance
+    if profile.profiler is not None:
+        profile.profiler.disable()
+        profile.profiler.dump_stats(profile.pstats_file)
+    return profile.report(command)
+
+def write_report(report, fp):
+    json.dump(report, fp, indent=2)
+    fp.write("\n")
+
+class span:
+    """
+    Context manager timing the enclosed block as the named span, e.g.
+
+        with span("extract.search"):
+            ...
+    """
+    __slots__ = ("name", "profile", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profile = current_profile()
+        if self.profile is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.record(self.name, time.perf_counter() - self.start)
+        return False
+
+def timed(name):
+    """ Decorator timing each call of a function as the named span """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
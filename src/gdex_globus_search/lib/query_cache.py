@@ -0,0 +1,80 @@
+import json
+import time
+import hashlib
+
+# Defaults for the query result cache: entries older than QUERY_CACHE_TTL
+# seconds are not used, and only the QUERY_CACHE_SIZE most recently used
+# entries are kept.
+QUERY_CACHE_TTL = 300
+QUERY_CACHE_SIZE = 500
+
+# Tables of the query cache, created by lib.database.SQLiteAdapter
+SCHEMA = (
+    """\
+CREATE TABLE IF NOT EXISTS query_cache (
+    namespace VARCHAR NOT NULL,
+    query_key VARCHAR NOT NULL,
+    index_id VARCHAR NOT NULL,
+    response_json VARCHAR NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (namespace, query_key)
+)""",
+)
+
+def query_key(index_id, query):
+    """ Return the cache key of a query (a dict or SearchQuery) on an index """
+    data = json.dumps({"index_id": index_id, "query": dict(query)}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def read_cached(adapter, index_id, query, ttl=QUERY_CACHE_TTL):
+    """
+    Return the cached response data of a query, or None if it is not
+    cached or is older than ttl seconds.
+    """
+    conn = adapter.connection
+    key = query_key(index_id, query)
+    now = time.time()
+    row = conn.execute(
+        "SELECT response_json FROM query_cache "
+        "WHERE namespace=? AND query_key=? AND created_at >= ?",
+        (adapter.namespace, key, now - ttl),
+    ).fetchone()
+    if row is None:
+        return None
+    conn.execute(
+        "UPDATE query_cache SET last_used=? WHERE namespace=? AND query_key=?",
+        (now, adapter.namespace, key),
+    )
+    return json.loads(row[0])
+
+def store_cached(adapter, index_id, query, data, max_entries=QUERY_CACHE_SIZE):
+    """
+    Cache the response data of a query, evicting the least recently used
+    entries beyond max_entries.
+    """
+    now = time.time()
+    with adapter.transaction() as conn:
+        conn.execute(
+            "REPLACE INTO query_cache(namespace, query_key, index_id, response_json, created_at, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (adapter.namespace, query_key(index_id, query), index_id, json.dumps(data), now, now),
+        )
+        conn.execute(
+            "DELETE FROM query_cache WHERE namespace=? AND query_key NOT IN ("
+            "SELECT query_key FROM query_cache WHERE namespace=? ORDER BY last_used DESC LIMIT ?)",
+            (adapter.namespace, adapter.namespace, max_entries),
+        )
+
+def invalidate_index(adapter, index_id):
+    """
+    Drop all cached results for an index, e.g. once an ingest task on it
+    has completed or a delete task has been submitted.  Returns the number
+    of entries dropped.
+    """
+    conn = adapter.connection
+    rowcount = conn.execute(
+        "DELETE FROM query_cache WHERE namespace=? AND index_id=?",
+        (adapter.namespace, index_id),
+    ).rowcount
+    return rowcount
@@ -1,10 +1,20 @@
+import logging
+
 import globus_sdk
 
-from .auth import internal_auth_client
+from .auth import client_credentials_authorizer
+from .transport import use_shared_transport
+
+logger = logging.getLogger(__name__)
 
 SEARCH_RESOURCE_SERVER = "search.api.globus.org"
 SEARCH_SCOPES = "urn:globus:auth:scope:search.api.globus.org:all"
 
 def search_client():
-    authorizer = globus_sdk.ClientCredentialsAuthorizer(internal_auth_client(), SEARCH_SCOPES)
-    return globus_sdk.SearchClient(authorizer=authorizer, app_name="dataset-search")
\ No newline at end of file
+    """ Return the SearchClient shared by all commands in this process """
+    if not hasattr(search_client, "_instance"):
+        authorizer = client_credentials_authorizer(SEARCH_SCOPES, SEARCH_RESOURCE_SERVER)
+        search_client._instance = use_shared_transport(
+            globus_sdk.SearchClient(authorizer=authorizer, app_name="dataset-search")
+        )
+    return search_client._instance
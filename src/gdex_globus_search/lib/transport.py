@@ -0,0 +1,89 @@
+import random
+
+# Defaults for the HTTP transport shared by all Globus clients in a process.
+# The pool size is the number of keep-alive connections kept open per host,
+# and should be at least the number of threads making requests concurrently
+# (see submitter.SUBMIT_WORKERS).  Timeouts are in seconds.
+HTTP_POOL_SIZE = 10
+HTTP_CONNECT_TIMEOUT = 10.0
+HTTP_READ_TIMEOUT = 60.0
+
+# Retry policy of the shared transport, which is the only layer retrying
+# requests: HTTP 429 (rate limited), transient 5xx responses and network
+# errors are retried up to MAX_RETRIES times.  Before retry n the transport
+# sleeps for the Retry-After time sent by the server, if any, or else for
+# a random time between zero and RETRY_BACKOFF * 2**n seconds (full
+# jitter), capped at RETRY_MAX_BACKOFF.
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0
+RETRY_MAX_BACKOFF = 60.0
+
+# requests and the globus_sdk transport are slow to import, so they are
+# imported when the shared transport is first created rather than when the
+# CLI starts.
+
+def mount_pool(session, pool_size):
+    """ Mount an HTTP adapter keeping up to pool_size connections open per host """
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+def retry_backoff(ctx):
+    """ Return the time to sleep before retrying a request (a globus_sdk RetryContext) """
+    if ctx.backoff is not None:
+        return ctx.backoff
+    return random.uniform(0, RETRY_BACKOFF * 2 ** ctx.attempt)
+
+def transport_settings():
+    """ Return the (pool size, connect timeout, read timeout) set with configure_transport """
+    return getattr(configure_transport, "_settings",
+                   (HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+
+def apply_settings(transport):
+    pool_size, connect_timeout, read_timeout = transport_settings()
+    # passed through to requests, which takes separate connect and read timeouts
+    transport.http_timeout = (connect_timeout, read_timeout)
+    mount_pool(transport.session, pool_size)
+    transport.max_retries = getattr(configure_retries, "_max_retries", MAX_RETRIES)
+
+def shared_transport():
+    """
+    Return the RequestsTransport shared by all Globus clients in this
+    process, so concurrent and successive requests reuse its keep-alive
+    connections.
+    """
+    if not hasattr(shared_transport, "_instance"):
+        from globus_sdk.transport import RequestsTransport
+
+        transport = RequestsTransport(retry_backoff=retry_backoff, max_sleep=RETRY_MAX_BACKOFF)
+        apply_settings(transport)
+        shared_transport._instance = transport
+    return shared_transport._instance
+
+def configure_transport(pool_size=HTTP_POOL_SIZE, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                        read_timeout=HTTP_READ_TIMEOUT):
+    """
+    Set the connection pool size and timeouts of the shared transport.
+    They are applied when the transport is first used.
+    """
+    configure_transport._settings = (pool_size, connect_timeout, read_timeout)
+    if hasattr(shared_transport, "_instance"):
+        apply_settings(shared_transport._instance)
+
+def configure_retries(max_retries=MAX_RETRIES):
+    """
+    Set the number of times the shared transport retries a request after
+    a transient error.  Applied when the transport is first used.
+    """
+    configure_retries._max_retries = max_retries
+    if hasattr(shared_transport, "_instance"):
+        apply_settings(shared_transport._instance)
+
+def use_shared_transport(client):
+    """ Replace the transport a Globus client was created with by the shared transport """
+    client.transport.close()
+    client.transport = shared_transport()
+    client.transport.user_agent = client.app_name
+    return client
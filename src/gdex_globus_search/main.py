@@ -1,39 +1,164 @@
+import importlib
+
 import click
 import logging
-import logging.handlers
-
-from . import (
-    extractor, 
-    assembler, 
-    submitter, 
-    watcher,
-    ingester, 
-    manage_index, 
-    manage_subject,
-    query
-)
+
 from .lib import common_options, configure_log
+from .lib.transport import (
+    configure_transport,
+    HTTP_POOL_SIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+)
+from .lib.database import configure_storage, SQLITE_JOURNAL_MODE, SQLITE_JOURNAL_MODES
+from .lib.profiling import start_profile, stop_profile, write_report
+from .lib.history import configure_metrics
 
 logger = logging.getLogger(__name__)
-configure_log()
 
-@click.group("dataset-search")
-@common_options
-def cli():
-    pass
+# Subcommands, with the module attribute defining each and its short help.
+# A subcommand's module is only imported when the subcommand is invoked, so
+# starting the CLI, or listing the subcommands with --help, does not import
+# the modules of every subcommand and their dependencies.  The short help
+# must match the first sentence of the command's help.
+SUBCOMMANDS = {
+    # index management
+    "create-index": ("manage_index.create_index", "Create a search index for searchable RDA datasets."),
+    "show-index": ("manage_index.show_index", "Show index info."),
+    "set-index": ("manage_index.set_index", "Set the Index for searchable datasets."),
+    # cli workflow
+    "extract": ("extractor.extract", "Extract metadata from the database."),
+    "assemble": ("assembler.assemble", "Annotate data and prepare it for ingest into a Globus Search index."),
+    "submit": ("submitter.submit", "Submit ingest documents as new Globus Search ingest tasks."),
+    "watch": ("watcher.watch", "Wait for Globus Search ingest tasks to complete."),
+    "ingest": ("ingester.ingest", "Run all workflow commands in sequence: extract, assemble, submit, watch."),
+    "sync": ("sync.sync", "Ingest datasets changed since the last sync."),
+    "reconcile": ("reconcile.reconcile", "Compare the search index with the metadata database."),
+    "stats": ("stats.stats", "Show statistics of recent workflow runs."),
+    # query results
+    "query": ("query.query", "Perform a search query."),
+    "rebuild-mirror": ("query.rebuild_mirror", "Rebuild the local mirror used by `query --local`."),
+    # subject management
+    "delete-subject": ("manage_subject.delete_subject", "Delete subject documents from a search index."),
+}
 
-# index management
-manage_index.add_commands(cli)
+class LazyGroup(click.Group):
+    """
+    A click group loading each subcommand listed in SUBCOMMANDS from its
+    module on first use.  Commands added with add_command are also
+    supported.
+    """
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(SUBCOMMANDS))
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands and cmd_name in SUBCOMMANDS:
+            module_name, attr = SUBCOMMANDS[cmd_name][0].rsplit(".", 1)
+            module = importlib.import_module(f".{module_name}", __package__)
+            self.add_command(getattr(module, attr), cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        """ List the subcommands, with the short help of those not loaded yet taken from SUBCOMMANDS """
+        names = self.list_commands(ctx)
+        if not names:
+            return
+        limit = formatter.width - 6 - max(len(name) for name in names)
+        rows = []
+        for name in names:
+            cmd = self.commands.get(name)
+            if cmd is None:
+                cmd = click.Command(name, help=SUBCOMMANDS[name][1])
+                rows.append((name, cmd.get_short_help_str(limit)))
+            elif not cmd.hidden:
+                rows.append((name, cmd.get_short_help_str(limit)))
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+@click.group("dataset-search", cls=LazyGroup)
+@click.option(
+    "--http-pool-size",
+    default=HTTP_POOL_SIZE,
+    show_default=True,
+    type=click.IntRange(min=1),
+    envvar="DATASET_SEARCH_HTTP_POOL_SIZE",
+    help="Number of keep-alive connections to the Globus APIs shared by all requests.",
+)
+@click.option(
+    "--http-connect-timeout",
+    default=HTTP_CONNECT_TIMEOUT,
+    show_default=True,
+    type=float,
+    envvar="DATASET_SEARCH_HTTP_CONNECT_TIMEOUT",
+    help="Timeout (in seconds) for connecting to the Globus APIs.",
+)
+@click.option(
+    "--http-read-timeout",
+    default=HTTP_READ_TIMEOUT,
+    show_default=True,
+    type=float,
+    envvar="DATASET_SEARCH_HTTP_READ_TIMEOUT",
+    help="Timeout (in seconds) for reading a response from the Globus APIs.",
+)
+@click.option(
+    "--metrics-file",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    envvar="DATASET_SEARCH_METRICS_FILE",
+    help="Also write the metrics of the last run of each workflow stage to this file, "
+    "for the Prometheus node exporter's textfile collector (use a '.prom' file in "
+    "its --collector.textfile.directory).",
+)
+@click.option(
+    "--sqlite-journal-mode",
+    default=SQLITE_JOURNAL_MODE,
+    type=click.Choice(SQLITE_JOURNAL_MODES, case_sensitive=False),
+    envvar="DATASET_SEARCH_SQLITE_JOURNAL_MODE",
+    help="Set the journal mode of the sqlite3 configuration database.  The mode is "
+    "stored in the database and kept until set again; by default it is left as it is "
+    "(DELETE for a new database).  WAL lets readers and a writer work concurrently, "
+    "but is only safe if every process using the database runs on the same host.",
+)
+@click.option(
+    "--profile",
+    default=False,
+    is_flag=True,
+    help="Time each stage of the command and write a JSON timing report to stderr "
+    "(or to --profile-output) when it finishes.",
+)
+@click.option(
+    "--profile-output",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the timing report to this file.  Implies --profile.",
+)
+@click.option(
+    "--profile-pstats",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="Also profile the command with cProfile and write the statistics, "
+    "readable with pstats, to this file.  Implies --profile.",
+)
+@common_options
+@click.pass_context
+def cli(ctx, http_pool_size, http_connect_timeout, http_read_timeout, metrics_file,
+        sqlite_journal_mode, profile, profile_output, profile_pstats):
+    configure_log()
+    configure_transport(http_pool_size, http_connect_timeout, http_read_timeout)
+    configure_metrics(metrics_file)
+    configure_storage(sqlite_journal_mode.upper() if sqlite_journal_mode else None)
 
-# cli workflow
-cli.add_command(extractor.extract)
-cli.add_command(assembler.assemble)
-cli.add_command(submitter.submit)
-cli.add_command(watcher.watch)
-cli.add_command(ingester.ingest)
+    if profile or profile_output or profile_pstats:
+        start_profile(profile_pstats)
+        ctx.call_on_close(lambda: report_profile(ctx.invoked_subcommand, profile_output))
 
-# query results
-cli.add_command(query.query)
+def report_profile(command, output=None):
+    """ Stop profiling and write the timing report to output, or to stderr """
+    report = stop_profile(command)
+    if output is None:
+        write_report(report, click.get_text_stream("stderr"))
+    else:
+        with open(output, "w") as fp:
+            write_report(report, fp)
+        logger.info(f"timing report written to {output}")
 
-# subject management
-manage_subject.add_commands(cli)
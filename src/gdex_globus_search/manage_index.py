@@ -86,9 +86,3 @@ def set_index(index_id):
     adapter = config_storage_adapter()
     adapter.store_config("index_info", {"index_id": str(index_id)})
     click.echo(f"successfully updated configured index, id='{index_id}'")
-
-
-def add_commands(group):
-    group.add_command(create_index)
-    group.add_command(show_index)
-    group.add_command(set_index)
\ No newline at end of file
@@ -1,60 +1,164 @@
-import os
 import click
+import globus_sdk
 
 from .lib import (
     common_options,
     validate_dsid,
+    validate_dsid_file,
     search_client,
+    ordered_map,
     config_storage_adapter,
-    OUTPUT_BASE,
 )
-from .extractor import get_other_metadata
+from .lib.fingerprint import remove_fingerprint
+from .lib.ledger import DELETE, new_batch, record_task
+from .lib.mirror import remove_documents
+from .lib.query_cache import invalidate_index
 from globus_sdk import GlobusAPIError
 
-DELETE_TASK_OUTPUT = os.path.join(OUTPUT_BASE, "task_delete")
-
 import logging
 logger = logging.getLogger(__name__)
 
-def submit_delete_subject(dsid, index_id, task_list_file):
-    subject = get_other_metadata(dsid)['url']
-
-    client = search_client()
-
-    try:
-        res = client.delete_subject(index_id, subject)
-    except GlobusAPIError as e:
-        msg = ("Globus API Error when attempting to delete a search index subject:\n"
-            "HTTP status: {0}\n"
-            "Error code: {1}\n"
-            "Error message: {2}\n"
-            "Search index: {3}\n"
-            "dsid: {4}\n"
-            "subject: {5}".format(e.http_status, e.code, e.message, index_id, dsid, subject)
-        )
-        logger.error(msg)
+# Number of delete_subject requests submitted concurrently
+DELETE_WORKERS = 4
+
+def delete_error_message(e, index_id, dsid, subject):
+    return ("Globus API Error when attempting to delete a search index subject:\n"
+        "HTTP status: {0}\n"
+        "Error code: {1}\n"
+        "Error message: {2}\n"
+        "Search index: {3}\n"
+        "dsid: {4}\n"
+        "subject: {5}".format(e.http_status, e.code, e.message, index_id, dsid, subject)
+    )
 
+def submit_delete_subject(client, dsid, index_id):
+    """
+    Submit a delete_subject task for a dataset and return its task ID.
+    Ingest entries use the dsid as their subject (see assembler.build_entries).
+    """
+    res = client.delete_subject(index_id, dsid)
     task_id = res["task_id"]
 
-    with open(task_list_file, "a") as fp:
-        fp.write(task_id + "\n")
-
     logger.info(f"""\
                 delete subject task for dsid = {dsid} 
                 submitted as task ID {task_id}""")
 
     return task_id
 
+def delete_subjects(client, index_id, dsids, adapter, batch_id=None, workers=DELETE_WORKERS):
+    """
+    Submit delete_subject tasks for the datasets concurrently, with up to
+    `workers` requests in flight at a time.  Tasks are recorded in the task
+    ledger in the calling thread.  The fingerprints of the deleted datasets
+    are removed, so they are ingested again if republished, as are their
+    documents in the local mirror and the cached query results for the index.
+
+    Returns a tuple of (task IDs, list of (dsid, error) for failed deletes).
+    """
+    task_ids = []
+    failed = []
+
+    def delete(dsid):
+        try:
+            return dsid, submit_delete_subject(client, dsid, index_id)
+        except (GlobusAPIError, globus_sdk.NetworkError) as e:
+            if isinstance(e, GlobusAPIError):
+                logger.error(delete_error_message(e, index_id, dsid, dsid))
+            else:
+                logger.error(f"failed to delete subject for dsid {dsid}: {e}")
+            return dsid, e
+
+    for dsid, result in ordered_map(delete, dsids, workers):
+        if isinstance(result, Exception):
+            failed.append((dsid, result))
+            continue
+        with adapter.transaction():
+            record_task(adapter, result, DELETE, [dsid], index_id, batch_id)
+            remove_fingerprint(adapter, dsid)
+            remove_documents(adapter, index_id, [dsid])
+        task_ids.append(result)
+
+    # cached query results would keep returning the deleted subjects
+    if task_ids:
+        invalidate_index(adapter, index_id)
+
+    return task_ids, failed
+
+def matching_subjects(client, index_id, query_string, advanced=False):
+    """ Return the subjects of all entries in the index matching a query """
+    query_obj = globus_sdk.SearchScrollQuery(q=query_string, advanced=advanced)
+    return sorted({entry["subject"] for entry in client.paginated.scroll(index_id, query_obj).items()})
+
+def delete_by_query(client, index_id, query_string, adapter, advanced=False, batch_id=None):
+    """
+    Delete every entry matching a query in one delete_by_query task.  The
+    matching subjects are listed first, so they can be recorded in the
+    task ledger and their fingerprints, local mirror documents and cached
+    query results removed.
+
+    Returns the task ID and the list of matching subjects.
+    """
+    subjects = matching_subjects(client, index_id, query_string, advanced)
+    res = client.delete_by_query(index_id,
+                                 {"q": query_string, "advanced": advanced})
+    task_id = res["task_id"]
+    with adapter.transaction():
+        record_task(adapter, task_id, DELETE, subjects, index_id, batch_id)
+        for subject in subjects:
+            remove_fingerprint(adapter, subject)
+        remove_documents(adapter, index_id, subjects)
+        invalidate_index(adapter, index_id)
+
+    logger.info(f"delete by query '{query_string}' submitted as task ID {task_id}, "
+                f"matching {len(subjects)} subjects")
+
+    return task_id, subjects
+
 @click.command(
     "delete-subject",
-    help="Delete a subject document from a search index."
+    help="Delete subject documents from a search index.\n"
+    "Delete the subjects of one or more datasets, given with '--dsid' (which may be "
+    "repeated) or '--dsid-file', or every subject matching '--query' in a single "
+    "delete-by-query task.",
 )
 @click.option(
     "--dsid",
     type=str,
-    required=True,
+    multiple=True,
     callback=validate_dsid,
-    help="Dataset ID (dnnnnnn) corresponding to the subject to delete from the search index.",
+    help="Dataset ID (dnnnnnn) corresponding to the subject to delete from the search index. "
+    "May be given more than once.",
+)
+@click.option(
+    "--dsid-file",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    callback=validate_dsid_file,
+    help="Path to a file listing the dataset IDs (dnnnnnn) to delete, one per line.",
+)
+@click.option(
+    "--query",
+    "query_string",
+    default=None,
+    help="Delete every subject matching this query in one delete-by-query task.",
+)
+@click.option(
+    "--advanced",
+    is_flag=True,
+    help="Interpret '--query' using the advanced query syntax",
+)
+@click.option(
+    "--dry-run",
+    default=False,
+    is_flag=True,
+    help="List the subjects which would be deleted without deleting them.",
+)
+@click.option(
+    "--workers",
+    default=DELETE_WORKERS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of delete tasks to submit concurrently.",
 )
 @click.option(
     "--index-id",
@@ -64,15 +168,16 @@ def submit_delete_subject(dsid, index_id, task_list_file):
     "the index created with `create-index` will be used.",
 )
 @common_options
-def delete_subject(dsid, index_id):
-    os.makedirs(DELETE_TASK_OUTPUT, exist_ok=True)
-    task_list_file = os.path.join(DELETE_TASK_OUTPUT, "delete-tasks.txt")
+def delete_subject(dsid, dsid_file, query_string, advanced, dry_run, workers, index_id):
+    dsids = list(dict.fromkeys(dsid + tuple(dsid_file or ())))
+    if bool(dsids) == bool(query_string):
+        raise click.UsageError("Provide either '--dsid'/'--dsid-file' or '--query'")
 
-    with open(task_list_file, "w"):  # empty the file (open in write mode)
-        pass
+    adapter = config_storage_adapter()
+    client = search_client()
 
     if not index_id:
-        index_info = config_storage_adapter().read_config("index_info")
+        index_info = adapter.read_config("index_info")
         if index_info is None:
             raise click.UsageError(
                 "Cannot delete subject without first setting up "
@@ -80,14 +185,43 @@ def delete_subject(dsid, index_id):
             )
         index_id = index_info["index_id"]
 
-    task_id = submit_delete_subject(dsid, index_id, task_list_file)
+    if dry_run:
+        subjects = matching_subjects(client, index_id, query_string, advanced) if query_string else dsids
+        for subject in subjects:
+            click.echo(subject)
+        click.echo(f"{len(subjects)} subjects would be deleted")
+        return
+
+    batch_id = new_batch(adapter)
+
+    if query_string:
+        task_id, subjects = delete_by_query(client, index_id, query_string, adapter, advanced, batch_id)
+        click.echo(
+            f"""\
+subject delete by query (task submission) for {len(subjects)} matching subjects complete
+task ID {task_id} recorded as batch {batch_id}"""
+        )
+        return
 
-    click.echo(
-        f"""\
-subject delete (task submission) for dsid = {dsid} complete
-task ID {task_id} written to
-    {task_list_file}"""
-    )
+    task_ids, failed = delete_subjects(client, index_id, dsids, adapter, batch_id, workers)
 
-def add_commands(group):
-    group.add_command(delete_subject)
+    if failed:
+        for failed_dsid, error in failed:
+            click.echo(f"delete for dsid = {failed_dsid} failed: {error}", err=True)
+        raise click.ClickException(
+            f"{len(failed)} of {len(dsids)} subject deletes failed to submit; "
+            f"the submitted tasks are recorded as batch {batch_id}"
+        )
+
+    if len(dsids) == 1:
+        click.echo(
+            f"""\
+subject delete (task submission) for dsid = {dsids[0]} complete
+task ID {task_ids[0]} recorded as batch {batch_id}"""
+        )
+    else:
+        click.echo(
+            f"""\
+subject delete (task submission) for {len(dsids)} datasets complete
+{len(task_ids)} tasks recorded as batch {batch_id}"""
+        )
@@ -1,11 +1,45 @@
+import json
+
 import click
 import globus_sdk
 
+from . import extractor
 from .lib import common_options, prettyprint_json, search_client, config_storage_adapter
+from .lib.query_cache import QUERY_CACHE_TTL, read_cached, store_cached
+from .lib.mirror import search_mirror, mirror_documents, clear_mirror
 
 import logging
 logger = logging.getLogger(__name__)
 
+# Number of results fetched per request with '--all'
+STREAM_PAGE_SIZE = 100
+
+def hit_record(result, fields=None):
+    """
+    Return the output record of a search result: its subject and content,
+    or only the given top-level content fields.
+    """
+    entries = result.get("entries", [])
+    content = entries[0]["content"] if entries else {}
+    if fields:
+        return {"subject": result["subject"], **{field: content.get(field) for field in fields}}
+    return {"subject": result["subject"], "content": content}
+
+def stream_results(client, index_id, query_obj, fields=None):
+    """
+    Walk all results of a scroll query page by page, and write one NDJSON
+    record per result as each page arrives.  Returns the number of results.
+    """
+    return echo_records(client.paginated.scroll(index_id, query_obj).items(), fields)
+
+def echo_records(results, fields=None):
+    """ Write one NDJSON record per search result.  Returns the number of results. """
+    count = 0
+    for result in results:
+        click.echo(json.dumps(hit_record(result, fields), ensure_ascii=False, separators=(",", ":")))
+        count += 1
+    return count
+
 @click.command(
     help="Perform a search query.\n"
     "This will automatically query the index created with create-index. "
@@ -44,6 +78,47 @@ logger = logging.getLogger(__name__)
     is_flag=True,
     help="Write the query structure to stdout instead of submitting it to the service",
 )
+@click.option(
+    "--all",
+    "--stream",
+    "stream",
+    is_flag=True,
+    help="Return all results instead of one page, paging through them with the scroll "
+    "API, and write one JSON record per result per line (NDJSON) as they arrive.",
+)
+@click.option(
+    "--page-size",
+    type=click.IntRange(min=1),
+    default=STREAM_PAGE_SIZE,
+    show_default=True,
+    help="Number of results fetched per request with '--all'",
+)
+@click.option(
+    "--fields",
+    help="With '--all', output only these content fields of each result (comma-delimited). "
+    "For example, '--fields=dataset_id,title'",
+)
+@click.option(
+    "--local",
+    is_flag=True,
+    help="Answer the query from the local mirror of ingested content instead of the "
+    "Globus Search service.  Simple queries match documents containing all of their "
+    "words; '--advanced' queries use the SQLite FTS5 query syntax.",
+)
+@click.option(
+    "--cache",
+    is_flag=True,
+    help="Answer the query from the local result cache if it was run recently, and "
+    "cache the result otherwise.  Cached results are dropped when an ingest or "
+    "delete task on the index completes.",
+)
+@click.option(
+    "--cache-ttl",
+    type=click.IntRange(min=1),
+    default=QUERY_CACHE_TTL,
+    show_default=True,
+    help="Maximum age (in seconds) of a cached result used with '--cache'",
+)
 def query(
     query_string,
     limit,
@@ -52,17 +127,30 @@ def query(
     variables,
     keywords,
     dump_query,
+    stream,
+    page_size,
+    fields,
+    local,
+    cache,
+    cache_ttl,
 ):
+    if stream and (offset or cache):
+        raise click.UsageError("'--all' cannot be combined with '--offset' or '--cache'")
+    if fields and not stream:
+        raise click.UsageError("'--fields' requires '--all'")
+
     adapter = config_storage_adapter()
-    client = search_client()
     index_info = adapter.read_config("index_info")
     if not index_info:
         raise click.UsageError("You must create an index with `create-index` first!")
     index_id = index_info["index_id"]
 
-    query_obj = globus_sdk.SearchQuery(
-        q=query_string, limit=limit, offset=offset, advanced=advanced
-    )
+    if stream:
+        query_obj = globus_sdk.SearchScrollQuery(q=query_string, limit=page_size, advanced=advanced)
+    else:
+        query_obj = globus_sdk.SearchQuery(
+            q=query_string, limit=limit, offset=offset, advanced=advanced
+        )
     if variables:
         query_obj.add_filter("variables", variables.split(","), type="match_any")
     if keywords:
@@ -70,5 +158,51 @@ def query(
 
     if dump_query:
         click.echo(prettyprint_json(dict(query_obj)))
-    else:
-        click.echo(prettyprint_json(client.post_search(index_id, query_obj).data))
\ No newline at end of file
+        return
+
+    if local:
+        filters = {}
+        if variables:
+            filters["variables"] = variables.split(",")
+        if keywords:
+            filters["keywords"] = keywords.split(",")
+        data = search_mirror(adapter, index_id, query_string, advanced, filters,
+                             None if stream else limit, offset)
+        if stream:
+            echo_records(data["gmeta"], fields.split(",") if fields else None)
+        else:
+            click.echo(prettyprint_json(data))
+        return
+
+    if stream:
+        count = stream_results(search_client(), index_id, query_obj,
+                               fields.split(",") if fields else None)
+        logger.info(f"query '{query_string}' streamed {count} results")
+        return
+
+    data = read_cached(adapter, index_id, query_obj, cache_ttl) if cache else None
+    if data is None:
+        data = search_client().post_search(index_id, query_obj).data
+        if cache:
+            store_cached(adapter, index_id, query_obj, data)
+    click.echo(prettyprint_json(data))
+
+@click.command(
+    "rebuild-mirror",
+    help="Rebuild the local mirror used by `query --local`.\n"
+    "Replace the mirror of the configured index with the current metadata of all "
+    "eligible (type 'P' or 'H') datasets, extracted from the metadata database.  "
+    "The mirror is otherwise kept up to date by `submit` and `delete-subject`.",
+)
+@common_options
+def rebuild_mirror():
+    adapter = config_storage_adapter()
+    index_info = adapter.read_config("index_info")
+    if not index_info:
+        raise click.UsageError("You must create an index with `create-index` first!")
+    index_id = index_info["index_id"]
+
+    metadata = extractor.metadata2dict_bulk()
+    clear_mirror(adapter, index_id)
+    count = mirror_documents(adapter, index_id, metadata.items())
+    click.echo(f"local mirror rebuilt with {count} datasets")
@@ -0,0 +1,134 @@
+import click
+import globus_sdk
+
+from . import extractor, assembler, submitter, manage_subject
+from .lib import (
+    common_options,
+    search_client,
+    config_storage_adapter,
+    configured_index_id,
+    prettyprint_json,
+)
+from .lib.fingerprint import fingerprint
+from .lib.ledger import new_batch
+
+import logging
+logger = logging.getLogger(__name__)
+
+def index_fingerprints(client, index_id):
+    """
+    Page through every entry in the index with the scroll API, and return
+    the fingerprint of each subject's content keyed by subject.  Only the
+    fingerprints are kept, not the entries themselves.
+    """
+    fingerprints = {}
+    query_obj = globus_sdk.SearchScrollQuery(q="*")
+    for result in client.paginated.scroll(index_id, query_obj).items():
+        entries = result.get("entries", [])
+        fingerprints[result["subject"]] = fingerprint(entries[0]["content"]) if entries else None
+    return fingerprints
+
+def reconcile_index(indexed, metadata):
+    """
+    Compare the fingerprints of the subjects in the index with the current
+    metadata of eligible datasets, keyed by dsid.
+
+    Returns a dict of sorted lists of subjects:
+        missing   eligible datasets with no subject in the index
+        orphaned  subjects in the index which are not eligible datasets
+        stale     subjects whose indexed content differs from the current metadata
+    """
+    return {
+        "missing": sorted(set(metadata) - set(indexed)),
+        "orphaned": sorted(set(indexed) - set(metadata)),
+        "stale": sorted(dsid for dsid in set(metadata) & set(indexed)
+                        if indexed[dsid] != fingerprint(metadata[dsid])),
+    }
+
+def queue_ingests(client, index_id, metadata, adapter, batch_id):
+    """ Submit ingest tasks for the given metadata dicts, keyed by dsid """
+    entries = (assembler.build_entries(data) for data in metadata.values())
+    docs = (assembler.gmeta_list(batch) for batch in assembler.iter_batches(entries))
+    return submitter.submit_docs(client, index_id, docs, adapter, batch_id, force=True)
+
+@click.command(
+    help="Compare the search index with the metadata database.\n"
+    "List every subject in the configured index and compare it with the eligible "
+    "(type 'P' or 'H') datasets in the search database.  Report datasets missing "
+    "from the index, orphaned subjects which are not eligible datasets, and stale "
+    "subjects whose indexed content differs from the current metadata.  With "
+    "'--apply', submit only the ingest and delete tasks needed to fix them, as one "
+    "batch which can be monitored with the `watch` command.",
+)
+@click.option(
+    "--apply",
+    default=False,
+    is_flag=True,
+    help="Ingest missing and stale datasets and delete orphaned subjects.",
+)
+@click.option(
+    "--json",
+    "as_json",
+    default=False,
+    is_flag=True,
+    help="Print the report as JSON.",
+)
+@common_options
+def reconcile(apply, as_json):
+    adapter = config_storage_adapter()
+    client = search_client()
+    index_id = configured_index_id()
+    if index_id is None:
+        raise click.UsageError("You must create an index with `create-index` first!")
+
+    indexed = index_fingerprints(client, index_id)
+    metadata = extractor.metadata2dict_bulk()
+    report = reconcile_index(indexed, metadata)
+    logger.info(f"reconcile: {len(indexed)} subjects indexed, {len(metadata)} eligible datasets, "
+                + ", ".join(f"{len(v)} {k}" for k, v in report.items()))
+
+    if as_json:
+        click.echo(prettyprint_json(report))
+    else:
+        click.echo(f"{len(indexed)} subjects in the index, {len(metadata)} eligible datasets")
+        for kind, subjects in report.items():
+            click.echo(f"{len(subjects)} {kind}" + (":" if subjects else ""))
+            for subject in subjects:
+                click.echo(f"  {subject}")
+
+    if not apply:
+        return report
+
+    to_ingest = {dsid: metadata[dsid] for dsid in report["missing"] + report["stale"]}
+    if not to_ingest and not report["orphaned"]:
+        click.echo("index is up to date, nothing to do")
+        return report
+
+    batch_id = new_batch(adapter)
+    failed = []
+    task_ids = []
+    if to_ingest:
+        ingest_ids, _, ingest_failed = queue_ingests(client, index_id, to_ingest, adapter, batch_id)
+        task_ids += ingest_ids
+        failed += [f"ingest document {n}: {error}" for n, error in ingest_failed]
+    if report["orphaned"]:
+        delete_ids, delete_failed = manage_subject.delete_subjects(
+            client, index_id, report["orphaned"], adapter, batch_id
+        )
+        task_ids += delete_ids
+        failed += [f"delete {subject}: {error}" for subject, error in delete_failed]
+
+    if failed:
+        for message in failed:
+            click.echo(f"{message}", err=True)
+        raise click.ClickException(
+            f"{len(failed)} reconcile tasks failed to submit; "
+            f"the submitted tasks are recorded as batch {batch_id}"
+        )
+
+    click.echo(
+        f"""\
+reconcile (task submission) complete
+{len(task_ids)} tasks recorded as batch {batch_id}"""
+    )
+    return report
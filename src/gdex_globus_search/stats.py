@@ -0,0 +1,132 @@
+import json
+
+import click
+
+from .lib import common_options, config_storage_adapter
+from .lib.history import STAGES, SUCCESS, percentile, recent_runs
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Default number of recent runs of each stage to summarize
+RECENT_RUNS = 20
+
+# A run is flagged as a regression when it is slower than REGRESSION_FACTOR
+# times the median of the earlier recent runs, or its throughput is lower
+# than the median divided by REGRESSION_FACTOR.  At least MIN_BASELINE_RUNS
+# earlier successful runs are needed to compare against.
+REGRESSION_FACTOR = 1.5
+MIN_BASELINE_RUNS = 3
+
+def throughput(run):
+    """ Return the datasets processed per second in a run, or None """
+    datasets = run["metrics"].get("datasets")
+    if not datasets or not run["duration"]:
+        return None
+    return datasets / run["duration"]
+
+def stage_stats(runs, factor=REGRESSION_FACTOR):
+    """
+    Summarize the recent runs of a stage, oldest first: the p50 and p95
+    duration and throughput of the successful runs, and whether the last
+    successful run is a regression against the ones before it.
+    """
+    succeeded = [run for run in runs if run["status"] == SUCCESS]
+    durations = [run["duration"] for run in succeeded]
+    rates = [rate for rate in map(throughput, succeeded) if rate is not None]
+    stats = {
+        "runs": len(runs),
+        "failed": len(runs) - len(succeeded),
+        "duration_p50": percentile(durations, 50),
+        "duration_p95": percentile(durations, 95),
+        "throughput_p50": percentile(rates, 50),
+        "throughput_p95": percentile(rates, 95),
+        "last_duration": durations[-1] if durations else None,
+        "last_throughput": throughput(succeeded[-1]) if succeeded else None,
+        "regressions": [],
+    }
+
+    baseline = succeeded[:-1]
+    if len(baseline) >= MIN_BASELINE_RUNS:
+        median = percentile([run["duration"] for run in baseline], 50)
+        if stats["last_duration"] > factor * median:
+            stats["regressions"].append("duration")
+        baseline_rates = [rate for rate in map(throughput, baseline) if rate is not None]
+        if stats["last_throughput"] is not None and len(baseline_rates) >= MIN_BASELINE_RUNS:
+            if stats["last_throughput"] < percentile(baseline_rates, 50) / factor:
+                stats["regressions"].append("throughput")
+    return stats
+
+def format_value(value, fmt):
+    return "-" if value is None else format(value, fmt)
+
+@click.command(
+    help="Show statistics of recent workflow runs.\n"
+    "Summarize the run history recorded by the extract, assemble, submit, watch, ingest "
+    "and sync commands: the median (p50) and 95th percentile (p95) duration and "
+    "throughput (datasets per second) of each stage over its recent successful runs.  "
+    "The last run of a stage is flagged as a regression if it is much slower than the "
+    "runs before it.",
+)
+@click.option(
+    "--stage",
+    "stages",
+    type=click.Choice(STAGES),
+    multiple=True,
+    help="Only show this stage.  May be given more than once.",
+)
+@click.option(
+    "--runs",
+    default=RECENT_RUNS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of recent runs of each stage to summarize.",
+)
+@click.option(
+    "--factor",
+    default=REGRESSION_FACTOR,
+    show_default=True,
+    type=click.FloatRange(min=1.0),
+    help="Flag the last run as a regression if its duration is more than this factor "
+    "times the median of the runs before it, or its throughput less than the median "
+    "divided by this factor.",
+)
+@click.option(
+    "--json",
+    "as_json",
+    default=False,
+    is_flag=True,
+    help="Print the statistics as JSON.",
+)
+@common_options
+def stats(stages, runs, factor, as_json):
+    adapter = config_storage_adapter()
+    results = {}
+    for stage in stages or STAGES:
+        stage_runs = recent_runs(adapter, stage, runs)
+        if stage_runs:
+            results[stage] = stage_stats(stage_runs, factor)
+
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+
+    if not results:
+        click.echo("no runs recorded yet")
+        return
+
+    click.echo(f"{'stage':<10}{'runs':>6}{'failed':>8}{'p50 s':>10}{'p95 s':>10}{'last s':>10}"
+               f"{'p50 ds/s':>10}{'last ds/s':>11}  regression")
+    for stage, s in results.items():
+        click.echo(
+            f"{stage:<10}{s['runs']:>6}{s['failed']:>8}"
+            f"{format_value(s['duration_p50'], '.2f'):>10}"
+            f"{format_value(s['duration_p95'], '.2f'):>10}"
+            f"{format_value(s['last_duration'], '.2f'):>10}"
+            f"{format_value(s['throughput_p50'], '.1f'):>10}"
+            f"{format_value(s['last_throughput'], '.1f'):>11}"
+            f"  {', '.join(s['regressions'])}"
+        )
+    regressed = [stage for stage, s in results.items() if s["regressions"]]
+    if regressed:
+        logger.warning(f"performance regression in the last run of: {', '.join(regressed)}")
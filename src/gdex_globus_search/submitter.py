@@ -1,34 +1,137 @@
-import json
-import os
-
 import click
+import globus_sdk
 
 from .lib import (
-    all_filenames, 
+    all_datafiles, 
+    read_records,
     common_options, 
     search_client, 
+    ordered_map,
     config_storage_adapter, 
-    move_file_to_completed,
     ASSEMBLED_OUTPUT,
-    TASK_SUBMIT_OUTPUT,
-    TASK_OUTPUT_FILE,
 )
+from .lib.transport import MAX_RETRIES, configure_retries
+from .lib.fingerprint import fingerprint, is_unchanged, record_pending
+from .lib.ledger import INGEST, new_batch, record_task
+from .lib.mirror import record_pending_documents
+from .lib.profiling import span
+from .lib.history import count, track_run
 
 import logging
 logger = logging.getLogger(__name__)
 
-def submit_doc(client, index_id, filename, task_list_file):
-    with open(filename) as fp:
-        data = json.load(fp)
-    res = client.ingest(index_id, data)
-    with open(task_list_file, "a") as fp:
-        fp.write(res["task_id"] + "\n")
+# Number of ingest requests submitted concurrently
+SUBMIT_WORKERS = 4
+
+def filter_doc(data, adapter, index_id, force=False):
+    """
+    Drop entries for datasets unchanged since they were last ingested from
+    an ingest document, unless force is True.
+
+    Returns the ingest document and the fingerprints of its entries keyed
+    by subject, or None if no entries were left to submit.
+    """
+    entries = data["ingest_data"]["gmeta"]
+    if not force:
+        entries = [entry for entry in entries
+                   if not is_unchanged(adapter, index_id, entry["subject"], entry["content"])]
+        if not entries:
+            logger.info("all entries in ingest document are unchanged since last ingest, skipping")
+            return None
+        data["ingest_data"]["gmeta"] = entries
+    return data, {entry["subject"]: fingerprint(entry["content"]) for entry in entries}
+
+def ingest_doc(client, index_id, data):
+    """
+    Submit an ingest document as a new ingest task and return the task ID.
+    Transient errors are retried by the shared transport of the client.
+    """
+    with span("submit.ingest"):
+        res = client.ingest(index_id, data)
+    return res["task_id"]
+
+def record_doc(adapter, task_id, index_id, data, fingerprints, batch_id=None):
+    """
+    Record an ingest task in the task ledger, along with the fingerprints
+    of the datasets it covers and its entries, which are added to the local
+    mirror once the task succeeds.
+    """
+    count("tasks_submitted")
+    with span("submit.record"), adapter.transaction():
+        record_task(adapter, task_id, INGEST, fingerprints, index_id, batch_id)
+        record_pending(adapter, task_id, index_id, fingerprints)
+        record_pending_documents(adapter, task_id, index_id,
+                                 ((entry["subject"], entry["content"]) for entry in data["ingest_data"]["gmeta"]))
+
+def submit_doc(client, index_id, data, adapter, force=False, batch_id=None):
+    """
+    Submit an ingest document as a new ingest task and record it in the
+    task ledger.
+
+    Entries for datasets unchanged since they were last ingested are
+    dropped from the document unless force is True.  Returns the task ID,
+    or None if no entries were left to submit.
+    """
+    filtered = filter_doc(data, adapter, index_id, force)
+    if filtered is None:
+        return None
+    data, fingerprints = filtered
+
+    task_id = ingest_doc(client, index_id, data)
+    record_doc(adapter, task_id, index_id, data, fingerprints, batch_id)
+    return task_id
+
+def submit_docs(client, index_id, docs, adapter, batch_id=None, force=False,
+                workers=SUBMIT_WORKERS):
+    """
+    Submit ingest documents concurrently, with up to `workers` ingest
+    requests in flight at a time.
+
+    Documents are filtered and their tasks recorded in the calling thread,
+    in the order of docs, so the configuration database has a single
+    writer.  A document that fails to submit after retries does not stop
+    the others.
+
+    Returns a tuple of (task IDs, number of documents skipped as
+    unchanged, list of (document number, error) for failed documents).
+    """
+    task_ids = []
+    failed = []
+    num_skipped = 0
+
+    def filtered_docs():
+        nonlocal num_skipped
+        for n, data in enumerate(docs, 1):
+            filtered = filter_doc(data, adapter, index_id, force)
+            if filtered is None:
+                num_skipped += 1
+                continue
+            yield n, filtered
+
+    def ingest(item):
+        n, (data, fingerprints) = item
+        try:
+            return n, ingest_doc(client, index_id, data), data, fingerprints
+        except (globus_sdk.GlobusAPIError, globus_sdk.NetworkError) as e:
+            logger.error(f"failed to submit ingest document {n}: {e}")
+            return n, e, data, fingerprints
+
+    for n, result, data, fingerprints in ordered_map(ingest, filtered_docs(), workers):
+        if isinstance(result, Exception):
+            failed.append((n, result))
+            count("failures")
+            continue
+        record_doc(adapter, result, index_id, data, fingerprints, batch_id)
+        count("datasets", len(fingerprints))
+        task_ids.append(result)
+
+    return task_ids, num_skipped, failed
 
 
 @click.command(
     help="Submit ingest documents as new Globus Search ingest tasks.\n"
     "Read ingest documents produced by the Assembler, submit them "
-    "each as a new ingest task and log their ingest task IDs. "
+    "each as a new ingest task and record the tasks in the task ledger. "
     "These tasks can then be monitored with the `watch` command.",
 )
 @click.option(
@@ -36,14 +139,7 @@ def submit_doc(client, index_id, filename, task_list_file):
     default=ASSEMBLED_OUTPUT,
     show_default=True,
     help="Absolute path to the directory containing "
-    "assembled ingest documents to submit",
-)
-@click.option(
-    "--output",
-    default=TASK_SUBMIT_OUTPUT,
-    show_default=True,
-    help="Abolute path to the directory "
-    "where the resulting task IDs will be written",
+    "assembled ingest documents to submit, in any format written by `assemble`",
 )
 @click.option(
     "--index-id",
@@ -52,23 +148,36 @@ def submit_doc(client, index_id, filename, task_list_file):
     "If omitted, the index stored in the sqlite3 configuration database, or "
     "the index created with `create-index` will be used.",
 )
+@click.option(
+    "--force",
+    default=False,
+    is_flag=True,
+    help="Submit entries even for datasets unchanged since they were last ingested.",
+)
+@click.option(
+    "--workers",
+    default=SUBMIT_WORKERS,
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="Number of ingest documents to submit concurrently.",
+)
+@click.option(
+    "--max-retries",
+    default=MAX_RETRIES,
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="Number of times to retry a Globus request after a rate limit (HTTP 429), "
+    "server or network error, with exponential backoff and jitter.  0 disables retries.",
+)
 @common_options
-def submit(directory, output, index_id):
+@track_run("submit")
+def submit(directory, index_id, force, workers, max_retries):
+    configure_retries(max_retries)
+    adapter = config_storage_adapter()
     client = search_client()
 
-    os.makedirs(output, exist_ok=True)
-    task_list_file = os.path.join(output, TASK_OUTPUT_FILE)
-
-    # move any existing task list file to the 'completed' subdirectory
-    if os.path.exists(task_list_file):
-        moved_task_file = move_file_to_completed(output, task_list_file)
-        click.echo(f"Moved existing task list file to {moved_task_file}")
-
-    with open(task_list_file, "w"):  # create a new empty task list file
-        pass
-
     if not index_id:
-        index_info = config_storage_adapter().read_config("index_info")
+        index_info = adapter.read_config("index_info")
         if index_info is None:
             raise click.UsageError(
                 "Cannot submit without first setting up "
@@ -76,12 +185,28 @@ def submit(directory, output, index_id):
             )
         index_id = index_info["index_id"]
 
-    for filename in all_filenames(directory):
-        submit_doc(client, index_id, filename, task_list_file)
+    batch_id = new_batch(adapter)
+    docs = (data for filename in all_datafiles(directory)
+            for data in read_records(filename))
+    task_ids, num_skipped, failed = submit_docs(client, index_id, docs, adapter,
+                                                batch_id, force, workers)
+
+    if num_skipped:
+        click.echo(f"skipped {num_skipped} ingest documents unchanged since last ingest (use '--force' to override)")
+
+    if failed:
+        for n, error in failed:
+            click.echo(f"ingest document {n} failed: {error}", err=True)
+        raise click.ClickException(
+            f"{len(failed)} of {len(failed) + len(task_ids)} ingest documents failed to submit; "
+            f"the submitted tasks are recorded as batch {batch_id}"
+        )
 
     click.echo(
         f"""\
 ingest document submission (task submission) complete
-task IDs are visible in
-    {task_list_file}"""
-    )
\ No newline at end of file
+{len(task_ids)} tasks recorded as batch {batch_id}"""
+    )
+
+    # returned for commands invoking submit, which pass it on to watch
+    return batch_id
\ No newline at end of file
@@ -0,0 +1,168 @@
+import shutil
+from datetime import datetime
+
+import click
+
+from . import extractor, assembler, submitter, watcher
+from .lib import (
+    EXTRACTED_OUTPUT,
+    ASSEMBLED_OUTPUT,
+    common_options,
+    config_storage_adapter,
+    db_connection,
+    dbget,
+    dbmget,
+)
+from .lib.history import count, track_run
+
+import logging
+logger = logging.getLogger(__name__)
+
+WATERMARK_CONFIG = "sync_watermarks"
+
+# Queries returning the dsids of datasets whose metadata changed after a
+# given timestamp, keyed by the database they run on.  {since} is replaced
+# with a timestamp in the database server's local time (see changed_dsids).
+# Date-only columns are compared by day, so a dataset changed on the day of
+# the watermark is picked up again; datasets that are in fact unchanged are
+# then skipped by their fingerprint.
+#
+# Only columns known to record when a row was changed are used.  No such
+# column is known for the tables of the 'search' database or for dsperiod,
+# so changes made only there are not seen by sync; see SYNC_LIMITATION.
+CHANGE_QUERIES = {
+    'dssdb': [
+        # set by dsarch whenever the dataset record is changed
+        "SELECT dsid FROM dataset WHERE date_change >= DATE '{since_date}'",
+        # a new version, with its own DOI, starts on its start_date
+        "SELECT dsid FROM dsvrsn WHERE status='A' AND start_date >= DATE '{since_date}'",
+    ],
+    'wagtail': [
+        "SELECT d.dsid FROM dataset_description_datasetdescriptionpage AS d "
+        "JOIN wagtailcore_page AS p ON p.id = d.page_ptr_id "
+        "WHERE p.last_published_at > TIMESTAMP '{since}'",
+    ],
+}
+
+SYNC_LIMITATION = (
+    "Changes made only to the 'search' database (keywords, title, summary) or to the "
+    "temporal coverage in dsperiod have no known modification time, so sync does not "
+    "see them; run 'extract --all' followed by 'assemble', 'submit' and 'watch' from time "
+    "to time to pick them up, which skips datasets whose metadata is unchanged."
+)
+
+def read_watermarks(adapter):
+    """
+    Return the stored sync watermarks as a dict of naive datetimes, in the
+    local time of each database server, keyed by database
+    """
+    watermarks = adapter.read_config(WATERMARK_CONFIG) or {}
+    return {database: datetime.fromisoformat(timestamp)
+            for database, timestamp in watermarks.items()}
+
+def store_watermarks(adapter, watermarks):
+    adapter.store_config(
+        WATERMARK_CONFIG,
+        {database: timestamp.isoformat() for database, timestamp in watermarks.items()},
+    )
+
+def changed_dsids(watermarks):
+    """
+    Query each metadata database for datasets changed after its watermark,
+    a naive datetime in the local time of the database server.
+
+    The current time of each server is read before its change queries run,
+    and becomes the new watermark of that database, so changes made while
+    syncing are picked up by the next sync and timestamps are only ever
+    compared with timestamps from the same clock.
+
+    Returns a tuple of (dsids in sorted order, new watermarks by database).
+    """
+    dsids = set()
+    new_watermarks = {}
+    for database, queries in CHANGE_QUERIES.items():
+        since = watermarks[database]
+        with db_connection(database) as conn:
+            new_watermarks[database] = dbget(conn, "SELECT LOCALTIMESTAMP AS now")['now']
+            for query in queries:
+                sql = query.format(since=since.isoformat(sep=' '), since_date=since.date().isoformat())
+                records = dbmget(conn, sql)
+                dsids.update(records.get('dsid', []))
+    return sorted(dsids), new_watermarks
+
+@click.command(
+    help="Ingest datasets changed since the last sync.\n"
+    "Query the metadata databases for datasets modified since the stored sync "
+    "watermark, and run only those datasets through the extract, assemble, submit "
+    "and watch workflow.  A watermark is kept for each database, taken from the "
+    "database server's clock, and advanced once all ingest tasks complete successfully.  "
+    + SYNC_LIMITATION,
+)
+@click.option(
+    "--since",
+    type=click.DateTime(),
+    default=None,
+    help="Sync datasets changed since this date/time, in the local time of the database "
+    "servers, instead of the stored watermarks.  Required for the first sync, when no "
+    "watermark has been stored.",
+)
+@click.option(
+    "--dry-run",
+    default=False,
+    is_flag=True,
+    help="List the changed datasets without ingesting them or updating the watermark.",
+)
+@click.option(
+    "--force",
+    default=False,
+    is_flag=True,
+    help="Re-ingest changed datasets even if their metadata is unchanged since they were last ingested.",
+)
+@common_options
+@click.pass_context
+@track_run("sync")
+def sync(ctx, since, dry_run, force):
+    adapter = config_storage_adapter()
+
+    if since is None:
+        watermarks = read_watermarks(adapter)
+        missing = [database for database in CHANGE_QUERIES if database not in watermarks]
+        if missing:
+            raise click.UsageError(
+                f"No sync watermark is stored yet for {', '.join(missing)}.  "
+                "Pass '--since' for the first sync."
+            )
+    else:
+        watermarks = dict.fromkeys(CHANGE_QUERIES, since)
+
+    dsids, new_watermarks = changed_dsids(watermarks)
+    for database, timestamp in watermarks.items():
+        logger.info(f"checking {database} for changes since {timestamp.isoformat()}")
+    logger.info(f"{len(dsids)} datasets changed")
+    click.echo(f"{len(dsids)} datasets changed")
+
+    if dry_run:
+        for dsid in dsids:
+            click.echo(dsid)
+        return
+
+    if dsids:
+        shutil.rmtree(EXTRACTED_OUTPUT, ignore_errors=True)
+        shutil.rmtree(ASSEMBLED_OUTPUT, ignore_errors=True)
+
+        rendered_data = extractor.metadata2dict_bulk(dsids)
+        written = extractor.write_metadata(rendered_data, EXTRACTED_OUTPUT, force)
+        count("datasets", len(written))
+        ctx.invoke(assembler.assemble, force=force)
+        batch_id = ctx.invoke(submitter.submit, force=force)
+        results = ctx.invoke(watcher.watch, batch_id=batch_id)
+
+        if any(task["state"] != "SUCCESS" for task in results):
+            logger.warning("sync watermark not advanced, some ingest tasks did not complete successfully")
+            click.echo("sync watermark not advanced, some ingest tasks did not complete successfully")
+            return
+
+    store_watermarks(adapter, new_watermarks)
+    for database, timestamp in new_watermarks.items():
+        logger.info(f"sync watermark of {database} advanced to {timestamp.isoformat()}")
+        click.echo(f"sync watermark of {database} advanced to {timestamp.isoformat()}")
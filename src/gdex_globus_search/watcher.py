@@ -1,62 +1,212 @@
 import os
+import json
 import time
+from datetime import datetime
 
 import click
 
 from .lib import (
     common_options, 
     search_client,
-    TASK_SUBMIT_OUTPUT,
+    config_storage_adapter,
+    configured_index_id,
     TASK_WATCH_OUTPUT,
-    TASK_OUTPUT_FILE,
 )
+from .lib.fingerprint import commit_pending, discard_pending
+from .lib.mirror import commit_pending_documents, discard_pending_documents
+from .lib.ledger import TERMINAL_STATES, update_task, batch_tasks, last_batch, open_tasks
+from .lib.query_cache import invalidate_index
+from .lib.profiling import span, timed
+from .lib.history import count, observe, track_run
 
 import logging
 logger = logging.getLogger(__name__)
 
-def wait(client, task_id, max_wait):
-    waited = 0
-    while True:
-        res = client.get_task(task_id)
-        if res["state"] in ("SUCCESS", "FAILED"):
-            task_info = {
-                "task_id": task_id,
-                "state": res["state"],
-                "index_id": res["index_id"],
-                "creation_date": res["creation_date"],
-                "completion_date": res.get("completion_date", ""),
-                "message": res.get("message", ""),
-                "additional_details": res.get("additional_details", {}),
-            }
-            return task_info
-
-        # wait 1s and check for timeout
-        waited += 1
-        if waited >= max_wait:
-            task_info = {
-                "task_id": task_id,
-                "state": res.get("state", "UNKNOWN"),
-                "index_id": res["index_id"],
-                "creation_date": res["creation_date"],
-                "completion_date": res.get("completion_date", ""),
-                "message": res.get("message", ""),
-                "additional_details": res.get("additional_details", {}),
-            }
-            return task_info
-        time.sleep(1)
+# Default maximum time (in seconds) to wait for all tasks to complete
+MAX_WAIT = 60
 
+# Polling interval (in seconds).  The interval starts at POLL_INTERVAL, is
+# multiplied by POLL_BACKOFF after each round in which no task finished,
+# up to MAX_POLL_INTERVAL, and is reset when a task finishes.
+POLL_INTERVAL = 1.0
+POLL_BACKOFF = 1.5
+MAX_POLL_INTERVAL = 15.0
+
+def task_info(task_id, res):
+    """ Return the task status information reported for a task """
+    return {
+        "task_id": task_id,
+        "state": res.get("state", "UNKNOWN"),
+        "index_id": res["index_id"],
+        "creation_date": res["creation_date"],
+        "completion_date": res.get("completion_date", ""),
+        "message": res.get("message", ""),
+        "additional_details": res.get("additional_details", {}),
+    }
+
+def task_latency(info):
+    """
+    Return the time in seconds from the creation to the completion of a
+    task, as reported by Globus Search, or None if it is not known.
+    """
+    try:
+        created = datetime.fromisoformat(info["creation_date"])
+        completed = datetime.fromisoformat(info["completion_date"])
+    except (TypeError, ValueError):
+        return None
+    return (completed - created).total_seconds()
+
+@timed("watch.poll")
+def poll_tasks(client, task_ids, index_ids):
+    """
+    Return the current status of each task, keyed by task ID.
+
+    The recent task list of each index in index_ids is fetched with one
+    request per index, and only tasks missing from those lists are fetched
+    individually.  The index of each individually fetched task is added to
+    index_ids, so later polls can find it in its index's task list.
+    """
+    wanted = set(task_ids)
+    statuses = {}
+    for index_id in list(index_ids):
+        res = client.get_task_list(index_id)
+        for task in res["tasks"]:
+            if task["task_id"] in wanted:
+                task.setdefault("index_id", index_id)
+                statuses[task["task_id"]] = task
+
+    for task_id in task_ids:
+        if task_id not in statuses:
+            statuses[task_id] = client.get_task(task_id)
+            index_ids.add(statuses[task_id]["index_id"])
+
+    return statuses
+
+def watch_tasks(client, adapter, task_ids, max_wait, delay=None, index_id=None):
+    """
+    Wait for the tasks to complete, showing a progress bar, and return a
+    list of task status dicts in the order of task_ids.
+
+    All outstanding tasks are polled together, and a task is no longer
+    polled once it succeeds or fails.  Tasks still outstanding after
+    max_wait seconds are returned with their last reported state.
+    Task states are read from the task list of index_id (by default the
+    configured index) where possible, see poll_tasks.
+    The state of each task is recorded in the task ledger, the dataset
+    fingerprints of successful ingest tasks are recorded as ingested and
+    their documents added to the local mirror, and
+    cached query results for the index of each completed task are dropped.
+    """
+    task_ids = list(dict.fromkeys(task_ids))
+    results = {}
+    deadline = time.monotonic() + max_wait
+    interval = POLL_INTERVAL
+    outstanding = list(task_ids)
+    index_ids = set()
+    if index_id is None:
+        index_id = configured_index_id()
+    if index_id is not None:
+        index_ids.add(index_id)
+
+    with click.progressbar(length=len(task_ids)) as bar:
+        while outstanding:
+            statuses = poll_tasks(client, outstanding, index_ids)
+            finished = [task_id for task_id in outstanding
+                        if statuses[task_id]["state"] in TERMINAL_STATES]
+            # the write transaction is only taken when there is something to record
+            if finished:
+                with span("watch.record"), adapter.transaction():
+                    for task_id in finished:
+                        results[task_id] = task_info(task_id, statuses[task_id])
+                        update_task(adapter, task_id, results[task_id]["state"], results[task_id]["message"])
+                        # record dataset fingerprints and mirror documents once their
+                        # ingest task has completed
+                        if results[task_id]["state"] == "SUCCESS":
+                            commit_pending(adapter, task_id)
+                            commit_pending_documents(adapter, task_id)
+                            count("tasks_succeeded")
+                        else:
+                            discard_pending(adapter, task_id)
+                            discard_pending_documents(adapter, task_id)
+                            count("failures")
+                        latency = task_latency(results[task_id])
+                        if latency is not None:
+                            observe("task_latency", latency)
+                        bar.update(1)
+                    # cached query results may no longer match the index contents
+                    for changed_index_id in {results[task_id]["index_id"] for task_id in finished}:
+                        invalidate_index(adapter, changed_index_id)
+            outstanding = [task_id for task_id in outstanding if task_id not in results]
+
+            remaining = deadline - time.monotonic()
+            if outstanding and remaining <= 0:
+                logger.warning(f"{len(outstanding)} tasks did not complete within {max_wait}s")
+                for task_id in outstanding:
+                    results[task_id] = task_info(task_id, statuses[task_id])
+                    update_task(adapter, task_id, results[task_id]["state"], results[task_id]["message"])
+                count("tasks_timed_out", len(outstanding))
+                break
+
+            if outstanding:
+                interval = POLL_INTERVAL if finished else min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+                time.sleep(min(interval, remaining))
+            if delay is not None:
+                time.sleep(delay)
+
+    return [results[task_id] for task_id in task_ids]
+
+def report_results(results):
+    """ Print the number of tasks which succeeded or failed """
+    n = len(results)
+    if all(task["state"] == "SUCCESS" for task in results):
+        click.echo(f"All tasks completed successfully ({n}/{n})")
+    else:
+        num_success = len([x for x in results if x["state"] == "SUCCESS"])
+        num_fail = n - num_success
+        click.echo(f"{num_success} tasks completed successfully ({num_success}/{n})")
+        click.echo(f"{num_fail} tasks failed or did not complete ({num_fail}/{n})")
+
+        failed_tasks = [x for x in results if x["state"] != "SUCCESS"]
+        if failed_tasks:
+            click.echo("Failed tasks:")
+            for task in failed_tasks:
+                click.echo(f"  Task ID: {task['task_id']}")
+                click.echo(f"    State: {task['state']}")
+                click.echo(f"    Message: {task['message']}")
+                click.echo(f"    Additional Details: {task['additional_details']}")
+
+def write_results(results, output):
+    """ Write task status information to task_results.json in the output directory """
+    os.makedirs(output, exist_ok=True)
+    output_file = os.path.join(output, "task_results.json")
+    with open(output_file, "w") as fp:
+        json.dump(results, fp, indent=2)
 
 @click.command(
     help="Wait for Globus Search ingest tasks to complete.\n"
-    "Wait for Tasks whose IDs are listed in the ingest task ID file to complete, and "
-    "print information about the number which succeed or fail. If a task takes too "
-    "long, it is treated as a failure.",
+    "Wait for the tasks of the most recently submitted batch to complete, and "
+    "print information about the number which succeed or fail. All tasks are "
+    "polled together, and their states are recorded in the task ledger.  Tasks "
+    "which have not completed within the maximum wait time are treated as failures "
+    "for this run, but stay open in the ledger and can be watched again with '--resume'.",
+)
+@click.option(
+    "--batch-id",
+    default=None,
+    help="Watch the tasks of this batch instead of the most recently submitted batch.",
+)
+@click.option(
+    "--resume",
+    default=False,
+    is_flag=True,
+    help="Watch every task in the ledger not yet known to have succeeded or failed, "
+    "e.g. after an interrupted watch.",
 )
 @click.option(
     "--task-id-file",
-    default=os.path.join(TASK_SUBMIT_OUTPUT, TASK_OUTPUT_FILE),
-    show_default=True,
-    help="Absolute path to the file containing task IDs to watch",
+    default=None,
+    help="Absolute path to a file listing task IDs to watch, one per line, instead of "
+    "tasks from the ledger",
 )
 @click.option(
     "--output",
@@ -67,55 +217,46 @@ def wait(client, task_id, max_wait):
 )
 @click.option(
     "--max-wait",
-    default=10,
+    default=MAX_WAIT,
     show_default=True,
     type=int,
-    help="The maximum amount of time (in seconds) to wait for a task to complete before "
-    "assuming that it is failed.",
+    help="The maximum amount of time (in seconds) to wait for all tasks to complete.",
+)
+@click.option(
+    "--index-id",
+    default=None,
+    help="ID of the search index the tasks were submitted to, used to look up "
+    "task states in batches.  If omitted, the configured index is used.",
 )
-@click.option(  # for easy testing of the progress bar, sleep between tasks
+@click.option(  # for easy testing of the progress bar, sleep between polls
     "--delay", hidden=True, type=float
 )
 @common_options
-def watch(task_id_file, output, max_wait, delay):
+@track_run("watch")
+def watch(batch_id, resume, task_id_file, output, max_wait, index_id, delay):
+    adapter = config_storage_adapter()
     client = search_client()
 
-    task_ids = set()
-    with open(task_id_file) as fp:
-        for line in fp:
-            line = line.strip()
-            if line:  # skip empty
-                task_ids.add(line.strip())
-
-    results = []
-    with click.progressbar(task_ids) as bar:
-        for task_id in bar:
-            task_info = wait(client, task_id, max_wait)
-            results.append(task_info)
-            if delay is not None:
-                time.sleep(delay)
+    if len([x for x in (batch_id, resume, task_id_file) if x]) > 1:
+        raise click.UsageError("Pass only one of '--batch-id', '--resume' or '--task-id-file'")
 
-    n = len(results)
-    if all(task["state"] == "SUCCESS" for task in results):
-        click.echo(f"All tasks completed successfully ({n}/{n})")
+    if task_id_file:
+        task_ids = []
+        with open(task_id_file) as fp:
+            for line in fp:
+                line = line.strip()
+                if line:  # skip empty
+                    task_ids.append(line)
+    elif resume:
+        task_ids = open_tasks(adapter)
     else:
-        num_success = len([x for x in results if x["state"] == "SUCCESS"])
-        num_fail = n - num_success
-        click.echo(f"{num_success} tasks completed successfully ({num_success}/{n})")
-        click.echo(f"{num_fail} tasks failed or did not complete ({num_fail}/{n})")
+        batch_id = batch_id or last_batch(adapter)
+        if batch_id is None:
+            raise click.UsageError("No tasks have been submitted yet")
+        task_ids = batch_tasks(adapter, batch_id)
 
-        failed_tasks = [x for x in results if x["state"] != "SUCCESS"]
-        if failed_tasks:
-            click.echo("Failed tasks:")
-            for task in failed_tasks:
-                click.echo(f"  Task ID: {task['task_id']}")
-                click.echo(f"    State: {task['state']}")
-                click.echo(f"    Message: {task['message']}")
-                click.echo(f"    Additional Details: {task['additional_details']}")
-                
-    # Write results to output file
-    os.makedirs(output, exist_ok=True)
-    output_file = os.path.join(output, "task_results.json")
-    with open(output_file, "w") as fp:
-        import json
-        json.dump(results, fp, indent=2)
\ No newline at end of file
+    results = watch_tasks(client, adapter, task_ids, max_wait, delay, index_id)
+    report_results(results)
+    write_results(results, output)
+
+    return results
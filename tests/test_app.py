@@ -1,4 +1,633 @@
 import pytest
 
+from gdex_globus_search.extractor import group_by_dsid, build_wagtail_metadata
+
 def test_hello():
    pass
+
+def test_group_by_dsid():
+    records = {
+        'dsid': ['d000001', 'd000002', 'd000001'],
+        'keyword': ['a', 'b', 'c'],
+    }
+    grouped = group_by_dsid(records)
+    assert grouped == {
+        'd000001': [{'dsid': 'd000001', 'keyword': 'a'}, {'dsid': 'd000001', 'keyword': 'c'}],
+        'd000002': [{'dsid': 'd000002', 'keyword': 'b'}],
+    }
+    assert group_by_dsid({}) == {}
+
+def test_build_wagtail_metadata_missing_record():
+    assert build_wagtail_metadata({'description': []}) == {'updates': None, 'total_volume': None}
+
+def test_fingerprint_is_stable():
+    from gdex_globus_search.lib.fingerprint import fingerprint
+    a = {'title': 'T', 'tags': ['AI Ready'], 'doi': None}
+    b = {'doi': None, 'tags': ['AI Ready'], 'title': 'T'}
+    assert fingerprint(a) == fingerprint(b)
+    assert fingerprint(a) != fingerprint(dict(a, title='U'))
+
+def test_iter_batches_respects_byte_and_count_limits():
+    import json
+    from gdex_globus_search.assembler import iter_batches
+
+    entries = [{"subject": f"d{i:06d}", "visible_to": ["public"], "content": {"title": "x" * (i * 10)}}
+               for i in range(50)]
+    max_bytes = 2000
+    batches = list(iter_batches(iter(entries), max_bytes=max_bytes, max_size=8))
+
+    assert [e for batch in batches for e in batch] == entries
+    for batch in batches:
+        assert len(batch) <= 8
+        doc = {"ingest_type": "GMetaList", "ingest_data": {"gmeta": batch}}
+        assert len(batch) == 1 or len(json.dumps(doc).encode("utf-8")) <= max_bytes
+
+def test_poll_tasks_falls_back_to_get_task():
+    from gdex_globus_search.watcher import poll_tasks
+
+    class Client:
+        def __init__(self):
+            self.get_task_calls = []
+        def get_task_list(self, index_id):
+            return {"tasks": [{"task_id": "t1", "state": "SUCCESS", "index_id": index_id}]}
+        def get_task(self, task_id):
+            self.get_task_calls.append(task_id)
+            return {"task_id": task_id, "state": "PENDING", "index_id": "other"}
+
+    client = Client()
+    index_ids = {"idx"}
+    statuses = poll_tasks(client, ["t1", "t2"], index_ids)
+    assert statuses["t1"]["state"] == "SUCCESS"
+    assert statuses["t2"]["state"] == "PENDING"
+    assert client.get_task_calls == ["t2"]
+    assert index_ids == {"idx", "other"}
+
+def test_reconcile_index():
+    from gdex_globus_search.lib.fingerprint import fingerprint
+    from gdex_globus_search.reconcile import reconcile_index
+
+    metadata = {'d000001': {'title': 'A'}, 'd000002': {'title': 'B'}, 'd000003': {'title': 'C'}}
+    indexed = {'d000001': fingerprint({'title': 'A'}), 'd000002': fingerprint({'title': 'old'}),
+               'd000004': fingerprint({'title': 'D'})}
+    assert reconcile_index(indexed, metadata) == {
+        'missing': ['d000003'],
+        'orphaned': ['d000004'],
+        'stale': ['d000002'],
+    }
+
+def test_delete_subjects_invalidates_query_cache(tmp_path):
+    from gdex_globus_search.lib.database import SQLiteAdapter
+    from gdex_globus_search.lib.query_cache import read_cached, store_cached
+    from gdex_globus_search.manage_subject import delete_subjects
+
+    class Client:
+        def delete_subject(self, index_id, subject):
+            return {"task_id": f"task-{subject}"}
+
+    adapter = SQLiteAdapter(tmp_path / "store.db")
+    store_cached(adapter, "idx", {"q": "*"}, {"total": 1})
+    task_ids, failed = delete_subjects(Client(), "idx", ["d000001"], adapter)
+    assert task_ids == ["task-d000001"] and failed == []
+    assert read_cached(adapter, "idx", {"q": "*"}) is None
+    adapter.close()
+
+def test_hit_record_projects_fields():
+    from gdex_globus_search.query import hit_record
+
+    result = {"subject": "d000001", "entries": [{"content": {"title": "T", "doi": "x"}}]}
+    assert hit_record(result) == {"subject": "d000001", "content": {"title": "T", "doi": "x"}}
+    assert hit_record(result, ["title", "missing"]) == {"subject": "d000001", "title": "T", "missing": None}
+
+def test_fts_query():
+    from gdex_globus_search.lib.mirror import fts_query
+
+    assert fts_query("*") is None
+    assert fts_query('sea "ice" (daily)') == '"sea" "ice" "daily"'
+    assert fts_query("sea OR ice", advanced=True) == "sea OR ice"
+
+def test_profile_spans():
+    from gdex_globus_search.lib.profiling import span, start_profile, stop_profile, timed
+
+    @timed("stage.step")
+    def step():
+        return 1
+
+    assert step() == 1
+    start_profile()
+    step()
+    step()
+    with span("stage.other"):
+        pass
+    report = stop_profile("stage")
+    assert report["command"] == "stage"
+    assert report["spans"]["stage.step"]["count"] == 2
+    assert report["spans"]["stage.other"]["count"] == 1
+    assert stop_profile() is None
+
+def test_stage_stats_flags_regression():
+    from gdex_globus_search.lib.history import percentile
+    from gdex_globus_search.stats import stage_stats
+
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2, 4], 50) == 2
+    assert percentile(range(1, 101), 95) == 95
+
+    runs = [{"status": "success", "duration": d, "metrics": {"datasets": 100}} for d in (10, 11, 9, 10)]
+    assert stage_stats(runs)["regressions"] == []
+    runs.append({"status": "failed", "duration": 1, "metrics": {}})
+    runs.append({"status": "success", "duration": 30, "metrics": {"datasets": 100}})
+    stats = stage_stats(runs)
+    assert stats["failed"] == 1
+    assert stats["duration_p50"] == 10
+    assert stats["regressions"] == ["duration", "throughput"]
+
+def test_sqlite_adapter_transactions(tmp_path):
+    import os
+    import threading
+    from gdex_globus_search.lib.auth import is_private
+    from gdex_globus_search.lib.database import SQLiteAdapter
+
+    adapter = SQLiteAdapter(tmp_path / "new" / "store.db")
+    assert adapter.connection.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+    assert is_private(adapter.filename)
+    os.chmod(adapter.filename, 0o644)
+    assert not is_private(adapter.filename)
+    wal = SQLiteAdapter(tmp_path / "wal.db", journal_mode="WAL")
+    assert wal.connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    wal.close()
+    # opened without a journal mode, the database keeps the one it has
+    wal = SQLiteAdapter(tmp_path / "wal.db")
+    assert wal.connection.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+    wal.close()
+    with adapter.transaction():
+        adapter.store_config("a", {"n": 1})
+        adapter.store_config("b", {"n": 2})
+    with pytest.raises(RuntimeError):
+        with adapter.transaction():
+            adapter.store_config("c", {"n": 3})
+            raise RuntimeError
+    assert adapter.read_config("b") == {"n": 2}
+    assert adapter.read_config("c") is None
+
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(adapter.connection))
+    thread.start()
+    thread.join()
+    assert connections[0] is not adapter.connection
+    adapter.close()
+
+def test_mirror_pending_documents(tmp_path):
+    from gdex_globus_search.lib.database import SQLiteAdapter
+    from gdex_globus_search.lib.mirror import (
+        record_pending_documents, commit_pending_documents, discard_pending_documents, search_mirror,
+    )
+
+    adapter = SQLiteAdapter(tmp_path / "store.db")
+    record_pending_documents(adapter, "task-1", "idx", [("d000001", {"title": "sea ice"})])
+    record_pending_documents(adapter, "task-2", "idx", [("d000002", {"title": "sea level"})])
+    assert search_mirror(adapter, "idx", "sea")["total"] == 0
+    assert commit_pending_documents(adapter, "task-1") == 1
+    assert discard_pending_documents(adapter, "task-2")
+    assert [hit["subject"] for hit in search_mirror(adapter, "idx", "sea")["gmeta"]] == ["d000001"]
+    assert commit_pending_documents(adapter, "task-2") == 0
+    adapter.close()
+
+def test_sync_watermarks_per_database(tmp_path):
+    from datetime import datetime
+    from gdex_globus_search.lib.database import SQLiteAdapter
+    from gdex_globus_search.sync import read_watermarks, store_watermarks
+
+    adapter = SQLiteAdapter(tmp_path / "store.db")
+    assert read_watermarks(adapter) == {}
+    watermarks = {"dssdb": datetime(2025, 1, 2), "wagtail": datetime(2025, 1, 2, 3, 4, 5, 6)}
+    store_watermarks(adapter, watermarks)
+    assert read_watermarks(adapter) == watermarks
+    adapter.close()
+
+@pytest.mark.parametrize("fmt", ["json", "compact", "ndjson", "json.gz", "compact.gz", "ndjson.gz"])
+def test_formats_round_trip(tmp_path, fmt):
+    from gdex_globus_search.extractor import write_metadata
+    from gdex_globus_search.assembler import flush_batch
+    from gdex_globus_search.lib import all_datafiles, read_records
+
+    metadata = {"d000001": {"dataset_id": "d000001", "title": "T é"}}
+    assert write_metadata(metadata, str(tmp_path / "extracted"), force=True, fmt=fmt) == ["d000001"]
+    records = [r for f in all_datafiles(str(tmp_path / "extracted")) for r in read_records(f)]
+    assert records == [metadata["d000001"]]
+
+    entries = [{"subject": "d000001", "content": {"n": 1}}, {"subject": "d000002", "content": {"n": 2}}]
+    flush_batch(entries[:1], 0, str(tmp_path / "assembled"), fmt)
+    flush_batch(entries[1:], 1, str(tmp_path / "assembled"), fmt)
+    docs = [r for f in all_datafiles(str(tmp_path / "assembled")) for r in read_records(f)]
+    assert [doc["ingest_data"]["gmeta"] for doc in docs] == [entries[:1], entries[1:]]
+
+def test_is_ndjson_checks_suffix():
+    from gdex_globus_search.lib import is_ndjson
+    assert is_ndjson("ndjson.gz") and is_ndjson("/out/batch_0.ndjson") and is_ndjson("b.ndjson.gz")
+    assert not is_ndjson("json") and not is_ndjson("/data.ndjson/batch_0.json")
+
+def test_cli_help_does_not_import_subcommands():
+    import subprocess
+    import sys
+    code = (
+        "import sys\n"
+        "from gdex_globus_search import cli\n"
+        "from gdex_globus_search.main import SUBCOMMANDS\n"
+        "try:\n"
+        "    cli(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "modules = {path.split('.')[0] for path, _ in SUBCOMMANDS.values()}\n"
+        "print(sorted(m for m in modules if 'gdex_globus_search.' + m in sys.modules))\n"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert "delete-subject" in result.stdout
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+
+def test_subcommand_short_help_matches_command():
+    from click.testing import CliRunner
+    from gdex_globus_search.main import SUBCOMMANDS, cli
+    for name, (_, short_help) in SUBCOMMANDS.items():
+        cmd = cli.get_command(None, name)
+        assert cmd.get_short_help_str(limit=200) == short_help, name
+    # with every command loaded, the listing is unchanged
+    assert "Perform a search query." in CliRunner().invoke(cli, ["--help"]).output
+
+# Behaviour tests of the workflow, run against the benchmark stand-ins for
+# the metadata databases and the Globus Search service
+INDEX_ID = "00000000-0000-0000-0000-000000000000"
+
+@pytest.fixture
+def stand_ins(tmp_path, monkeypatch):
+    """
+    Point lib.database and lib.search at a synthetic metadata store, a
+    stand-in SearchClient (replaced by tests through the returned dict) and
+    a new sqlite3 configuration database, as benchmarks.run.install does.
+    """
+    from benchmarks.standins import SyntheticMetadataStore, StandInSearchClient
+    from gdex_globus_search.lib import database, search
+
+    store = SyntheticMetadataStore(str(tmp_path), 20)
+    adapter = database.SQLiteAdapter(tmp_path / "config.db", namespace="DEFAULT")
+    adapter.store_config("index_info", {"index_id": INDEX_ID})
+    database.close_db_connections()
+    monkeypatch.setattr(database.DBConnectionPool, "_connect", lambda pool: store.connect(pool.database))
+    monkeypatch.setattr(database.config_storage_adapter, "_instance", adapter, raising=False)
+    monkeypatch.setattr(search.search_client, "_instance", StandInSearchClient(), raising=False)
+    yield {"store": store, "adapter": adapter, "search": search}
+    database.close_db_connections()
+    adapter.close()
+
+def use_client(stand_ins, client):
+    stand_ins["search"].search_client._instance = client
+    return client
+
+def ingest_docs(subjects):
+    """ Return one ingest document per subject """
+    from gdex_globus_search.assembler import gmeta_list
+    return [gmeta_list([{"subject": s, "visible_to": ["public"], "content": {"dataset_id": s, "title": s}}])
+            for s in subjects]
+
+def scripted_client(**kwargs):
+    """
+    Return a stand-in SearchClient whose ingest requests fail for the
+    subjects in fail_submit, with the latency of each request given by
+    latency, and whose task states are set by tests in ``states``.  The
+    highest number of requests in flight at once is kept in ``max_in_flight``.
+    """
+    import time
+    import globus_sdk
+    from benchmarks.standins import StandInSearchClient
+
+    class ScriptedSearchClient(StandInSearchClient):
+        def __init__(self, fail_submit=(), latency=None):
+            super().__init__()
+            self.fail_submit = set(fail_submit)
+            self.latency = latency or {}
+            self.states = {}
+            self.subjects = {}
+            self.in_flight = self.max_in_flight = 0
+
+        def ingest(self, index_id, data):
+            subject = data["ingest_data"]["gmeta"][0]["subject"]
+            with self._lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                time.sleep(self.latency.get(subject, 0))
+                if subject in self.fail_submit:
+                    raise globus_sdk.NetworkError("connection reset", ConnectionResetError())
+                res = super().ingest(index_id, data)
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+            self.subjects[subject] = res["task_id"]
+            return res
+
+        def _task(self, task_id):
+            task = super()._task(task_id)
+            task["state"] = self.states.get(task_id, "PROGRESS")
+            return task
+
+    return ScriptedSearchClient(**kwargs)
+
+def test_submit_docs_concurrently_in_input_order(stand_ins):
+    from gdex_globus_search.lib.ledger import batch_tasks, new_batch, read_task
+    from gdex_globus_search.submitter import submit_docs
+
+    adapter = stand_ins["adapter"]
+    subjects = [f"d00000{n}" for n in range(8)]
+    # earlier documents take longest, so requests complete out of order
+    client = scripted_client(latency={s: 0.02 * (8 - n) for n, s in enumerate(subjects)})
+    batch_id = new_batch(adapter)
+    task_ids, num_skipped, failed = submit_docs(client, INDEX_ID, ingest_docs(subjects), adapter,
+                                                batch_id, workers=4)
+    assert client.max_in_flight > 1
+    assert (num_skipped, failed) == (0, [])
+    assert task_ids == [client.subjects[s] for s in subjects]
+    assert batch_tasks(adapter, batch_id) == task_ids
+    assert [read_task(adapter, task_id)["dsids"] for task_id in task_ids] == [[s] for s in subjects]
+
+def test_submit_docs_isolates_failed_document(stand_ins, tmp_path):
+    from click.testing import CliRunner
+    from gdex_globus_search.assembler import flush_batch
+    from gdex_globus_search.lib.ledger import batch_tasks, last_batch, read_task
+    from gdex_globus_search.submitter import submit, submit_docs
+
+    adapter = stand_ins["adapter"]
+    subjects = ["d000001", "d000002", "d000003"]
+    client = use_client(stand_ins, scripted_client(fail_submit={"d000002"}))
+    task_ids, num_skipped, failed = submit_docs(client, INDEX_ID, ingest_docs(subjects), adapter)
+    assert task_ids == [client.subjects["d000001"], client.subjects["d000003"]]
+    assert [(n, type(e).__name__) for n, e in failed] == [(2, "NetworkError")]
+    assert [read_task(adapter, task_id)["dsids"] for task_id in task_ids] == [["d000001"], ["d000003"]]
+
+    # the submit command reports the failed document, and records the others
+    directory = tmp_path / "assembled"
+    for docid, doc in enumerate(ingest_docs(["d000004", "d000002"])):
+        flush_batch(doc["ingest_data"]["gmeta"], docid, str(directory))
+    result = CliRunner().invoke(submit, ["--directory", str(directory)])
+    assert result.exit_code == 1
+    assert "ingest document 2 failed: connection reset" in result.output
+    assert "1 of 2 ingest documents failed to submit" in result.output
+    assert batch_tasks(adapter, last_batch(adapter)) == [client.subjects["d000004"]]
+
+class FakeClock:
+    """ Stands in for the time module in watcher, recording each sleep """
+    def __init__(self, on_sleep=None):
+        self.now = 0.0
+        self.sleeps = []
+        self.on_sleep = on_sleep
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+        if self.on_sleep:
+            self.on_sleep(len(self.sleeps))
+
+def test_watch_tasks_backoff_and_deadline(stand_ins, monkeypatch):
+    from gdex_globus_search import watcher
+    from gdex_globus_search.lib.ledger import open_tasks
+    from gdex_globus_search.submitter import submit_docs
+
+    adapter = stand_ins["adapter"]
+    client = scripted_client()
+    task_ids, _, _ = submit_docs(client, INDEX_ID, ingest_docs(["d000001"]), adapter)
+    clock = FakeClock()
+    monkeypatch.setattr(watcher, "time", clock)
+
+    results = watcher.watch_tasks(client, adapter, task_ids, max_wait=100)
+    assert [r["state"] for r in results] == ["PROGRESS"]
+    assert clock.sleeps[:9] == [1.5, 2.25, 3.375, 5.0625, 7.59375, 11.390625, 15.0, 15.0, 15.0]
+    # the last sleep is cut short by the deadline, which ends the watch
+    assert sum(clock.sleeps) == 100 and len(clock.sleeps) == 11
+    assert open_tasks(adapter) == task_ids
+
+def test_watch_tasks_resets_interval_when_a_task_finishes(stand_ins, monkeypatch):
+    from gdex_globus_search import watcher
+    from gdex_globus_search.submitter import submit_docs
+
+    adapter = stand_ins["adapter"]
+    client = scripted_client()
+    task_ids, _, _ = submit_docs(client, INDEX_ID, ingest_docs(["d000001", "d000002"]), adapter)
+
+    def finish(num_sleeps):
+        if num_sleeps == 3:
+            client.states[task_ids[0]] = "SUCCESS"
+        elif num_sleeps == 5:
+            client.states[task_ids[1]] = "SUCCESS"
+
+    clock = FakeClock(finish)
+    monkeypatch.setattr(watcher, "time", clock)
+    results = watcher.watch_tasks(client, adapter, task_ids, max_wait=100)
+    assert [r["state"] for r in results] == ["SUCCESS", "SUCCESS"]
+    assert clock.sleeps == [1.5, 2.25, 3.375, 1.0, 1.5]
+
+def test_watch_tasks_records_outcomes(stand_ins, monkeypatch):
+    from gdex_globus_search import watcher
+    from gdex_globus_search.lib.fingerprint import fingerprint, pending_config_name, read_fingerprint
+    from gdex_globus_search.lib.ledger import open_tasks, read_task
+    from gdex_globus_search.lib.mirror import pending_documents_name, search_mirror
+    from gdex_globus_search.submitter import submit_docs
+
+    adapter = stand_ins["adapter"]
+    client = scripted_client()
+    docs = ingest_docs(["d000001", "d000002"])
+    content = docs[0]["ingest_data"]["gmeta"][0]["content"]
+    task_ids, _, _ = submit_docs(client, INDEX_ID, docs, adapter)
+    client.states = dict(zip(task_ids, ["SUCCESS", "FAILED"]))
+    monkeypatch.setattr(watcher, "time", FakeClock())
+
+    # duplicate task IDs are watched, and reported, once
+    results = watcher.watch_tasks(client, adapter, task_ids + task_ids[:1], max_wait=10)
+    assert [(r["task_id"], r["state"]) for r in results] == list(zip(task_ids, ["SUCCESS", "FAILED"]))
+    assert [read_task(adapter, task_id)["state"] for task_id in task_ids] == ["SUCCESS", "FAILED"]
+    assert open_tasks(adapter) == []
+
+    # the pending fingerprints and documents of the successful task are
+    # committed, and those of the failed task discarded
+    assert read_fingerprint(adapter, INDEX_ID, "d000001") == fingerprint(content)
+    assert read_fingerprint(adapter, INDEX_ID, "d000002") is None
+    for task_id in task_ids:
+        assert adapter.read_config(pending_config_name(task_id)) is None
+        assert adapter.read_config(pending_documents_name(task_id)) is None
+    assert [hit["subject"] for hit in search_mirror(adapter, INDEX_ID, "*")["gmeta"]] == ["d000001"]
+
+def test_ledger_open_and_batch_tasks(tmp_path):
+    from gdex_globus_search.lib.database import SQLiteAdapter
+    from gdex_globus_search.lib.ledger import DELETE, INGEST, batch_tasks, open_tasks, record_task, update_task
+
+    adapter = SQLiteAdapter(tmp_path / "store.db")
+    record_task(adapter, "t1", INGEST, ["d000001"], INDEX_ID, "b1")
+    record_task(adapter, "t2", DELETE, ["d000002"], INDEX_ID, "b1")
+    record_task(adapter, "t3", INGEST, ["d000003"], INDEX_ID, "b2")
+    assert update_task(adapter, "t1", "SUCCESS")
+    assert update_task(adapter, "t3", "PROGRESS")
+    assert not update_task(adapter, "t4", "SUCCESS")
+    assert batch_tasks(adapter, "b1") == ["t1", "t2"]
+    assert open_tasks(adapter) == ["t2", "t3"]
+    assert open_tasks(adapter, kind=INGEST) == ["t3"]
+    adapter.close()
+
+def test_watch_batch_and_resume(stand_ins, tmp_path):
+    from click.testing import CliRunner
+    from gdex_globus_search import watcher
+    from gdex_globus_search.assembler import flush_batch
+    from gdex_globus_search.lib.ledger import batch_tasks, open_tasks
+    from gdex_globus_search.submitter import submit
+
+    adapter = stand_ins["adapter"]
+    client = use_client(stand_ins, scripted_client())
+    runner = CliRunner()
+    batch_ids = []
+    for n, subjects in enumerate((["d000001", "d000002"], ["d000003"])):
+        directory = tmp_path / f"assembled{n}"
+        for docid, doc in enumerate(ingest_docs(subjects)):
+            flush_batch(doc["ingest_data"]["gmeta"], docid, str(directory))
+        result = runner.invoke(submit, ["--directory", str(directory)], standalone_mode=False)
+        batch_ids.append(result.return_value)
+    first, second = (batch_tasks(adapter, batch_id) for batch_id in batch_ids)
+    client.states = dict.fromkeys(first + second, "SUCCESS")
+
+    # the batch passed on by submit is watched, not the most recent batch
+    args = ["--output", str(tmp_path / "task_watch"), "--max-wait", "5"]
+    result = runner.invoke(watcher.watch, args + ["--batch-id", batch_ids[0]], standalone_mode=False)
+    assert [r["task_id"] for r in result.return_value] == first
+    assert open_tasks(adapter) == second
+
+    result = runner.invoke(watcher.watch, args + ["--resume"], standalone_mode=False)
+    assert [r["task_id"] for r in result.return_value] == second
+    assert open_tasks(adapter) == []
+
+def test_search_metadata_query_matches_bulk_extraction(stand_ins):
+    import click
+    from gdex_globus_search.extractor import metadata2dict, metadata2dict_bulk
+
+    store = stand_ins["store"]
+    dsids = store.dsids()
+    bulk = metadata2dict_bulk(dsids)
+    assert list(bulk) == dsids
+    for dsid in dsids:
+        assert metadata2dict(dsid) == bulk[dsid]
+
+    unsupported = sorted(set(store.dsids(supported_only=False)) - set(dsids))
+    assert unsupported and metadata2dict_bulk(unsupported) == {}
+    with pytest.raises(click.Abort):
+        metadata2dict(unsupported[0])
+
+def test_db_connection_pool_reuse_and_close(stand_ins):
+    from gdex_globus_search.lib.database import DBConnectionPool, close_db_connections, db_connection, dbget
+
+    pool = DBConnectionPool("search", max_size=1)
+    with pool.connection() as conn:
+        pass
+    with pool.connection() as reused:
+        assert reused is conn
+    with pool.connection() as first, pool.connection() as second:
+        assert second is not first
+    # only max_size idle connections are kept
+    assert first.closed and not second.closed
+    pool.close()
+    assert second.closed
+    with pool.connection() as conn:
+        assert conn is not second and not conn.closed
+    pool.close()
+
+    with db_connection("search") as conn:
+        assert dbget(conn, "SELECT count(*) AS n FROM datasets") == {"n": 20}
+    with db_connection("search") as reused:
+        assert reused is conn
+    close_db_connections()
+    assert conn.closed
+
+def test_ingest_in_memory(stand_ins, tmp_path, monkeypatch):
+    from click.testing import CliRunner
+    from gdex_globus_search import ingester
+
+    outputs = {name: tmp_path / name for name in ("EXTRACTED_OUTPUT", "ASSEMBLED_OUTPUT", "TASK_WATCH_OUTPUT")}
+    for name, path in outputs.items():
+        monkeypatch.setattr(ingester, name, str(path))
+    client = stand_ins["search"].search_client()
+    dsid = stand_ins["store"].dsids()[0]
+    runner = CliRunner()
+
+    result = runner.invoke(ingester.ingest, ["--dsid", dsid, "--in-memory"])
+    assert result.exit_code == 0, result.output
+    assert "All tasks completed successfully (1/1)" in result.output
+    assert client.calls["ingest"] == 1
+    assert not any(path.exists() for path in outputs.values())
+
+    # the dataset is now unchanged since it was last ingested
+    result = runner.invoke(ingester.ingest, ["--dsid", dsid, "--in-memory"])
+    assert "unchanged since last ingest" in result.output and client.calls["ingest"] == 1
+
+    result = runner.invoke(ingester.ingest, ["--dsid", dsid, "--in-memory", "--keep-artifacts", "--force"])
+    assert result.exit_code == 0, result.output
+    assert client.calls["ingest"] == 2
+    assert all(any(path.iterdir()) for path in outputs.values())
+
+    result = runner.invoke(ingester.ingest, ["--dsid", dsid, "--keep-artifacts"])
+    assert result.exit_code == 2 and "'--keep-artifacts' requires '--in-memory'" in result.output
+
+def indexed_client(subjects):
+    """ Return a stand-in SearchClient whose index holds the given subjects, supporting delete_by_query """
+    from types import SimpleNamespace
+    from benchmarks.standins import StandInSearchClient
+
+    class IndexedSearchClient(StandInSearchClient):
+        def __init__(self):
+            super().__init__()
+            self.calls["delete_by_query"] = 0
+            self.paginated = SimpleNamespace(scroll=self.scroll)
+
+        def scroll(self, index_id, query):
+            return SimpleNamespace(items=lambda: iter({"subject": s, "entries": []} for s in subjects))
+
+        def delete_by_query(self, index_id, query):
+            self._count("delete_by_query")
+            return self._submit(index_id)
+
+    return IndexedSearchClient()
+
+def test_delete_by_query(stand_ins):
+    from gdex_globus_search.lib.fingerprint import read_fingerprint, record_pending, commit_pending
+    from gdex_globus_search.lib.ledger import DELETE, read_task
+    from gdex_globus_search.lib.mirror import mirror_documents, search_mirror
+    from gdex_globus_search.lib.query_cache import read_cached, store_cached
+    from gdex_globus_search.manage_subject import delete_by_query
+
+    adapter = stand_ins["adapter"]
+    subjects = ["d000002", "d000001"]
+    record_pending(adapter, "t0", INDEX_ID, {"d000001": "a", "d000002": "b", "d000003": "c"})
+    commit_pending(adapter, "t0")
+    mirror_documents(adapter, INDEX_ID, [(s, {"title": s}) for s in ("d000001", "d000002", "d000003")])
+    store_cached(adapter, INDEX_ID, {"q": "*"}, {"total": 3})
+
+    client = indexed_client(subjects)
+    task_id, deleted = delete_by_query(client, INDEX_ID, "title:d00000*", adapter)
+    assert deleted == ["d000001", "d000002"] and client.calls["delete_by_query"] == 1
+    task = read_task(adapter, task_id)
+    assert (task["kind"], task["dsids"]) == (DELETE, deleted)
+    assert [read_fingerprint(adapter, INDEX_ID, s) for s in ("d000001", "d000002", "d000003")] == [None, None, "c"]
+    assert [hit["subject"] for hit in search_mirror(adapter, INDEX_ID, "*")["gmeta"]] == ["d000003"]
+    assert read_cached(adapter, INDEX_ID, {"q": "*"}) is None
+
+def test_delete_subject_dry_run(stand_ins):
+    from click.testing import CliRunner
+    from gdex_globus_search.lib.ledger import last_batch, open_tasks
+    from gdex_globus_search.manage_subject import delete_subject
+
+    adapter = stand_ins["adapter"]
+    client = use_client(stand_ins, indexed_client(["d000001", "d000002"]))
+    runner = CliRunner()
+    result = runner.invoke(delete_subject, ["--query", "*", "--dry-run"])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ["d000001", "d000002", "2 subjects would be deleted"]
+
+    result = runner.invoke(delete_subject, ["--dsid", "d000003", "--dry-run"])
+    assert result.output.splitlines() == ["d000003", "1 subjects would be deleted"]
+    assert client.calls["delete_by_query"] == client.calls["delete_subject"] == 0
+    assert last_batch(adapter) is None and open_tasks(adapter) == []